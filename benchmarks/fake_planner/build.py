@@ -0,0 +1,22 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Stand-in for the FS build script. There is nothing to compile; we only mimic the layout of a
+built planner, i.e., the directories that FSCachedRevision removes or archives after the build.
+"""
+
+import os
+import sys
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in ['.build', 'build', 'vendor', 'src', 'submodules']:
+        os.makedirs(os.path.join(here, name), exist_ok=True)
+    with open(os.path.join(here, 'build', 'build-options.txt'), 'w') as f:
+        f.write(' '.join(sys.argv[1:]) + '\n')
+
+
+if __name__ == '__main__':
+    main()
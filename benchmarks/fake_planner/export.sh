@@ -0,0 +1,4 @@
+#!/bin/bash
+# Export revision $1 of this repository into directory $2, as the FS export.sh script does.
+set -e
+git archive --format=tar "$1" | tar -x -C "$2"
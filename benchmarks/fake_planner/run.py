@@ -0,0 +1,107 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Stand-in for the FS planner driver, used to benchmark fslab itself.
+
+It accepts the options that FSRun passes to the planner and writes the same kind of output as
+FS: "[INFO][t]"-stamped log lines (phases, grounding info, simulation info, periodic node generation
+rates) and a results.json file. All numbers are derived deterministically from the problem name and
+the --seed option.
+
+    run.py --domain domain.pddl --instance problem.pddl --output . [--seed N] [--rate-lines N]
+           [--plan-length N] [--cpu-time SECONDS] [--solved-fraction F]
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+import zlib
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--domain', required=True)
+    parser.add_argument('--instance', required=True)
+    parser.add_argument('--output', default='.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rate-lines', type=int, default=200,
+                        help='number of periodic node generation rate lines in the log')
+    parser.add_argument('--plan-length', type=int, default=50,
+                        help='mean plan length, which determines the size of results.json')
+    parser.add_argument('--cpu-time', type=float, default=0.0,
+                        help='CPU time to burn, in seconds, to emulate the search')
+    parser.add_argument('--solved-fraction', type=float, default=0.8)
+    return parser.parse_args()
+
+
+def burn_cpu(seconds):
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        sum(range(1000))
+
+
+def main():
+    args = parse_args()
+    problem = os.path.basename(os.path.realpath(args.instance))
+    rng = random.Random(zlib.crc32('{}:{}'.format(problem, args.seed).encode('utf-8')))
+    clock = 0.0
+
+    def log(message):
+        print('[INFO][{:9.5f}] {}'.format(clock, message))
+
+    log('Loading problem data')
+    for phase, cpu in [('Python parser and preprocessing', rng.uniform(0.1, 2)),
+                       ('Computing reachable groundings...', rng.uniform(0.01, 1))]:
+        clock += cpu
+        log('{}: [{:.2f}s CPU, {:.2f}s wall-clock, diff: {:.2f}MB, {:.2f}MB total]'.format(
+            phase, cpu, cpu * 1.05, rng.uniform(0, 50), rng.uniform(50, 500)))
+
+    num_actions = rng.randint(100, 100000)
+    log('Number of state variables: {}'.format(rng.randint(10, 100000)))
+    print(' Number of action schemata: {}'.format(rng.randint(1, 50)))
+    log('Number of (perhaps partially) ground actions: {}'.format(num_actions))
+    log('Loaded a total of {} reachable ground actions'.format(num_actions))
+    log('Successor Generator: {}'.format(rng.choice(['naive', 'match_tree', 'adaptive'])))
+    log('Mem. usage before match-tree construction: {}kB. / {} kB.'.format(rng.randint(10**4, 10**6), 8 * 10**6))
+    log('Starting IW(1) Simulation')
+    log('Finished IW(1) Simulation. Fraction reached subgoals: {:.2f}'.format(rng.random()))
+    log('Total simulation time: {:.5f}'.format(rng.uniform(0, 5)))
+    log('Mem. usage on start of SBFWS search: {}kB. / {} kB.'.format(rng.randint(10**4, 10**6), 8 * 10**6))
+
+    rate = rng.uniform(1000, 100000)
+    memory = rng.randint(10**4, 10**5)
+    for index in range(1, args.rate_lines + 1):
+        clock += 5000 / rate
+        memory += rng.randint(0, 5000)
+        log('Node generation rate after {}K generations (nodes/sec.): {:.1f}. Memory consumption: {}kB. / {} kB.'.format(
+            5 * index, rate * rng.uniform(0.9, 1.1), memory, 8 * 10**6))
+
+    burn_cpu(args.cpu_time)
+
+    solved = rng.random() < args.solved_fraction
+    generated = args.rate_lines * 5000
+    plan = ['(action-{} o{} o{})'.format(rng.randint(0, 20), rng.randint(0, 99), rng.randint(0, 99))
+            for _ in range(max(1, int(rng.gauss(args.plan_length, args.plan_length / 4))))]
+    results = {
+        'out_of_memory': False,
+        'valid': True,
+        'solved': solved,
+        'memory': memory,
+        'search_time': clock,
+        'time_backend': clock,
+        'plan_length': len(plan) if solved else 0,
+        'expanded': generated // 3,
+        'generated': generated,
+        'evaluated': generated,
+        'plan': plan if solved else [],
+        'gen_per_second': rate,
+    }
+    with open(os.path.join(args.output, 'results.json'), 'w') as f:
+        json.dump(results, f)
+
+
+if __name__ == '__main__':
+    main()
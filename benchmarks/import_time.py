@@ -0,0 +1,126 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the startup cost of the fslab modules that every experiment script and every parser
+invocation imports. Each module is imported --repeat times in a fresh interpreter, and the median
+cumulative import time reported by "python -X importtime" is printed, together with the modules
+that contribute most to it.
+
+With --revision, the modules of the given Git revision of this repository are measured as well,
+so that the cost before and after a change can be compared:
+
+    python benchmarks/import_time.py --revision HEAD~1 --output import-time.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(DIR)
+MODULES = ['fslab.common_setup', 'fslab.experiment', 'fslab.reports', 'fslab.fsparser']
+IMPORTTIME_PATTERN = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def export_revision(revision, path):
+    """ Write the src directory of the given revision to *path* and return its location. """
+    os.makedirs(path)
+    archive = subprocess.Popen(['git', 'archive', revision, 'src'], cwd=REPO, stdout=subprocess.PIPE)
+    subprocess.check_call(['tar', '-x', '-C', path], stdin=archive.stdout)
+    if archive.wait() != 0:
+        sys.exit('Could not export revision {}'.format(revision))
+    return os.path.join(path, 'src')
+
+
+def measure_import(module, src_dir, workdir):
+    """ Import *module* from *src_dir* in a new interpreter and return the "-X importtime" entries. """
+    env = dict(os.environ, PYTHONPATH=src_dir)
+    # The parser module of older revisions parses the current directory when imported, so we run
+    # the import in an empty directory and ignore its exit code.
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    entries = {}
+    for line in process.stderr.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            entries[name] = (int(self_us), int(cumulative_us))
+    return entries
+
+
+def measure(src_dir, modules, repeat, top):
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for module in modules:
+            runs = [measure_import(module, src_dir, workdir) for _ in range(repeat)]
+            runs = [entries for entries in runs if module in entries]
+            if not runs:
+                results[module] = None
+                continue
+            cumulative = statistics.median(entries[module][1] for entries in runs) / 1e6
+            # Rank the top-level packages by their cumulative import time in the first run.
+            top_level = {}
+            for name, (_, cumulative_us) in runs[0].items():
+                package = name.split('.')[0]
+                top_level[package] = max(top_level.get(package, 0), cumulative_us)
+            heaviest = sorted(top_level.items(), key=lambda item: -item[1])[:top]
+            results[module] = {
+                'import_time': cumulative,
+                'heaviest_packages': [[name, us / 1e6] for name, us in heaviest],
+            }
+    return results
+
+
+def print_results(label, results):
+    print(label)
+    for module, result in results.items():
+        if result is None:
+            print('  {:24} failed'.format(module))
+            continue
+        heaviest = ', '.join('{} {:.3f}s'.format(name, seconds) for name, seconds in result['heaviest_packages'])
+        print('  {:24} {:7.3f}s   ({})'.format(module, result['import_time'], heaviest))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modules', nargs='+', default=MODULES)
+    parser.add_argument('--repeat', type=int, default=5, help='imports per module (the median is reported)')
+    parser.add_argument('--top', type=int, default=4, help='number of heaviest packages to show')
+    parser.add_argument('--revision', help='also measure this Git revision of the repository')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'working_tree': measure(os.path.join(REPO, 'src'), args.modules, args.repeat, args.top),
+    }
+    print_results('Working tree', results['working_tree'])
+    if args.revision:
+        tmp_dir = tempfile.mkdtemp(prefix='fslab-import-time-')
+        try:
+            src_dir = export_revision(args.revision, os.path.join(tmp_dir, 'repo'))
+            results['revision'] = args.revision
+            results['revision_results'] = measure(src_dir, args.modules, args.repeat, args.top)
+        finally:
+            shutil.rmtree(tmp_dir)
+        print_results('Revision {}'.format(args.revision), results['revision_results'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
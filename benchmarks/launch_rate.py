@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark how many resource-limited processes per second fslab.call can start. A short command
+is started --launches times with the time and memory limits that a planner run gets, once with
+the limits set by the shell wrapper of fslab.call and once with a preexec_fn that sets them in
+the forked child, as fslab.call used to do. Each method is measured with one launching thread and
+with --threads threads.
+
+The cost of fork grows with the memory of the launching process, which can be inflated with
+--parent-memory to resemble a long-running driver:
+
+    python benchmarks/launch_rate.py --parent-memory 2048 --threads 8 --output launch-rate.json
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(DIR), 'src'))
+
+from fslab.call import get_limit_wrapper  # noqa: E402
+
+
+TIME_LIMIT = 1800  # in seconds
+MEMORY_LIMIT = 8 * 1024  # in MiB
+
+
+def launch_with_preexec_fn(cmd):
+    def prepare_call():
+        resource.setrlimit(resource.RLIMIT_CPU, (TIME_LIMIT, TIME_LIMIT + 5))
+        _, hard_mem_limit = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (MEMORY_LIMIT * 1024 * 1024, hard_mem_limit))
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    return subprocess.Popen(cmd, preexec_fn=prepare_call).wait()
+
+
+def launch_with_wrapper(cmd):
+    return subprocess.Popen(get_limit_wrapper(TIME_LIMIT, MEMORY_LIMIT) + cmd).wait()
+
+
+METHODS = {'preexec_fn': launch_with_preexec_fn, 'wrapper': launch_with_wrapper}
+
+
+def measure(launch, cmd, launches, threads):
+    """ Return the number of launches per second. """
+    start = time.perf_counter()
+    if threads == 1:
+        for _ in range(launches):
+            launch(cmd)
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(lambda _: launch(cmd), range(launches)))
+    return launches / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--launches', type=int, default=500, help='launches per measurement')
+    parser.add_argument('--threads', type=int, default=4, help='number of launching threads')
+    parser.add_argument('--parent-memory', type=int, default=0, metavar='MIB',
+                        help='memory to allocate in the launching process')
+    parser.add_argument('--command', nargs='+', default=['/bin/true'], help='command to launch')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    # Touch every page, so that fork has to copy the page tables.
+    ballast = bytearray(args.parent_memory * 1024 * 1024)
+    for index in range(0, len(ballast), 4096):
+        ballast[index] = 1
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'launches': args.launches,
+        'parent_memory': args.parent_memory,
+        'command': args.command,
+        'launches_per_second': {},
+    }
+    for name, launch in METHODS.items():
+        for threads in sorted({1, args.threads}):
+            rate = measure(launch, args.command, args.launches, threads)
+            results['launches_per_second']['{}-{}'.format(name, threads)] = rate
+            print('{:12} {:2d} thread(s): {:8.1f} launches/s'.format(name, threads, rate))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the overhead of fslab on a whole experiment: build, run (locally), parse again, fetch and
+report for a synthetic suite of N tasks and M algorithms. The planner is replaced by the stand-in
+in benchmarks/fake_planner, which writes realistic logs and results instantly (or after burning
+--cpu-time seconds), so that the measurements are dominated by fslab and lab.
+
+Each stage runs as a separate experiment step process. The wall-clock time, CPU time and peak
+resident set size (of the step process and its children) of each stage are printed and written as
+JSON to --output, for regression tracking.
+
+    python benchmarks/pipeline.py --tasks 200 --algorithms 4 --output pipeline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from fslab.version import __version__
+
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_PLANNER_DIR = os.path.join(DIR, 'fake_planner')
+EXPERIMENT_SCRIPT = os.path.join(DIR, 'pipeline_experiment.py')
+STAGES = ['build', 'start', 'parse-again', 'fetch', 'report']
+
+
+def make_planner_repo(path):
+    """ Create a Git repository with the planner stand-in, as FSCachedRevision expects it. """
+    shutil.copytree(FAKE_PLANNER_DIR, path)
+    git = ['git', '-c', 'user.name=fslab', '-c', 'user.email=fslab@localhost']
+    for cmd in [['init', '-q'], ['add', '.'], ['commit', '-q', '-m', 'Fake planner']]:
+        subprocess.check_call(git + cmd, cwd=path)
+
+
+def make_benchmarks(path, num_tasks, num_domains):
+    """ Write *num_tasks* tasks, spread evenly over *num_domains* domains, and return the domain names. """
+    domains = ['domain{:03d}'.format(index) for index in range(num_domains)]
+    for domain in domains:
+        os.makedirs(os.path.join(path, domain))
+        with open(os.path.join(path, domain, 'domain.pddl'), 'w') as f:
+            f.write('(define (domain {}))\n'.format(domain))
+    for index in range(num_tasks):
+        domain = domains[index % num_domains]
+        with open(os.path.join(path, domain, 'p{:05d}.pddl'.format(index)), 'w') as f:
+            f.write('(define (problem p{:05d}) (:domain {}))\n'.format(index, domain))
+    return domains
+
+
+def run_stage(stage, env, log):
+    """ Run the given experiment step and return its measurements. """
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, EXPERIMENT_SCRIPT, stage], env=env, stdout=log, stderr=log)
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        'stage': stage,
+        'returncode': process.returncode,
+        'wall_time': time.perf_counter() - start,
+        'cpu_time': rusage.ru_utime + rusage.ru_stime,
+        # On Linux, ru_maxrss is given in KiB and covers the largest process of the stage.
+        'peak_rss_kb': rusage.ru_maxrss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, default=100)
+    parser.add_argument('--domains', type=int, default=10)
+    parser.add_argument('--algorithms', type=int, default=2)
+    parser.add_argument('--processes', type=int, default=1, help='number of parallel runs')
+    parser.add_argument('--rate-lines', type=int, default=200, help='node generation rate lines per log')
+    parser.add_argument('--plan-length', type=int, default=50, help='mean plan length in results.json')
+    parser.add_argument('--cpu-time', type=float, default=0.0, help='CPU time of each fake planner run')
+    parser.add_argument('--workdir', help='directory for the experiment (default: temporary directory)')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary directory')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+    # LocalEnvironment refuses to use more processes than CPUs, which would only fail the start stage.
+    cpus = len(os.sched_getaffinity(0))
+    if not 1 <= args.processes <= cpus:
+        parser.error('--processes must be between 1 and the number of available CPUs ({})'.format(cpus))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='fslab-benchmark-')
+    try:
+        make_planner_repo(os.path.join(workdir, 'planner'))
+        domains = make_benchmarks(os.path.join(workdir, 'benchmarks'), args.tasks, args.domains)
+        config = {
+            'exp_dir': os.path.join(workdir, 'exp'),
+            'repo': os.path.join(workdir, 'planner'),
+            'revision_cache': os.path.join(workdir, 'revision-cache'),
+            'benchmarks_dir': os.path.join(workdir, 'benchmarks'),
+            'domains': domains,
+            'algorithms': args.algorithms,
+            'processes': args.processes,
+            'rate_lines': args.rate_lines,
+            'plan_length': args.plan_length,
+            'cpu_time': args.cpu_time,
+        }
+        env = dict(os.environ, FSLAB_BENCHMARK_CONFIG=json.dumps(config))
+
+        stages = []
+        with open(os.path.join(workdir, 'benchmark.log'), 'w') as log:
+            for stage in STAGES:
+                result = run_stage(stage, env, log)
+                stages.append(result)
+                print('{stage:12} {wall_time:8.2f}s wall {cpu_time:8.2f}s CPU {peak_rss_kb:9d} KiB peak'.format(
+                    **result))
+                if result['returncode'] != 0:
+                    sys.exit('Stage {} failed, see {}'.format(stage, log.name))
+
+        results = {
+            'fslab_version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': cpus,
+            'tasks': args.tasks,
+            'domains': args.domains,
+            'algorithms': args.algorithms,
+            'runs': args.tasks * args.algorithms,
+            'processes': args.processes,
+            'rate_lines': args.rate_lines,
+            'plan_length': args.plan_length,
+            'cpu_time': args.cpu_time,
+            'stages': stages,
+        }
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+    finally:
+        if args.keep or args.workdir:
+            print('Experiment files are in {}'.format(workdir))
+        else:
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
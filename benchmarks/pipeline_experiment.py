@@ -0,0 +1,45 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+The lab experiment run by benchmarks/pipeline.py. It is configured through the FSLAB_BENCHMARK_CONFIG
+environment variable (a JSON object) and otherwise used like any other experiment script, i.e., its
+steps are selected on the command line.
+"""
+
+import json
+import os
+
+from lab.environments import LocalEnvironment
+
+import fslab
+from fslab.experiment import FSExperiment
+from fslab.reports import FSAbsoluteReport
+
+
+REPORT_ATTRIBUTES = [
+    'coverage', 'expansions', 'generations', 'memory', 'node_generation_rate', 'plan_length',
+    'search_time', 'time_frontend', 'total_time']
+
+config = json.loads(os.environ['FSLAB_BENCHMARK_CONFIG'])
+
+exp = FSExperiment(
+    path=config['exp_dir'],
+    environment=LocalEnvironment(processes=config['processes']),
+    revision_cache=config['revision_cache'],
+    time_limit=60, memory_limit=2048)
+exp.add_suite(config['benchmarks_dir'], config['domains'])
+for index in range(config['algorithms']):
+    exp.add_algorithm(
+        'algo{:02d}'.format(index), config['repo'], 'HEAD',
+        ['--seed', str(index), '--rate-lines', str(config['rate_lines']),
+         '--plan-length', str(config['plan_length']), '--cpu-time', str(config['cpu_time'])])
+exp.add_parser(os.path.join(os.path.dirname(fslab.__file__), 'fsparser.py'))
+
+exp.add_step('build', exp.build)
+exp.add_step('start', exp.start_runs)
+exp.add_parse_again_step()
+exp.add_fetcher(name='fetch')
+exp.add_report(FSAbsoluteReport(attributes=REPORT_ATTRIBUTES), name='report', outfile='report.html')
+
+exp.run_steps()
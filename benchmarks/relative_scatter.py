@@ -0,0 +1,74 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the data preparation (and optionally the rendering) of RelativeScatterPlotReport on a
+synthetic comparison of two algorithms.
+
+    python benchmarks/relative_scatter.py --tasks 100000 [--render]
+"""
+
+import argparse
+from collections import defaultdict
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from fslab.relativescatter import RelativeScatterPlotReport
+from fslab.reports import get_domain_category
+
+
+def make_problem_runs(num_tasks, num_domains, seed):
+    rng = random.Random(seed)
+    problem_runs = defaultdict(list)
+    for index in range(num_tasks):
+        domain = 'domain{:03d}'.format(index % num_domains)
+        problem = 'p{:06d}.pddl'.format(index)
+        expansions = rng.randint(0, 10**6)
+        ratio = rng.lognormvariate(0, 0.5)
+        for algorithm, value in [('base', expansions), ('new', int(expansions * ratio))]:
+            run = {'algorithm': algorithm, 'domain': domain, 'problem': problem}
+            if rng.random() > 0.05:  # Some tasks lack a value
+                run['expansions'] = value
+            problem_runs[(domain, problem)].append(run)
+    return problem_runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tasks', type=int, default=100000)
+    parser.add_argument('--domains', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--render', action='store_true', help='also render the plot to a PNG file')
+    args = parser.parse_args()
+
+    report = RelativeScatterPlotReport(
+        attributes=['expansions'], filter_algorithm=['base', 'new'], get_category=get_domain_category)
+    report.problem_runs = make_problem_runs(args.tasks, args.domains, args.seed)
+    report.algorithms = ['base', 'new']
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    categories = report._fill_categories()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    num_points = sum(len(x) for x, _ in categories.values())
+    print('Data preparation: {} points in {} categories, {:.3f}s, peak memory {:.1f} MiB'.format(
+        num_points, len(categories), elapsed, peak / 2**20))
+
+    if args.render:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            report.outfile = os.path.join(tmpdir, 'plot.png')
+            report.xlabel, report.ylabel = report.algorithms
+            start = time.perf_counter()
+            report._write_plot(None, report.outfile)
+            print('Rendering: {:.3f}s, {:.1f} KiB'.format(
+                time.perf_counter() - start, os.path.getsize(report.outfile) / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -42,21 +42,28 @@ def main():
             'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
 
             'Programming Language :: Python :: 3',
-            'Programming Language :: Python :: 3.6',
-            'Programming Language :: Python :: 3.7',
+            'Programming Language :: Python :: 3.8',
+            'Programming Language :: Python :: 3.9',
+            'Programming Language :: Python :: 3.10',
+            'Programming Language :: Python :: 3.11',
         ],
 
+        python_requires='>=3.8',
+
         packages=find_packages('src'),  # include all packages under src
         package_dir={'': 'src'},  # tell distutils packages are under src
 
 
         install_requires=[
             'lab>=5.3',
+            'numpy',
         ],
 
         extras_require={
             'dev': ['pytest', 'tox', 'pytest-cov', 'mypy'],
             'test': ['pytest', 'tox', 'pytest-cov', 'mypy'],
+            'parquet': ['pyarrow'],
+            'zstd': ['zstandard'],
         },
 
         # This will include non-code files specified in the manifest, see e.g.
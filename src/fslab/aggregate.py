@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per-(algorithm, domain) aggregate statistics of the numeric attributes of an experiment.
+
+The aggregates (counts, sums and geometric means) are computed in a single streaming pass over
+the runs, reading them in batches from the columnar store if there is one, and keeping only one
+running accumulator per (algorithm, domain, attribute). They are written to the evaluation
+directory, so that reports can show per-domain and per-suite totals without loading the runs.
+
+Note that, unlike the domain summaries of :class:`downward.reports.absolute.AbsoluteReport`,
+the aggregates of an algorithm cover all of its runs that have a value for the attribute, not only
+the tasks for which all algorithms have a value.
+"""
+
+from collections import defaultdict
+from fnmatch import fnmatch
+import json
+import logging
+import math
+import os
+import sys
+
+import numpy as np
+
+from downward.reports import PlanningReport
+from lab import tools
+from lab.reports import Report, Table
+
+from .store import BOOL, FLOAT, INT, SCHEMA_FILENAME, ColumnarStore, get_store_dir, has_store
+
+
+AGGREGATES_FILENAME = 'aggregates.json'
+
+#: Name of the pseudo-domain that holds the aggregates over all domains.
+ALL_DOMAINS = 'all'
+
+DEFAULT_BATCH_SIZE = 65536
+
+_NUMERIC_KINDS = (BOOL, INT, FLOAT)
+
+
+class RunningStatistics(object):
+    """ Running count, sum, extrema and log-sum (for the geometric mean) of a sequence of numbers. """
+    FIELDS = ['count', 'total', 'finite_total', 'log_total', 'nonpositive', 'infinite', 'minimum', 'maximum']
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.log_total = 0.0
+        # Lab's geometric mean is zero as soon as one value is zero.
+        self.nonpositive = 0
+        # Values of sys.maxsize stand for infinity (e.g. heuristic values) and are ignored by finite sums.
+        # Their sum is kept separately, since subtracting them from the total would lose all precision.
+        self.infinite = 0
+        self.finite_total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add_array(self, values):
+        """ Add the values of a float array without NaNs. """
+        if not len(values):
+            return
+        infinite = values >= sys.maxsize
+        positive = values > 0
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.infinite += int(np.count_nonzero(infinite))
+        self.finite_total += float(values[~infinite].sum())
+        self.nonpositive += len(values) - int(np.count_nonzero(positive))
+        self.log_total += float(np.log(values[positive]).sum())
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.log_total += other.log_total
+        self.nonpositive += other.nonpositive
+        self.infinite += other.infinite
+        self.finite_total += other.finite_total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    @property
+    def geometric_mean(self):
+        if not self.count:
+            return None
+        if self.nonpositive:
+            return 0.0
+        return math.exp(self.log_total / self.count)
+
+    def get_value(self, function):
+        """ Return the aggregate that corresponds to the lab aggregation *function*, e.g. ``sum``. """
+        if not self.count:
+            return None
+        name = getattr(function, '__name__', function)
+        if name == 'geometric_mean':
+            return self.geometric_mean
+        if name == 'arithmetic_mean':
+            return self.mean
+        if name == 'finite_sum':
+            return self.finite_total
+        if name == 'min':
+            return self.minimum
+        if name == 'max':
+            return self.maximum
+        return self.total
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for field in cls.FIELDS:
+            setattr(stats, field, data[field])
+        return stats
+
+
+def _to_float_array(values):
+    """ Convert a list of numbers and Nones into a float array with NaN for missing values. """
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+class StreamingAggregator(object):
+    """
+    Accumulate per-(algorithm, domain) statistics of the given numeric *attributes* from batches
+    of runs. Only the accumulators are kept in memory, never the runs themselves.
+    """
+    def __init__(self, attributes):
+        self.attributes = list(attributes)
+        self.stats = defaultdict(RunningStatistics)
+
+    def add_batch(self, columns):
+        """ Add a batch of runs, given as a dictionary mapping attributes to lists of values. """
+        groups = list(zip(columns['algorithm'], columns['domain']))
+        if not groups:
+            return
+        names = sorted(set(groups))
+        code_of = {name: code for code, name in enumerate(names)}
+        codes = np.fromiter((code_of[group] for group in groups), dtype=np.intp, count=len(groups))
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+
+        for attribute in list(self.attributes):
+            values = columns.get(attribute)
+            if values is None:
+                continue
+            try:
+                values = _to_float_array(values)[order]
+            except (TypeError, ValueError):
+                logging.warning('Ignoring non-numeric attribute {} in the aggregates'.format(attribute))
+                self.attributes.remove(attribute)
+                continue
+            for code, (algorithm, domain) in enumerate(names):
+                group_values = values[bounds[code]:bounds[code + 1]]
+                self.stats[(algorithm, domain, attribute)].add_array(group_values[~np.isnan(group_values)])
+
+    def get_results(self):
+        return AggregateStatistics(self.stats)
+
+
+class AggregateStatistics(object):
+    """ The aggregates of an experiment, mapping (algorithm, domain, attribute) to :class:`RunningStatistics`. """
+    def __init__(self, stats, source_mtime=None):
+        self.stats = dict(stats)
+        self.source_mtime = source_mtime
+
+    @property
+    def algorithms(self):
+        return sorted({algorithm for algorithm, _, _ in self.stats})
+
+    @property
+    def domains(self):
+        return sorted({domain for _, domain, _ in self.stats})
+
+    @property
+    def attributes(self):
+        return sorted({attribute for _, _, attribute in self.stats})
+
+    def get(self, algorithm, attribute, domain=ALL_DOMAINS):
+        """ Return the statistics of *attribute* for *algorithm* in *domain* (default: in all domains). """
+        if domain != ALL_DOMAINS:
+            return self.stats.get((algorithm, domain, attribute), RunningStatistics())
+        stats = RunningStatistics()
+        for (algo, _, attr), domain_stats in self.stats.items():
+            if algo == algorithm and attr == attribute:
+                stats.merge(domain_stats)
+        return stats
+
+    def write(self, eval_dir):
+        data = {
+            'source_mtime': self.source_mtime,
+            'aggregates': [dict(algorithm=algorithm, domain=domain, attribute=attribute, **stats.to_dict())
+                           for (algorithm, domain, attribute), stats in sorted(self.stats.items())]}
+        tools.makedirs(eval_dir)
+        tools.write_file(os.path.join(eval_dir, AGGREGATES_FILENAME), json.dumps(data, indent=1))
+
+    @classmethod
+    def load(cls, eval_dir):
+        """ Load the aggregates of *eval_dir*, or return None if they are missing or outdated. """
+        filename = os.path.join(eval_dir, AGGREGATES_FILENAME)
+        if not os.path.exists(filename):
+            return None
+        with open(filename) as f:
+            data = json.load(f)
+        if data['source_mtime'] != _get_source_mtime(eval_dir):
+            return None
+        if any(field not in entry for entry in data['aggregates'] for field in RunningStatistics.FIELDS):
+            # The aggregates were written by an older version.
+            return None
+        stats = {}
+        for entry in data['aggregates']:
+            key = (entry.pop('algorithm'), entry.pop('domain'), entry.pop('attribute'))
+            stats[key] = RunningStatistics.from_dict(entry)
+        return cls(stats, source_mtime=data['source_mtime'])
+
+
+def _get_source_mtime(eval_dir):
+    if has_store(eval_dir):
+        return os.path.getmtime(os.path.join(get_store_dir(eval_dir), SCHEMA_FILENAME))
+    return os.path.getmtime(os.path.join(eval_dir, 'properties'))
+
+
+def _iter_property_batches(eval_dir, attributes, batch_size):
+    props = tools.Properties(filename=os.path.join(eval_dir, 'properties'))
+    runs = list(props.values())
+    for start in range(0, len(runs), batch_size):
+        batch = runs[start:start + batch_size]
+        yield {attr: [run.get(attr) for run in batch] for attr in ['algorithm', 'domain'] + attributes}
+
+
+def compute_aggregates(eval_dir, attributes=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Compute the aggregates of the given *attributes* (default: all numeric attributes) over the
+    runs in *eval_dir* and write them to the evaluation directory.
+
+    With a columnar store, runs are read in batches of *batch_size* runs, so that memory usage does
+    not depend on the number of runs. Otherwise the properties file has to be loaded first.
+    """
+    source_mtime = _get_source_mtime(eval_dir)
+    if has_store(eval_dir):
+        store = ColumnarStore(eval_dir)
+        columns = store.schema['columns']
+        numeric = [attr for attr in store.attributes if columns[attr]['kind'] in _NUMERIC_KINDS]
+        attributes = numeric if attributes is None else [attr for attr in attributes if attr in numeric]
+        batches = store.iter_batches(['algorithm', 'domain'] + attributes, batch_size=batch_size)
+    else:
+        logging.info('No columnar store found, reading the properties file to compute the aggregates')
+        if attributes is None:
+            props = tools.Properties(filename=os.path.join(eval_dir, 'properties'))
+            attributes = sorted({attr for run in props.values() for attr, value in run.items()
+                                 if isinstance(value, (int, float))})
+            del props
+        batches = _iter_property_batches(eval_dir, attributes, batch_size)
+
+    aggregator = StreamingAggregator(attributes)
+    for batch in batches:
+        aggregator.add_batch(batch)
+    results = aggregator.get_results()
+    results.source_mtime = source_mtime
+    results.write(eval_dir)
+    logging.info('Wrote aggregates of {} attributes to {}'.format(
+        len(aggregator.attributes), os.path.join(eval_dir, AGGREGATES_FILENAME)))
+    return results
+
+
+def get_aggregates(eval_dir, attributes=None):
+    """ Return the stored aggregates of *eval_dir*, computing them if they are missing or outdated. """
+    aggregates = AggregateStatistics.load(eval_dir)
+    if aggregates is not None and (attributes is None or set(attributes) <= set(aggregates.attributes)):
+        return aggregates
+    return compute_aggregates(eval_dir)
+
+
+class AggregateReport(Report):
+    """
+    Report the per-domain and overall aggregates of the given attributes for all algorithms,
+    without loading the runs (see :func:`compute_aggregates`). Each attribute is aggregated with
+    its lab aggregation function (sum by default, geometric mean for times and search effort).
+
+    For each pair of algorithms in *algorithm_pairs*, a column with the difference between the
+    aggregates of the second and the first algorithm is added.
+
+    Filters are not supported, since the aggregates are computed in advance.
+    """
+    def __init__(self, algorithm_pairs=None, **kwargs):
+        if 'filter' in kwargs or any(key.startswith('filter_') for key in kwargs):
+            logging.critical('AggregateReport does not support filters.')
+        self.algorithm_pairs = algorithm_pairs or []
+        super().__init__(**kwargs)
+
+    def __call__(self, eval_dir, outfile):
+        self.eval_dir = os.path.abspath(eval_dir)
+        self.outfile = os.path.abspath(outfile)
+        self.aggregates = get_aggregates(self.eval_dir)
+
+        predefined = {str(attr): attr for attr in PlanningReport.PREDEFINED_ATTRIBUTES}
+        patterns = self.attributes or ['*']
+        names = {attr for attr in self.aggregates.attributes if any(fnmatch(attr, p) for p in patterns)}
+        self.attributes = [self._prepare_attribute(predefined.get(name, name)) for name in sorted(names)]
+        self.write()
+
+    def _get_table(self, attribute):
+        function = attribute.function or sum
+        table = Table(title='{} ({})'.format(attribute, getattr(function, '__name__', function)),
+                      min_wins=None if self.algorithm_pairs else attribute.min_wins, digits=attribute.digits)
+        algorithms = self.aggregates.algorithms
+        domains = self.aggregates.domains
+        for domain in domains + [ALL_DOMAINS]:
+            for algorithm in algorithms:
+                value = self.aggregates.get(algorithm, attribute, domain).get_value(function)
+                table.add_cell(domain, algorithm, value)
+            for algo1, algo2 in self.algorithm_pairs:
+                value1 = table[domain].get(algo1)
+                value2 = table[domain].get(algo2)
+                diff = None if value1 is None or value2 is None else value2 - value1
+                table.add_cell(domain, 'Diff ({} - {})'.format(algo2, algo1), diff)
+        table.set_row_order(domains + [ALL_DOMAINS])
+        return table
+
+    def get_markup(self):
+        return '\n'.join(str(self._get_table(attribute)) for attribute in self.attributes)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+"""
+Packing of finished run directories into a few large, indexed archives.
+
+Each run directory is written as a separate compressed tar archive, and these are appended to
+the current shard file (``shard-00000.tar.zst``, ...) of the archive directory ``<exp>/archive``.
+An index records the shard, offset and length of every run, so that a single run can be
+extracted (or parsed again) by (algorithm, domain, problem) without reading anything else.
+
+Since gzip and zstd files may consist of several concatenated streams, a whole shard can also be
+unpacked with standard tools, e.g. ``zstd -dc shard-00000.tar.zst | tar -x --ignore-zeros``.
+"""
+
+from glob import glob
+import gzip
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+from lab import tools
+
+from .compression import EXTENSIONS, GZIP, ZSTD, check_compression, zstandard
+
+
+ARCHIVE_DIRNAME = 'archive'
+INDEX_FILENAME = 'index.json'
+DEFAULT_MAX_SHARD_SIZE = 2 * 1024**3  # in bytes
+
+
+def get_archive_dir(exp_dir):
+    return os.path.join(exp_dir, ARCHIVE_DIRNAME)
+
+
+def has_archive(exp_dir):
+    return os.path.exists(os.path.join(get_archive_dir(exp_dir), INDEX_FILENAME))
+
+
+def is_finished(run_dir):
+    """ A run is finished once the lab driver has written its log and the parsed properties. """
+    return all(os.path.exists(os.path.join(run_dir, name)) for name in ['driver.log', 'properties'])
+
+
+def _compress(data, compression):
+    if compression == GZIP:
+        return gzip.compress(data, compresslevel=6)
+    return zstandard.ZstdCompressor(level=10).compress(data)
+
+
+def _decompress(data, compression):
+    if compression == GZIP:
+        return gzip.decompress(data)
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def _load_properties(fileobj):
+    props = tools.Properties()
+    props.update(json.loads(fileobj.read().decode('utf-8')))
+    return props
+
+
+def _extract_all(tar, dest_dir):
+    """ Extract *tar* into *dest_dir*, refusing members that would end up outside of it. """
+    # The "data" filter would also refuse the absolute symbolic links to the PDDL files.
+    if hasattr(tarfile, 'tar_filter'):
+        tar.extractall(dest_dir, filter='tar')
+        return
+    dest_dir = os.path.realpath(dest_dir)
+    for member in tar.getmembers():
+        path = os.path.realpath(os.path.join(dest_dir, member.name))
+        if os.path.isabs(member.name) or os.path.commonpath([dest_dir, path]) != dest_dir:
+            logging.critical('Refusing to extract {} outside of {}'.format(member.name, dest_dir))
+    tar.extractall(dest_dir)
+
+
+def _pack_run(run_dir, arcname):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        # Symbolic links (e.g. to the PDDL files) are stored as links.
+        tar.add(run_dir, arcname=arcname)
+    return buffer.getvalue()
+
+
+class RunArchive(object):
+    """
+    The archive of the run directories of the experiment in *exp_dir*.
+
+    New runs are compressed with *compression* ("zstd" if the zstandard module is available,
+    "gzip" otherwise). Runs of one archive may use different compression formats.
+    """
+    def __init__(self, exp_dir, compression=None):
+        self.exp_dir = exp_dir
+        self.path = get_archive_dir(exp_dir)
+        self.compression = compression or (ZSTD if zstandard is not None else GZIP)
+        check_compression(self.compression)
+        self.index_file = os.path.join(self.path, INDEX_FILENAME)
+        self.runs = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as f:
+                self.runs = json.load(f)['runs']
+
+    def _write_index(self):
+        tools.makedirs(self.path)
+        tmp_file = self.index_file + '.tmp'
+        tools.write_file(tmp_file, json.dumps({'runs': self.runs}))
+        os.replace(tmp_file, self.index_file)
+
+    def _get_shards(self):
+        return sorted(glob(os.path.join(self.path, 'shard-*')))
+
+    def _open_shard(self, max_shard_size):
+        """ Return the name of the shard to which new runs are appended. """
+        shards = [shard for shard in self._get_shards() if shard.endswith(EXTENSIONS[self.compression])]
+        if shards and os.path.getsize(shards[-1]) < max_shard_size:
+            return shards[-1]
+        return os.path.join(self.path, 'shard-{:05d}.tar{}'.format(
+            len(self._get_shards()), EXTENSIONS[self.compression]))
+
+    def find(self, algorithm, domain, problem, repetition=None):
+        """ Return the ID of the archived run of *algorithm* on the given task, or None. """
+        parts = [algorithm, domain, problem]
+        if repetition is not None:
+            parts.append('rep{}'.format(repetition))
+        run_id = '-'.join(parts)
+        return run_id if run_id in self.runs else None
+
+    def add(self, run_dirs, remove=True, max_shard_size=DEFAULT_MAX_SHARD_SIZE, base_dir=None, replace=False):
+        """
+        Append the given finished run directories to the archive and, if *remove* is True, delete
+        them afterwards. Runs are only deleted once the index that points to them has been written.
+
+        Runs are stored under their path relative to *base_dir* (default: the experiment directory).
+        Archived runs are only replaced silently if *replace* is True.
+        """
+        base_dir = base_dir or self.exp_dir
+        tools.makedirs(self.path)
+        archived = []
+        shard = None
+        out = None
+        try:
+            for run_dir in run_dirs:
+                static_props = tools.Properties(filename=os.path.join(run_dir, 'static-properties'))
+                run_id = '-'.join(static_props['id'])
+                if run_id in self.runs and not replace:
+                    logging.warning('Run {} is archived already, archiving {} again'.format(run_id, run_dir))
+                if out is None or out.tell() >= max_shard_size:
+                    if out is not None:
+                        out.close()
+                    shard = self._open_shard(max_shard_size)
+                    out = open(shard, 'ab')
+                rel_dir = os.path.relpath(run_dir, base_dir)
+                chunk = _compress(_pack_run(run_dir, rel_dir), self.compression)
+                offset = out.tell()
+                out.write(chunk)
+                self.runs[run_id] = {
+                    'shard': os.path.basename(shard), 'offset': offset, 'length': len(chunk),
+                    'compression': self.compression, 'run_dir': rel_dir}
+                archived.append(run_dir)
+        finally:
+            if out is not None:
+                out.close()
+            self._write_index()
+
+        if remove:
+            for run_dir in archived:
+                tools.remove_path(run_dir)
+            for runs_dir in {os.path.dirname(run_dir) for run_dir in archived}:
+                if not os.listdir(runs_dir):
+                    os.rmdir(runs_dir)
+        logging.info('Archived {} runs to {}'.format(len(archived), self.path))
+        return archived
+
+    def read_tar(self, run_id):
+        """ Return an open :class:`tarfile.TarFile` with the directory of the given run. """
+        entry = self.runs[run_id]
+        with open(os.path.join(self.path, entry['shard']), 'rb') as f:
+            f.seek(entry['offset'])
+            chunk = f.read(entry['length'])
+        return tarfile.open(fileobj=io.BytesIO(_decompress(chunk, entry['compression'])))
+
+    def read_properties(self, run_id, filename='properties'):
+        """ Return the given properties file of the run, read from the archive without extracting the run. """
+        with self.read_tar(run_id) as tar:
+            try:
+                member = tar.extractfile('{}/{}'.format(self.runs[run_id]['run_dir'], filename))
+            except KeyError:
+                member = None
+            return tools.Properties() if member is None else _load_properties(member)
+
+    def read_link(self, run_id, filename):
+        """ Return the absolute target of the symbolic link *filename* (e.g. "domain.pddl") of the run. """
+        run_dir = self.runs[run_id]['run_dir']
+        with self.read_tar(run_id) as tar:
+            target = tar.getmember('{}/{}'.format(run_dir, filename)).linkname
+        return os.path.normpath(os.path.join(self.exp_dir, run_dir, target))
+
+    def update_properties(self, run_ids, update):
+        """
+        Call *update* with the ID and the properties of each of the given runs and replace the
+        archived runs by copies with the updated properties.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run_dirs = []
+            for run_id in run_ids:
+                run_dir = self.extract(run_id, tmp_dir)
+                props = tools.Properties(filename=os.path.join(run_dir, 'properties'))
+                update(run_id, props)
+                props.write()
+                run_dirs.append(run_dir)
+            # The runs are appended to the current shard; their old copies become unreachable.
+            self.add(run_dirs, remove=False, base_dir=tmp_dir, replace=True)
+
+    def extract(self, run_id, dest_dir=None):
+        """
+        Extract the directory of the given run below *dest_dir* (default: the experiment directory,
+        i.e., restore it where it was) and return its path.
+        """
+        dest_dir = dest_dir or self.exp_dir
+        with self.read_tar(run_id) as tar:
+            _extract_all(tar, dest_dir)
+        return os.path.join(dest_dir, self.runs[run_id]['run_dir'])
+
+    def fetch(self, run_id):
+        """
+        Return the properties of the given run, read from the archive without extracting the run,
+        with the same checks for unexplained errors as :meth:`lab.fetcher.Fetcher.fetch_dir`.
+        """
+        run_dir = self.runs[run_id]['run_dir']
+        props = tools.Properties()
+        with self.read_tar(run_id) as tar:
+            members = {member.name: member for member in tar.getmembers()}
+
+            def read_member(filename):
+                member = members.get('{}/{}'.format(run_dir, filename))
+                return None if member is None else tar.extractfile(member)
+
+            for filename in ['static-properties', 'properties']:
+                member = read_member(filename)
+                if member is not None:
+                    props.update(_load_properties(member))
+            if '{}/driver.log'.format(run_dir) not in members:
+                props.add_unexplained_error('driver.log is missing. Probably the run was never started.')
+            for filename in ['driver.err', 'run.err']:
+                member = read_member(filename)
+                content = member.read().decode('utf-8', errors='replace') if member is not None else ''
+                if content:
+                    props.add_unexplained_error('{}: {}'.format(filename, content))
+        return props
+
+    def reparse(self, run_id, parsers, update=False):
+        """
+        Run the given parser scripts on a temporary copy of the run directory and return the new
+        properties. If *update* is True, the archived run is replaced by the reparsed one.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run_dir = self.extract(run_id, tmp_dir)
+            for parser in tools.make_list(parsers):
+                subprocess.check_call([sys.executable, os.path.abspath(parser)], cwd=run_dir)
+            props = tools.Properties(filename=os.path.join(run_dir, 'properties'))
+            if update:
+                # The run is appended to the current shard; its old copy becomes unreachable.
+                self.add([run_dir], remove=False, base_dir=tmp_dir, replace=True)
+        return props
+
+
+def archive_runs(exp_dir, compression=None, remove=True, max_shard_size=DEFAULT_MAX_SHARD_SIZE):
+    """ Pack all finished run directories of the experiment in *exp_dir* into its archive. """
+    run_dirs = sorted(glob(os.path.join(exp_dir, 'runs-*-*', '*')))
+    finished = [run_dir for run_dir in run_dirs if is_finished(run_dir)]
+    if len(finished) < len(run_dirs):
+        logging.info('Skipping {} unfinished runs'.format(len(run_dirs) - len(finished)))
+    RunArchive(exp_dir, compression).add(finished, remove=remove, max_shard_size=max_shard_size)
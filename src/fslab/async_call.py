@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""
+An asyncio version of :class:`fslab.call.Call`, with which a single process can supervise many
+concurrent commands (see :mod:`fslab.async_driver`).
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from lab import tools
+
+from .call import get_limit_wrapper, _find_executable
+
+
+CHUNK_SIZE = 64 * 1024
+# Time between SIGTERM and SIGKILL when a command is aborted, in seconds.
+KILL_DELAY = 5
+
+
+def _get_bytes(limit):
+    return None if limit is None else int(limit * 1024)
+
+
+def _get_exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class AsyncCall(object):
+    """
+    Run a command with the time and memory limits of :class:`fslab.call.Call`, and
+
+    - abort it with SIGTERM (and SIGKILL after KILL_DELAY seconds) when it exceeds its wall-clock
+      time limit, which, as for Call, is 1.5 times the time limit, but at least 30 seconds,
+    - copy its output to the *stdout* and *stderr* files (or filenames) while enforcing the soft
+      and hard output limits (in KiB) as lab does (streams without limits are passed to the
+      command directly), and
+    - collect its resource usage (see :attr:`rusage`).
+
+    Messages are written to *log*, a :class:`logging.Logger`, in the same format as Call writes
+    them to the driver log.
+
+    The command is started with :class:`subprocess.Popen`, which does not block since the limits
+    are applied by an exec wrapper, and reaped by us with :func:`os.wait4` to get its resource
+    usage. asyncio's own subprocesses are reaped by its child watcher, which discards it.
+    """
+    def __init__(self, args, name, time_limit=None, memory_limit=None, soft_stdout_limit=None,
+                 hard_stdout_limit=None, soft_stderr_limit=None, hard_stderr_limit=None,
+                 stdout=None, stderr=None, cwd=None, env=None, log=None):
+        self.args = list(args)
+        self.name = name
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.wall_clock_time_limit = None if time_limit is None else max(30, time_limit * 1.5)
+        self.streams = {'stdout': stdout, 'stderr': stderr}
+        self.limits = {'stdout': (_get_bytes(soft_stdout_limit), _get_bytes(hard_stdout_limit)),
+                       'stderr': (_get_bytes(soft_stderr_limit), _get_bytes(hard_stderr_limit))}
+        self.cwd = cwd
+        self.env = env
+        self.log = log
+        self.process = None
+        self.returncode = None
+        self._start_time = None
+        self.wall_clock_time = None
+        #: The resource usage of the command (see :func:`resource.getrusage`), once it finished.
+        self.rusage = None
+
+    def _log(self, level, msg):
+        if self.log is not None:
+            self.log.log(level, msg)
+
+    async def _pump(self, pipe, stream_name, outfile):
+        """ Copy the output of the command from *pipe* to *outfile*, enforcing the output limits. """
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=CHUNK_SIZE)
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        soft_limit, hard_limit = self.limits[stream_name]
+        written = 0
+        try:
+            while True:
+                data = await reader.read(CHUNK_SIZE)
+                if not data:
+                    break
+                if outfile is None:
+                    continue
+                if hard_limit is not None and written + len(data) > hard_limit:
+                    self._log(logging.ERROR, '{} wrote {} KiB (hard limit) to {} -> abort command'.format(
+                        self.name, hard_limit / 1024, outfile.name))
+                    outfile.write(data[:hard_limit - written])
+                    outfile.flush()
+                    outfile = None
+                    self._terminate()
+                    continue
+                outfile.write(data)
+                written += len(data)
+        finally:
+            transport.close()
+        if outfile is not None:
+            outfile.flush()
+            if soft_limit is not None and written > soft_limit:
+                self._log(logging.ERROR, '{} finished and wrote {} KiB to {} (soft limit: {} KiB)'.format(
+                    self.name, written / 1024, outfile.name, soft_limit / 1024))
+
+    def _send_signal(self, signum):
+        # Popen.terminate() and Popen.kill() poll the process and would reap it before we do.
+        # Until we reap it, its PID cannot be reused, even if it has exited already.
+        if self.process is not None and self.returncode is None:
+            try:
+                os.kill(self.process.pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _terminate(self):
+        self._send_signal(signal.SIGTERM)
+
+    async def _wait_for_exit(self):
+        """ Wait until the command terminates, reap it and return its exit status and resource usage. """
+        loop = asyncio.get_running_loop()
+        pid = self.process.pid
+        exited = loop.create_future()
+        pidfd = None
+        if hasattr(os, 'pidfd_open'):
+            try:
+                pidfd = os.pidfd_open(pid)
+            except OSError:
+                pass
+        if pidfd is not None:
+            loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+            try:
+                await exited
+            finally:
+                loop.remove_reader(pidfd)
+                os.close(pidfd)
+            _, status, rusage = os.wait4(pid, 0)
+        else:
+            # Without pidfds (e.g. on older kernels), wait in a thread of our own.
+            def wait():
+                result = os.wait4(pid, 0)
+                loop.call_soon_threadsafe(exited.set_result, result)
+            threading.Thread(target=wait, name='wait-{}'.format(pid), daemon=True).start()
+            _, status, rusage = await exited
+        return status, rusage
+
+    async def _enforce_wall_clock_time_limit(self):
+        await asyncio.sleep(self.wall_clock_time_limit)
+        self._log(logging.ERROR, 'wall-clock time for {} too high: {:.2f} > {} -> abort command'.format(
+            self.name, time.time() - self._start_time, self.wall_clock_time_limit))
+        self._terminate()
+        await asyncio.sleep(KILL_DELAY)
+        self._send_signal(signal.SIGKILL)
+
+    async def run(self):
+        """ Run the command and return its exit code (negative if it was terminated by a signal). """
+        if not _find_executable(self.args[0], self.cwd, self.env):
+            self._log(logging.ERROR, 'Call {} failed. "{}" not found'.format(self.name, self.args[0]))
+            self.returncode = 127
+            return self.returncode
+
+        opened_files = []
+        outfiles = {}
+        for stream_name, stream in self.streams.items():
+            if isinstance(stream, tools.string_type):
+                stream = open(stream, 'ab')
+                opened_files.append(stream)
+            outfiles[stream_name] = stream
+
+        # Streams without output limits are written by the command itself, so that their content
+        # is visible to others (e.g. a parser reading driver.log) while the command runs.
+        pumped = [name for name in ['stdout', 'stderr'] if outfiles[name] is None or self.limits[name] != (None, None)]
+        redirects = {name: subprocess.PIPE if name in pumped else outfiles[name] for name in ['stdout', 'stderr']}
+        for name in redirects:
+            if name not in pumped:
+                outfiles[name].flush()
+
+        self._start_time = time.time()
+        self.process = subprocess.Popen(
+            get_limit_wrapper(self.time_limit, self.memory_limit) + self.args,
+            stdin=subprocess.DEVNULL, cwd=self.cwd, env=self.env, **redirects)
+        pumps = [asyncio.ensure_future(self._pump(getattr(self.process, name), name, outfiles[name]))
+                 for name in pumped]
+        watchdog = None
+        if self.wall_clock_time_limit is not None:
+            watchdog = asyncio.ensure_future(self._enforce_wall_clock_time_limit())
+        try:
+            status, rusage = await self._wait_for_exit()
+        except asyncio.CancelledError:
+            # The driver is shutting down.
+            self._send_signal(signal.SIGKILL)
+            try:
+                os.waitpid(self.process.pid, 0)
+            except ChildProcessError:
+                # The thread that waits for the command (without pidfds) reaped it.
+                pass
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+        self.returncode = self.process.returncode = _get_exit_code(status)
+        await asyncio.gather(*pumps)
+        self.wall_clock_time = time.time() - self._start_time
+        self.rusage = rusage
+        for f in opened_files:
+            f.close()
+
+        self._log(logging.INFO, '{} wall-clock time: {:.2f}s'.format(self.name, self.wall_clock_time))
+        self._log(logging.INFO, '{} CPU time: {:.2f}s, max RSS: {} KiB'.format(
+            self.name, rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss))
+        self._log(logging.INFO, '{} exit code: {}'.format(self.name, self.returncode))
+        return self.returncode
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+"""
+Execute the runs of an experiment concurrently from a single event loop (see
+:class:`fslab.environments.AsyncLocalEnvironment`).
+
+The driver executes the commands of each run (from its ``commands.json``) with
+:class:`~fslab.async_call.AsyncCall`, so that no Python interpreter has to be started for the run
+script of each run, and writes the same driver logs and output files as the run script. At most
+*processes* runs are executed at the same time, and runs are only started while the sum of their
+memory limits fits into the *memory_budget* (in MiB). Runs whose commands need features of the run
+script (log compression, time limit escalation, profiling) execute their run script instead. As
+the run script, the driver ignores the output limits of the commands, unless
+*enforce_output_limits* is True.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+from contextlib import asynccontextmanager
+
+from lab import tools
+from lab.experiment import get_run_dir
+
+from .async_call import AsyncCall
+from .experiment import COMMANDS_FILENAME
+
+
+OUTPUT_LIMIT_KWARGS = {'soft_stdout_limit', 'hard_stdout_limit', 'soft_stderr_limit', 'hard_stderr_limit'}
+CALL_KWARGS = {'time_limit', 'memory_limit'} | OUTPUT_LIMIT_KWARGS
+FORMATTER = logging.Formatter('%(asctime)-s %(levelname)-8s %(message)s')
+
+
+class MemoryBudget(object):
+    """ A semaphore for memory: :meth:`reserve` waits until the requested amount is available. """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.available = capacity
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, amount):
+        # A run that needs more than the whole budget gets all of it.
+        amount = min(amount, self.capacity)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.available >= amount)
+            self.available -= amount
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.available += amount
+                self._condition.notify_all()
+
+
+def _make_run_logger(run_dir):
+    """ Return a logger that writes to the driver.log and driver.err of the run, as the run script would. """
+    # The logger is not registered with the logging module, so that it is freed after the run.
+    logger = logging.Logger(run_dir)
+    for filename, levels in [('driver.log', lambda level: level <= logging.WARNING),
+                             ('driver.err', lambda level: level > logging.WARNING)]:
+        handler = logging.FileHandler(os.path.join(run_dir, filename), mode='a')
+        handler.setFormatter(FORMATTER)
+        handler.addFilter(lambda record, levels=levels: levels(record.levelno))
+        logger.addHandler(handler)
+    return logger
+
+
+def _remove_if_empty(path):
+    if os.path.exists(path) and os.path.getsize(path) == 0:
+        os.remove(path)
+
+
+def _get_call_kwargs(command):
+    # Lab stores the name of the command among its keyword arguments.
+    return {key: value for key, value in command['kwargs'].items() if key != 'name'}
+
+
+def _can_execute_directly(spec):
+    return (not spec['log_compression'] and not spec['escalation'] and
+            all(set(_get_call_kwargs(command)) <= CALL_KWARGS for command in spec['commands']))
+
+
+async def _execute_commands(run_dir, commands, enforce_output_limits):
+    logger = _make_run_logger(run_dir)
+    logger.info('node: {}'.format(platform.node()))
+    with open(os.path.join(run_dir, 'run.log'), 'wb') as run_log, \
+            open(os.path.join(run_dir, 'run.err'), 'wb') as run_err:
+        for command in commands:
+            kwargs = _get_call_kwargs(command)
+            if not enforce_output_limits:
+                # fslab.call.Call, which the run script uses, does not enforce them either.
+                kwargs = {key: value for key, value in kwargs.items() if key not in OUTPUT_LIMIT_KWARGS}
+            call = AsyncCall(command['args'], command['name'], stdout=run_log, stderr=run_err,
+                             cwd=run_dir, log=logger, **kwargs)
+            await call.run()
+    for handler in logger.handlers:
+        handler.close()
+    for name in ['run.log', 'run.err']:
+        _remove_if_empty(os.path.join(run_dir, name))
+
+
+async def execute_run(run_dir, memory_budget, enforce_output_limits=False):
+    """ Execute the run in *run_dir* and return True if it wrote to driver.err (i.e., it failed). """
+    with open(os.path.join(run_dir, COMMANDS_FILENAME)) as f:
+        spec = json.load(f)
+    memory = max(command['kwargs'].get('memory_limit') or 0 for command in spec['commands'])
+    driver_log = os.path.join(run_dir, 'driver.log')
+    driver_err = os.path.join(run_dir, 'driver.err')
+    async with memory_budget.reserve(memory):
+        for path in [driver_log, driver_err]:
+            open(path, 'w').close()
+        if _can_execute_directly(spec):
+            await _execute_commands(run_dir, spec['commands'], enforce_output_limits)
+        else:
+            call = AsyncCall([tools.get_python_executable(), 'run'], 'run', stdout=driver_log,
+                             stderr=driver_err, cwd=run_dir)
+            await call.run()
+    error = os.path.getsize(driver_err) != 0
+    for path in [driver_log, driver_err]:
+        _remove_if_empty(path)
+    return error
+
+
+async def execute_runs(exp_dir, task_order, processes, memory_budget=None, enforce_output_limits=False):
+    """
+    Execute the runs with the ids in *task_order*, in this order, and return the number of runs
+    that failed.
+    """
+    cpus = asyncio.BoundedSemaphore(processes)
+    memory = MemoryBudget(memory_budget if memory_budget is not None else float('inf'))
+    failed = 0
+
+    async def execute(task_id, run_id):
+        nonlocal failed
+        run_dir = os.path.join(exp_dir, get_run_dir(run_id))
+        try:
+            logging.info('Starting run {} (TASK_ID {}) in {}'.format(run_id, task_id, run_dir))
+            failed += await execute_run(run_dir, memory, enforce_output_limits)
+        except Exception as err:
+            logging.error('Run {} failed: {}'.format(run_dir, err))
+            failed += 1
+        finally:
+            cpus.release()
+
+    tasks = set()
+    for task_id, run_id in enumerate(task_order, start=1):
+        # Only create a task for a run once it can start, so that there are at most *processes* tasks.
+        await cpus.acquire()
+        task = asyncio.ensure_future(execute(task_id, run_id))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+    return failed
+
+
+def _raise_open_files_limit():
+    # Each running command needs a few file descriptors for its pipes and output files.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (OSError, ValueError):
+            pass
+
+
+def main(task_order, processes, memory_budget=None, enforce_output_limits=False):
+    tools.configure_logging()
+    # The main script lies in the experiment directory.
+    exp_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
+    _raise_open_files_limit()
+    try:
+        failed = asyncio.run(execute_runs(exp_dir, task_order, processes, memory_budget, enforce_output_limits))
+    except KeyboardInterrupt:
+        logging.warning('Main script interrupted')
+        sys.exit(1)
+    if failed:
+        sys.exit('Error: At least one run failed.')
@@ -15,24 +15,46 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import errno
-import logging
-import resource
+import os
+import shutil
 import subprocess
 import sys
 
 from lab import tools
 from lab.calls.call import Call as Labcall
 
+from .compression import StreamCompressor, get_log_filename
+from .profiling import RssSampler
 
-def set_limit(kind, soft_limit, hard_limit):
-    try:
-        resource.setrlimit(kind, (soft_limit, hard_limit))
-    except (OSError, ValueError) as err:
-        logging.error(
-            "Resource limit for %s could not be set to %s (%s)"
-            % (kind, (soft_limit, hard_limit), err)
-        )
+
+def get_limit_wrapper(time_limit=None, memory_limit=None):
+    """Return the prefix of a command that applies the time limit (in
+    seconds) and the memory limit (in MiB) to it and disables core dumps.
+
+    The limits are set by the ulimit builtin of /bin/sh, which then
+    replaces itself with the command, so the command keeps the PID of
+    the started process. If a limit cannot be set, the shell reports
+    it on stderr and runs the command anyway.
+
+    """
+    limits = ["ulimit -c 0"]
+    if time_limit is not None:
+        # When the soft time limit is reached, SIGXCPU is emitted. Once we
+        # reach the higher hard time limit, SIGKILL is sent. Having some
+        # padding between the two limits allows programs to handle SIGXCPU.
+        # The soft limit is set first, since it may not exceed the hard one.
+        limits.append("ulimit -S -t {}".format(int(time_limit)))
+        limits.append("ulimit -H -t {}".format(int(time_limit) + 5))
+    if memory_limit is not None:
+        # Only the soft limit is lowered (ulimit expects KiB).
+        limits.append("ulimit -S -v {}".format(int(memory_limit * 1024)))
+    return ["/bin/sh", "-c", "; ".join(limits + ['exec "$@"']), "sh"]
+
+
+def _find_executable(path, cwd=None, env=None):
+    if os.sep in path:
+        return os.path.exists(os.path.join(cwd or "", path))
+    return shutil.which(path, path=(env or os.environ).get("PATH")) is not None
 
 
 class Call(Labcall):
@@ -46,6 +68,10 @@ class Call(Labcall):
         hard_stdout_limit=None,
         soft_stderr_limit=None,
         hard_stderr_limit=None,
+        rss_log=None,
+        rss_interval=0.1,
+        stdout_compression=None,
+        stderr_compression=None,
         **kwargs
     ):
         """Make system calls with time and memory constraints.
@@ -56,6 +82,16 @@ class Call(Labcall):
         See also the documentation for
         ``lab.experiment._Buildable.add_command()``.
 
+        If *rss_log* is given, the resident set size of the process
+        (and its children) is sampled every *rss_interval* seconds
+        and written to that file (see ``fslab.profiling``).
+
+        If *stdout_compression* or *stderr_compression* is "gzip" or
+        "zstd", the output to the respective stream is compressed
+        while it is being written (see ``fslab.compression``). Streams
+        given as file objects must then be opened in binary mode;
+        filenames get the extension of the compression format.
+
         """
         assert "stdin" not in kwargs, "redirecting stdin is not supported"
         self.name = name
@@ -71,12 +107,30 @@ class Call(Labcall):
 
         # Allow passing filenames instead of file handles.
         self.opened_files = []
+        # Files written by a compressor must stay open until it finishes.
+        self.compressed_files = []
+        compressions = {"stdout": stdout_compression, "stderr": stderr_compression}
         for stream_name in ["stdout", "stderr"]:
             stream = kwargs.get(stream_name)
+            compression = compressions[stream_name]
             if isinstance(stream, tools.string_type):
-                file = open(stream, mode="w")
+                if compression is None:
+                    file = open(stream, mode="w")
+                    self.opened_files.append(file)
+                else:
+                    file = open(get_log_filename(stream, compression), mode="wb")
+                    self.compressed_files.append(file)
                 kwargs[stream_name] = file
-                self.opened_files.append(file)
+
+        # Let the process write into pipes whose content is compressed into the streams.
+        self.compressors = []
+        for stream_name in ["stdout", "stderr"]:
+            stream = kwargs.get(stream_name)
+            compression = compressions[stream_name]
+            if compression is not None and stream is not None:
+                compressor = StreamCompressor(stream, compression)
+                kwargs[stream_name] = compressor.get_input()
+                self.compressors.append(compressor)
 
         # Allow redirecting and limiting the output to streams.
         self.redirected_streams_and_limits = {}
@@ -93,31 +147,44 @@ class Call(Labcall):
         #         )
         #         kwargs[stream_name] = subprocess.PIPE
 
-        def prepare_call():
-            # When the soft time limit is reached, SIGXCPU is emitted. Once we
-            # reach the higher hard time limit, SIGKILL is sent. Having some
-            # padding between the two limits allows programs to handle SIGXCPU.
-            if time_limit is not None:
-                set_limit(resource.RLIMIT_CPU, time_limit, time_limit + 5)
-            if memory_limit is not None:
-                _, hard_mem_limit = resource.getrlimit(resource.RLIMIT_AS)
-                # Convert memory from MiB to Bytes.
-                set_limit(
-                    resource.RLIMIT_AS, memory_limit * 1024 * 1024, hard_mem_limit
-                )
-            set_limit(resource.RLIMIT_CORE, 0, 0)
-
         try:
-            self.process = subprocess.Popen(args, preexec_fn=prepare_call, **kwargs)
-        except OSError as err:
-            if err.errno == errno.ENOENT:
+            if not _find_executable(args[0], kwargs.get("cwd"), kwargs.get("env")):
                 sys.exit(
                     'Error: Call {name} failed. "{path}" not found'.format(
-                        path=args[0], **locals()
+                        path=args[0], name=name
                     )
                 )
-            else:
-                raise
+            # Without a preexec_fn, subprocess can start the process with
+            # vfork, which is faster and safe to use from several threads.
+            self.process = subprocess.Popen(
+                get_limit_wrapper(time_limit, memory_limit) + list(args), **kwargs
+            )
+        except BaseException:
+            # Do not leak the pipes of the compressors and the opened files.
+            for compressor in self.compressors:
+                compressor.abort()
+            for file in self.opened_files + self.compressed_files:
+                file.close()
+            raise
+
+        for compressor in self.compressors:
+            compressor.close_input()
+            compressor.start()
+
+        self.rss_sampler = None
+        if rss_log is not None:
+            self.rss_sampler = RssSampler(self.process.pid, rss_log, rss_interval)
+            self.rss_sampler.start()
+
+    def wait(self):
+        retcode = super().wait()
+        if self.rss_sampler is not None:
+            self.rss_sampler.stop()
+        for compressor in self.compressors:
+            compressor.finish()
+        for file in self.compressed_files:
+            file.close()
+        return retcode
 
     def _redirect_streams(self):
         return
@@ -9,23 +9,36 @@ from fslab.experiment import FSExperiment
 from lab.experiment import ARGPARSER
 from lab import tools
 
-from downward.reports.absolute import AbsoluteReport
-from downward.reports.compare import ComparativeReport
-from downward.reports.scatter import ScatterPlotReport
+# The report classes (and with them matplotlib) are only imported by the
+# steps that need them, so that importing this module stays cheap.
+
+
+ARGPARSER.add_argument(
+    "--test",
+    choices=["yes", "no", "auto"],
+    default="auto",
+    dest="test_run",
+    help="test experiment locally on a small suite if --test=yes or "
+         "--test=auto and we are not on a cluster")
+
+_ARGS = None
 
 
 def parse_args():
-    ARGPARSER.add_argument(
-        "--test",
-        choices=["yes", "no", "auto"],
-        default="auto",
-        dest="test_run",
-        help="test experiment locally on a small suite if --test=yes or "
-             "--test=auto and we are not on a cluster")
-    return ARGPARSER.parse_args()
+    """Parse the command line arguments the first time they are needed."""
+    global _ARGS
+    if _ARGS is None:
+        _ARGS = ARGPARSER.parse_args()
+    return _ARGS
 
 
-ARGS = parse_args()
+def __getattr__(name):
+    # ARGS used to be parsed at import time. Keep it available for
+    # existing experiment scripts, but only parse the arguments on access.
+    if name == "ARGS":
+        return parse_args()
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
 
 
 DEFAULT_OPTIMAL_SUITE = [
@@ -140,8 +153,9 @@ def is_running_on_cluster():
 
 
 def is_test_run():
-    return ARGS.test_run == "yes" or (
-            ARGS.test_run == "auto" and not is_running_on_cluster())
+    args = parse_args()
+    return args.test_run == "yes" or (
+            args.test_run == "auto" and not is_running_on_cluster())
 
 
 def get_algo_nick(revision, config_nick):
@@ -255,6 +269,18 @@ class FSIssueExperiment(FSExperiment):
 
         self._revisions = revisions
         self._configs = configs
+        self._dataset = None
+
+    def get_dataset(self):
+        """Return the dataset of runs shared by all report steps.
+
+        The runs in the evaluation directory are loaded only once (and
+        lazily, when the first report step needs them) and are then
+        reused by all reports of the experiment."""
+        if self._dataset is None:
+            from fslab.dataset import RunDataset
+            self._dataset = RunDataset(self.eval_dir)
+        return self._dataset
 
     def add_absolute_report_step(self, **kwargs):
         """Add step that makes an absolute report.
@@ -264,15 +290,17 @@ class FSIssueExperiment(FSExperiment):
 
         The report is written to the experiment evaluation directory.
 
-        All *kwargs* will be passed to the AbsoluteReport class. If the
+        All *kwargs* will be passed to the FSAbsoluteReport class. If the
         keyword argument *attributes* is not specified, a default list
         of attributes is used. ::
 
             exp.add_absolute_report_step(attributes=["coverage"])
 
         """
+        from fslab.reports import FSAbsoluteReport
         kwargs.setdefault("attributes", self.DEFAULT_TABLE_ATTRIBUTES)
-        report = AbsoluteReport(**kwargs)
+        kwargs.setdefault("dataset", self.get_dataset())
+        report = FSAbsoluteReport(**kwargs)
         outfile = os.path.join(
             self.eval_dir,
             get_experiment_name() + "." + report.output_format)
@@ -280,7 +308,8 @@ class FSIssueExperiment(FSExperiment):
         # self.add_step(
         #     'publish-absolute-report', subprocess.call, ['publish', outfile])
 
-    def add_comparison_table_step(self, **kwargs):
+    def add_comparison_table_step(self, processes=None, incremental=True,
+                                  **kwargs):
         """Add a step that makes pairwise revision comparisons.
 
         Create comparative reports for all pairs of Fast Downward
@@ -288,7 +317,12 @@ class FSIssueExperiment(FSExperiment):
         lists the two absolute attribute values and their difference
         for all attributes in kwargs["attributes"].
 
-        All *kwargs* will be passed to the CompareConfigsReport class.
+        The reports are made in parallel by *processes* worker
+        processes (default: one per CPU). If *incremental* is True,
+        only the tables whose input data changed since they were last
+        made (e.g. those of a newly added revision) are made again.
+
+        All *kwargs* will be passed to the FSComparativeReport class.
         If the keyword argument *attributes* is not specified, a
         default list of attributes is used. ::
 
@@ -296,8 +330,12 @@ class FSIssueExperiment(FSExperiment):
 
         """
         kwargs.setdefault("attributes", self.DEFAULT_TABLE_ATTRIBUTES)
+        output_format = kwargs.get("format", "html")
 
         def make_comparison_tables():
+            from fslab.reports import (
+                FSComparativeReport, ReportJob, make_reports)
+            jobs = []
             for rev1, rev2 in itertools.combinations(self._revisions, 2):
                 compared_configs = []
                 for config in self._configs:
@@ -306,12 +344,14 @@ class FSIssueExperiment(FSExperiment):
                         ("%s-%s" % (rev1, config_nick),
                          "%s-%s" % (rev2, config_nick),
                          "Diff (%s)" % config_nick))
-                report = ComparativeReport(compared_configs, **kwargs)
                 outfile = os.path.join(
                     self.eval_dir,
                     "%s-%s-%s-compare.%s" % (
-                        self.name, rev1, rev2, report.output_format))
-                report(self.eval_dir, outfile)
+                        self.name, rev1, rev2, output_format))
+                jobs.append(ReportJob(
+                    FSComparativeReport, outfile, compared_configs, **kwargs))
+            make_reports(jobs, self.eval_dir, self.get_dataset(), processes,
+                         incremental)
 
         def publish_comparison_tables():
             for rev1, rev2 in itertools.combinations(self._revisions, 2):
@@ -324,7 +364,89 @@ class FSIssueExperiment(FSExperiment):
         self.add_step(
             "publish-comparison-tables", publish_comparison_tables)
 
-    def add_scatter_plot_step(self, relative=False, attributes=None):
+    def add_phase_report_step(self, **kwargs):
+        """Add a step that compares the cost of the planner phases.
+
+        The report lists the total CPU time, wall-clock time and memory
+        delta of each phase found in the planner logs, with the relative
+        change between each pair of revisions for every config. This
+        shows which phase of the pipeline got slower.
+
+        All *kwargs* will be passed to the FSPhaseReport class. ::
+
+            exp.add_phase_report_step(attributes=["phase_*_cpu"])
+
+        """
+        from fslab.reports import FSPhaseReport
+        kwargs.setdefault("dataset", self.get_dataset())
+        if "algorithm_pairs" not in kwargs:
+            kwargs["algorithm_pairs"] = [
+                (get_algo_nick(rev1, config.nick),
+                 get_algo_nick(rev2, config.nick))
+                for rev1, rev2 in itertools.combinations(self._revisions, 2)
+                for config in self._configs]
+        report = FSPhaseReport(**kwargs)
+        outfile = os.path.join(
+            self.eval_dir,
+            "%s-phases.%s" % (self.name, report.output_format))
+        self.add_report(report, outfile=outfile)
+
+    def add_scaling_report_step(self, **kwargs):
+        """Add a step that reports how the algorithms scale with task size.
+
+        The report bins the tasks by an instance-size feature (by default
+        the number of ground actions) and lists the median search time,
+        memory and node generation rate of each algorithm per bin, with
+        the fitted growth exponents.
+
+        All *kwargs* will be passed to the FSScalingReport class. ::
+
+            exp.add_scaling_report_step(
+                size_attribute="num_state_vars", plot_format="png")
+
+        """
+        from fslab.scaling import FSScalingReport
+        kwargs.setdefault("dataset", self.get_dataset())
+        report = FSScalingReport(**kwargs)
+        outfile = os.path.join(
+            self.eval_dir,
+            "%s-scaling.%s" % (self.name, report.output_format))
+        self.add_report(report, outfile=outfile)
+
+    def add_aggregate_report_step(self, **kwargs):
+        """Add steps that compute and report per-domain aggregates.
+
+        The first step computes the sums and geometric means of all
+        numeric attributes per algorithm and domain in a single
+        streaming pass over the runs and stores them in the evaluation
+        directory. The second step makes an AggregateReport from them,
+        with a difference column for each config and pair of revisions.
+
+        All *kwargs* will be passed to the AggregateReport class. If the
+        keyword argument *attributes* is not specified, a default list
+        of attributes is used. ::
+
+            exp.add_aggregate_report_step(attributes=["coverage"])
+
+        """
+        from fslab.aggregate import AggregateReport, compute_aggregates
+        kwargs.setdefault("attributes", self.DEFAULT_TABLE_ATTRIBUTES)
+        if "algorithm_pairs" not in kwargs:
+            kwargs["algorithm_pairs"] = [
+                (get_algo_nick(rev1, config.nick),
+                 get_algo_nick(rev2, config.nick))
+                for rev1, rev2 in itertools.combinations(self._revisions, 2)
+                for config in self._configs]
+        report = AggregateReport(**kwargs)
+        outfile = os.path.join(
+            self.eval_dir,
+            "%s-aggregates.%s" % (self.name, report.output_format))
+        self.add_step(
+            "compute-aggregates", compute_aggregates, self.eval_dir)
+        self.add_report(report, outfile=outfile)
+
+    def add_scatter_plot_step(self, relative=False, attributes=None,
+                              processes=None, incremental=True, **kwargs):
         """Add step creating (relative) scatter plots for all revision pairs.
 
         Create a scatter plot for each combination of attribute,
@@ -335,6 +457,16 @@ class FSIssueExperiment(FSExperiment):
 
             exp.add_scatter_plot_step(attributes=["expansions"])
 
+        The plots are rendered in parallel by *processes* worker
+        processes (default: one per CPU). If *incremental* is True,
+        only the plots whose input data changed since they were last
+        made are rendered again.
+
+        All *kwargs* will be passed to the scatter plot report class,
+        e.g. to choose how plots with very many points are drawn. ::
+
+            exp.add_scatter_plot_step(large_plot_mode="hexbin")
+
         """
         if relative:
             from .relativescatter import RelativeScatterPlotReport
@@ -342,29 +474,36 @@ class FSIssueExperiment(FSExperiment):
             scatter_dir = os.path.join(self.eval_dir, "scatter-relative")
             step_name = "make-relative-scatter-plots"
         else:
-            report_class = ScatterPlotReport
+            from .scatter import FSScatterPlotReport
+            report_class = FSScatterPlotReport
             scatter_dir = os.path.join(self.eval_dir, "scatter-absolute")
             step_name = "make-absolute-scatter-plots"
         if attributes is None:
             attributes = self.DEFAULT_SCATTER_PLOT_ATTRIBUTES
 
-        def make_scatter_plot(config_nick, rev1, rev2, attribute):
+        def get_scatter_plot_job(config_nick, rev1, rev2, attribute):
+            from fslab.reports import ReportJob, get_domain_category
             name = "-".join([self.name, rev1, rev2, attribute, config_nick])
             print("Make scatter plot for ", name)
             algo1 = get_algo_nick(rev1, config_nick)
             algo2 = get_algo_nick(rev2, config_nick)
-            report = report_class(
+            return ReportJob(
+                report_class,
+                os.path.join(scatter_dir, rev1 + "-" + rev2, name),
                 filter_algorithm=[algo1, algo2],
                 attributes=[attribute],
-                get_category=lambda run1, run2: run1["domain"])
-            report(
-                self.eval_dir,
-                os.path.join(scatter_dir, rev1 + "-" + rev2, name))
+                get_category=get_domain_category,
+                **kwargs)
 
         def make_scatter_plots():
+            from fslab.reports import make_reports
+            jobs = []
             for config in self._configs:
                 for rev1, rev2 in itertools.combinations(self._revisions, 2):
                     for attribute in attributes:
-                        make_scatter_plot(config.nick, rev1, rev2, attribute)
+                        jobs.append(get_scatter_plot_job(
+                            config.nick, rev1, rev2, attribute))
+            make_reports(jobs, self.eval_dir, self.get_dataset(), processes,
+                         incremental)
 
         self.add_step(step_name, make_scatter_plots)
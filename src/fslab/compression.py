@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streaming compression of run logs.
+
+The output of a process can be compressed while it is being written (see the *stdout_compression*
+and *stderr_compression* arguments of :class:`fslab.call.Call`), and compressed logs can be read
+through :func:`open_log`. Since lab's parser only reads plain files, the FS parser decompresses
+the run log for the time of the parsing (see :func:`decompress_log`). Several processes can append to the same compressed
+log, since both gzip and zstd files may consist of several concatenated streams.
+
+gzip is always available; zstd needs the `zstandard` module.
+"""
+
+import gzip
+import io
+import logging
+import os
+import shutil
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+COMPRESSIONS = [GZIP, ZSTD]
+EXTENSIONS = {GZIP: '.gz', ZSTD: '.zst'}
+
+CHUNK_SIZE = 64 * 1024
+
+
+def check_compression(compression):
+    if compression not in COMPRESSIONS:
+        logging.critical('Compression {} not in {}'.format(compression, COMPRESSIONS))
+    if compression == ZSTD and zstandard is None:
+        logging.critical('zstd compression needs the zstandard module.')
+
+
+def get_log_filename(filename, compression):
+    """ Return the name of the file to which the (possibly compressed) log *filename* is written. """
+    return filename if compression is None else filename + EXTENSIONS[compression]
+
+
+def _open_compressor(fileobj, compression):
+    if compression == GZIP:
+        # A moderate compression level keeps up with fast-writing processes.
+        return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=6)
+    return zstandard.ZstdCompressor(level=3).stream_writer(fileobj, closefd=False)
+
+
+class StreamCompressor(threading.Thread):
+    """
+    Compress everything written to the pipe returned by :meth:`get_input` into *fileobj*, a file
+    object opened in binary mode. The compressed stream is complete once :meth:`finish` returns;
+    *fileobj* itself is flushed but not closed.
+    """
+    def __init__(self, fileobj, compression):
+        super().__init__(name='compressor', daemon=True)
+        check_compression(compression)
+        self.fileobj = fileobj
+        self.compression = compression
+        self._read_fd, self._write_fd = os.pipe()
+
+    def get_input(self):
+        return self._write_fd
+
+    def close_input(self):
+        """ Close the parent's copy of the write end of the pipe, after passing it to the child. """
+        if self._write_fd is not None:
+            os.close(self._write_fd)
+            self._write_fd = None
+
+    def run(self):
+        compressor = _open_compressor(self.fileobj, self.compression)
+        with os.fdopen(self._read_fd, 'rb') as pipe:
+            while True:
+                chunk = pipe.read1(CHUNK_SIZE)
+                if not chunk:
+                    break
+                compressor.write(chunk)
+        compressor.close()
+        self.fileobj.flush()
+
+    def finish(self):
+        self.close_input()
+        self.join()
+
+    def abort(self):
+        """ Close both ends of the pipe of a compressor that has not been started. """
+        self.close_input()
+        os.close(self._read_fd)
+
+
+def find_log(filename):
+    """ Return the path of the log *filename* or of its compressed version, or None if neither exists. """
+    for path in [filename] + [filename + ext for ext in EXTENSIONS.values()]:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def open_log(filename):
+    """
+    Open the log *filename* for reading as text. If it does not exist, its compressed version
+    (*filename*.gz or *filename*.zst) is opened instead and decompressed while it is being read.
+    """
+    path = find_log(filename)
+    if path is None:
+        raise FileNotFoundError(2, 'No such file or directory', filename)
+    if path.endswith(EXTENSIONS[GZIP]):
+        return gzip.open(path, 'rt')
+    if path.endswith(EXTENSIONS[ZSTD]):
+        if zstandard is None:
+            logging.critical('Reading {} needs the zstandard module.'.format(path))
+        raw = open(path, 'rb')
+        reader = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(reader)
+    return open(path)
+
+
+def decompress_log(filename):
+    """
+    If only the compressed version of the log *filename* exists, decompress it to *filename* and
+    return True, otherwise return False.
+    """
+    path = find_log(filename)
+    if path is None or path == filename:
+        return False
+    tmp_file = '{}.{}.tmp'.format(filename, os.getpid())
+    with open_log(filename) as src, open(tmp_file, 'w') as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(tmp_file, filename)
+    return True
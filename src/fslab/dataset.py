@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+"""
+An in-memory, indexed dataset of the runs in an evaluation directory, to be shared by all
+the reports of an experiment.
+"""
+
+from collections import defaultdict
+import hashlib
+import json
+import logging
+import os
+
+from lab import tools
+
+from .store import ColumnarStore, SCHEMA_FILENAME, get_store_dir, has_store
+
+
+class RunDataset(object):
+    """
+    The runs of an evaluation directory, indexed by (algorithm, domain, problem) and by algorithm.
+
+    The data is read at most once per attribute: when backed by a columnar store, attributes are
+    loaded lazily the first time some report asks for them; otherwise the whole properties file
+    is read on first use. Reports obtain their (shallow-copied) subset of runs through
+    :meth:`select`, so they can safely modify the runs in their filters.
+    """
+
+    def __init__(self, eval_dir):
+        self.eval_dir = eval_dir
+        self._reset()
+
+    def _reset(self):
+        self._source_mtime = None
+        self._store = None
+        self._runs = {}
+        self._keys = {}
+        self._by_algorithm = defaultdict(list)
+        self._loaded_attributes = set()
+        self._all_loaded = False
+        self._digests = {}
+
+    def _get_source_file(self):
+        if has_store(self.eval_dir):
+            return os.path.join(get_store_dir(self.eval_dir), SCHEMA_FILENAME)
+        return os.path.join(self.eval_dir, 'properties')
+
+    def _check_source(self):
+        """ Make sure the index refers to the current data in the eval dir, e.g. after fetching again. """
+        source = self._get_source_file()
+        if not os.path.exists(source):
+            logging.critical('No properties found in evaluation dir {}'.format(self.eval_dir))
+        mtime = os.path.getmtime(source)
+        if mtime != self._source_mtime:
+            self._reset()
+            self._source_mtime = mtime
+            if has_store(self.eval_dir):
+                self._store = ColumnarStore(self.eval_dir)
+
+    def _index(self, props):
+        for run_id, run in props.items():
+            key = self._keys.get(run_id)
+            if key is None:
+                key = (run['algorithm'], run['domain'], run['problem'])
+                self._keys[run_id] = key
+                self._runs[key] = {}
+                self._by_algorithm[key[0]].append(run_id)
+            self._runs[key].update(run)
+
+    def _load(self, attributes):
+        if self._all_loaded:
+            return
+        if self._store is None:
+            logging.info('Reading properties file into the shared dataset')
+            self._index(tools.Properties(filename=os.path.join(self.eval_dir, 'properties')))
+            self._all_loaded = True
+            return
+
+        if not self._runs:
+            # The index attributes are needed for every run.
+            attributes = set(attributes) | {'id', 'algorithm', 'domain', 'problem'}
+        missing = [attr for attr in attributes if attr not in self._loaded_attributes]
+        if missing:
+            logging.info('Loading {} attributes into the shared dataset'.format(len(missing)))
+            self._index(self._store.load(missing))
+            self._loaded_attributes.update(missing)
+
+    @property
+    def attributes(self):
+        """ All attributes available in the evaluation directory. """
+        self._check_source()
+        if self._store is not None:
+            return self._store.attributes
+        self._load([])
+        return sorted({attr for run in self._runs.values() for attr in run})
+
+    @property
+    def algorithms(self):
+        self._check_source()
+        self._load([])
+        return list(self._by_algorithm.keys())
+
+    def get_run(self, algorithm, domain, problem):
+        return self._runs.get((algorithm, domain, problem))
+
+    def get_digest(self, algorithm, attribute):
+        """ Return a digest of the values of *attribute* in all runs of *algorithm*. """
+        self._check_source()
+        key = (algorithm, attribute)
+        if key not in self._digests:
+            self._load([attribute])
+            run_ids = sorted(self._by_algorithm.get(algorithm, []))
+            values = [[run_id, self._runs[self._keys[run_id]].get(attribute)] for run_id in run_ids]
+            self._digests[key] = hashlib.sha1(json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()
+        return self._digests[key]
+
+    def select(self, algorithms=None, attributes=None):
+        """
+        Return a lab-style {run_id: run} dictionary with copies of the runs of the given *algorithms*
+        (default: all), restricted to the given *attributes* (default: all).
+        """
+        self._check_source()
+        attributes = self.attributes if attributes is None else attributes
+        self._load(attributes)
+
+        if algorithms is None:
+            run_ids = self._keys.keys()
+        else:
+            run_ids = [run_id for algo in algorithms for run_id in self._by_algorithm.get(algo, [])]
+
+        wanted = set(attributes)
+        props = tools.Properties()
+        for run_id in run_ids:
+            run = self._runs[self._keys[run_id]]
+            props[run_id] = {attr: value for attr, value in run.items() if attr in wanted}
+        return props
+
+
+class RunSlice(object):
+    """
+    A fixed set of runs offering the same interface as :class:`RunDataset`.
+
+    Slices are used to ship the part of a dataset that a single report needs to a worker process.
+    """
+
+    def __init__(self, props):
+        self.props = props
+
+    @property
+    def attributes(self):
+        return sorted({attr for run in self.props.values() for attr in run})
+
+    @property
+    def algorithms(self):
+        return sorted({run['algorithm'] for run in self.props.values()})
+
+    def get_digest(self, algorithm, attribute):
+        values = sorted([run_id, run.get(attribute)] for run_id, run in self.props.items()
+                        if run['algorithm'] == algorithm)
+        return hashlib.sha1(json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def select(self, algorithms=None, attributes=None):
+        wanted_algorithms = None if algorithms is None else set(algorithms)
+        wanted = None if attributes is None else set(attributes)
+        props = tools.Properties()
+        for run_id, run in self.props.items():
+            if wanted_algorithms is None or run['algorithm'] in wanted_algorithms:
+                props[run_id] = {attr: value for attr, value in run.items() if wanted is None or attr in wanted}
+        return props
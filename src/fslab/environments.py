@@ -1,7 +1,16 @@
 
 import os
 
-from lab.environments import SlurmEnvironment
+from lab.environments import Environment, LocalEnvironment, SlurmEnvironment
+
+
+ASYNC_JOB_TPL = """#! /usr/bin/env python
+
+from fslab.async_driver import main
+
+main(%(task_order)s, processes=%(processes)d, memory_budget=%(memory_budget)r,
+     enforce_output_limits=%(enforce_output_limits)r)
+"""
 
 
 class UPFSlurmEnvironment(SlurmEnvironment):
@@ -34,6 +43,33 @@ class UPFSlurmEnvironment(SlurmEnvironment):
         super().__init__(**kwargs)
 
 
+class AsyncLocalEnvironment(LocalEnvironment):
+    """
+    Environment for running experiments locally, in which a single process executes up to
+    *processes* runs concurrently (see :mod:`fslab.async_driver`). Unlike with LocalEnvironment,
+    *processes* may exceed the number of CPUs, e.g. for short runs that spend much of their time
+    waiting for the disk. If *memory_budget* (in MiB) is given, runs are only started while the
+    sum of the memory limits of the running runs fits into it.
+
+    Like the run scripts of the other environments (see :class:`fslab.call.Call`), the driver
+    ignores the output limits of the commands, unless *enforce_output_limits* is True, in which
+    case commands that exceed their hard output limit are aborted as in lab.
+    """
+    def __init__(self, processes=None, memory_budget=None, enforce_output_limits=False, **kwargs):
+        Environment.__init__(self, **kwargs)
+        self.processes = processes or os.cpu_count()
+        if self.processes < 1:
+            raise ValueError('processes must be positive.')
+        self.memory_budget = memory_budget
+        self.enforce_output_limits = enforce_output_limits
+
+    def write_main_script(self):
+        script = ASYNC_JOB_TPL % dict(
+            task_order=self._get_task_order(), processes=self.processes, memory_budget=self.memory_budget,
+            enforce_output_limits=self.enforce_output_limits)
+        self.exp.add_new_file('', self.EXP_RUN_SCRIPT, script, permissions=0o755)
+
+
 # A hack to force the sourcing of the virtual environment the script has been invoked from
 # upon execution of the SBATCH script
 venv = os.getenv('VIRTUAL_ENV', None)
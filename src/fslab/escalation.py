@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+"""
+Multi-round scheduling with escalating time limits.
+
+With ``initial_time_limit`` (see :class:`~fslab.experiment.FSExperiment`), every run first gets
+the short initial time limit. After each round, the escalation step (see
+:meth:`~fslab.experiment.FSExperiment.add_escalation_steps`) looks for runs that timed out, i.e.,
+that did not solve the task and were killed by the CPU time limit or used up their time. Their
+output is moved into the subdirectory ``round-<N>`` of the run directory and they are marked for
+the next round, in which they get a time limit that is *factor* times larger, up to
+``time_limit``. The next start step then executes all runs again, but runs that are not marked
+return immediately (replaying their driver log), so that this works with any lab environment.
+
+The run script keeps the state of the run in ``time-limit-escalation.json``, from which the parser
+sets the attributes
+
+- ``time_limit``: the time limit of the final round of the run,
+- ``escalation_round``: the number of the final round (starting at 0),
+- ``escalation_time_limits``: the time limits of all rounds of the run, and
+- ``escalation_wasted_time``: the planner wall-clock time spent in the previous rounds.
+
+All other attributes are those of the final round, in which the planner ran from scratch, so that
+e.g. ``search_time`` is not affected by the earlier rounds.
+"""
+
+import json
+import logging
+import os
+import re
+import shutil
+import signal
+import sys
+from glob import glob
+
+from lab import tools
+
+
+STATE_FILENAME = 'time-limit-escalation.json'
+ROUND_DIR_PREFIX = 'round-'
+SAVED_LOG_SUFFIX = '.saved'
+
+# Files of the run directory that are not output of a round.
+KEPT_FILES = ['run', 'static-properties', 'domain.pddl', 'problem.pddl', STATE_FILENAME]
+DRIVER_LOGS = ['driver.log', 'driver.err']
+
+# Exit codes of the planner when it is killed because it exceeded the CPU time limit
+# (SIGXCPU at the soft limit, SIGKILL at the hard limit), possibly reported by a shell.
+TIMEOUT_EXIT_CODES = {-signal.SIGXCPU, -signal.SIGKILL, 128 + signal.SIGXCPU, 128 + signal.SIGKILL}
+
+WALL_CLOCK_PATTERN = re.compile(r'planner wall-clock time: (\d+(?:\.\d+)?)s')
+EXIT_CODE_PATTERN = re.compile(r'planner exit code: (-?\d+)')
+
+
+def get_time_limits(initial_time_limit, time_limit, factor):
+    """ Return the time limits of the rounds, e.g. [60, 300, 1500, 1800] for (60, 1800, 5). """
+    if initial_time_limit <= 0 or factor <= 1:
+        logging.critical('The initial time limit must be positive and the factor greater than 1.')
+    limits = []
+    limit = initial_time_limit
+    while limit < time_limit:
+        limits.append(limit)
+        limit *= factor
+    return limits + [time_limit]
+
+
+def read_state(run_dir='.'):
+    state_file = os.path.join(run_dir, STATE_FILENAME)
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def write_state(state, run_dir='.'):
+    tools.write_file(os.path.join(run_dir, STATE_FILENAME), json.dumps(state))
+
+
+def _replay_driver_logs(run_dir='.'):
+    # The job that executes the run has just truncated driver.log and driver.err, so we write
+    # their contents from the round in which the run finished (saved by the escalation step) to
+    # our stdout and stderr.
+    for name, stream in zip(DRIVER_LOGS, [sys.stdout, sys.stderr]):
+        saved = os.path.join(run_dir, name + SAVED_LOG_SUFFIX)
+        if os.path.exists(saved):
+            with open(saved) as f:
+                stream.write(f.read())
+            stream.flush()
+
+
+def start_round(time_limits):
+    """
+    Called by the run script: return the time limit of the run in the current round, or None if
+    the run finished in a previous round and is not marked for the current one. Runs that were
+    not checked by the escalation step since their last round are executed again with the same
+    time limit, as they would be without escalation.
+    """
+    state = read_state()
+    if state is None:
+        state = {'round': 0, 'time_limit': time_limits[0], 'rounds': [], 'pending': True}
+    if not state['pending'] and os.path.exists('driver.log' + SAVED_LOG_SUFFIX):
+        _replay_driver_logs()
+        return None
+    state['pending'] = False
+    write_state(state)
+    return state['time_limit']
+
+
+def read_driver_log(run_dir):
+    """ Return the planner wall-clock time and exit code logged in the driver.log of *run_dir*. """
+    wall_clock_time = exit_code = None
+    try:
+        with open(os.path.join(run_dir, 'driver.log')) as f:
+            content = f.read()
+    except FileNotFoundError:
+        return wall_clock_time, exit_code
+    match = WALL_CLOCK_PATTERN.search(content)
+    if match:
+        wall_clock_time = float(match.group(1))
+    match = EXIT_CODE_PATTERN.search(content)
+    if match:
+        exit_code = int(match.group(1))
+    return wall_clock_time, exit_code
+
+
+def is_timeout(props, time_limit, wall_clock_time, exit_code):
+    if props.get('coverage') or props.get('out_of_memory'):
+        return False
+    return exit_code in TIMEOUT_EXIT_CODES or (wall_clock_time is not None and wall_clock_time >= time_limit)
+
+
+def _move_round_output(run_dir, round_dir):
+    os.mkdir(round_dir)
+    for name in os.listdir(run_dir):
+        if name not in KEPT_FILES and not name.startswith(ROUND_DIR_PREFIX):
+            os.rename(os.path.join(run_dir, name), os.path.join(round_dir, name))
+
+
+def escalate_run(run_dir, time_limits):
+    """
+    Mark the run in *run_dir* for the next round if it timed out in its last round and a larger
+    time limit is left. Return True if the run was marked.
+    """
+    state = read_state(run_dir)
+    properties_file = os.path.join(run_dir, 'properties')
+    if state is None or state['pending'] or not os.path.exists(properties_file):
+        # The run was not executed yet, or did not finish.
+        return False
+    wall_clock_time, exit_code = read_driver_log(run_dir)
+    larger_limits = [limit for limit in time_limits if limit > state['time_limit']]
+    with open(properties_file) as f:
+        props = json.load(f)
+    if not larger_limits or not is_timeout(props, state['time_limit'], wall_clock_time, exit_code):
+        for name in DRIVER_LOGS:
+            path = os.path.join(run_dir, name)
+            if os.path.exists(path):
+                shutil.copyfile(path, path + SAVED_LOG_SUFFIX)
+        return False
+
+    _move_round_output(run_dir, os.path.join(run_dir, '{}{}'.format(ROUND_DIR_PREFIX, state['round'])))
+    state['rounds'].append({
+        'time_limit': state['time_limit'], 'planner_wall_clock_time': wall_clock_time, 'exit_code': exit_code})
+    state.update(round=state['round'] + 1, time_limit=larger_limits[0], pending=True)
+    write_state(state, run_dir)
+    return True
+
+
+def escalate_time_limits(exp_dir, time_limits):
+    """ Mark all runs of the experiment that timed out for the next round (see :func:`escalate_run`). """
+    run_dirs = sorted(glob(os.path.join(exp_dir, 'runs-*-*', '*')))
+    escalated = 0
+    for index, run_dir in enumerate(run_dirs, start=1):
+        loglevel = logging.INFO if index % 1000 == 0 else logging.DEBUG
+        logging.log(loglevel, 'Checking run: {:6d}/{:d}'.format(index, len(run_dirs)))
+        escalated += escalate_run(run_dir, time_limits)
+    logging.info('{} of {} runs timed out and get a larger time limit in the next round.'.format(
+        escalated, len(run_dirs)))
+
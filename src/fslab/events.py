@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per-event records of the SDD construction and the IW simulation of the planner.
+
+The parser (see :mod:`fslab.fsparser`) extracts one record for each SDD that the planner builds
+and for each IW(k) simulation it runs, and stores them as compact tables (lists of rows) in the
+properties of the run:
+
+- ``sdd_events``: one row per SDD with the columns of :data:`SDD_EVENT_COLUMNS`. The duration is
+  the time between the "Building SDD" message and the "SDD minimization" message that follows it.
+- ``simulation_events``: one row per simulation with the columns of
+  :data:`SIMULATION_EVENT_COLUMNS`. The duration is the time between the "Starting IW(k)
+  Simulation" and "Finished IW(k) Simulation" messages.
+
+Values that are not in the log (e.g. the timestamps of logs without them, or the fraction of
+reached subgoals of a simulation that did not finish) are None. The aggregate attributes of the
+run (``sdd_sizes``, ``sim_iw1_successful``, ...) are derived from these tables.
+
+:func:`load_events` reads the events of all runs of an evaluation directory into a single table
+of numpy columns, e.g. to find out where the simulation time goes across many runs::
+
+    events = load_events('exp-eval', 'simulation_events')
+    iw2 = events['width'] == 2
+    print(np.nansum(events['duration'][iw2]), 'seconds in IW(2) simulations')
+"""
+
+import os
+import re
+
+from lab import tools
+
+
+SDD_EVENTS = 'sdd_events'
+SIMULATION_EVENTS = 'simulation_events'
+
+SDD_EVENT_COLUMNS = ['timestamp', 'duration', 'vars', 'constraints', 'nodes_before', 'nodes_after']
+SIMULATION_EVENT_COLUMNS = ['width', 'timestamp', 'duration', 'reached_subgoals', 'reached_all_goals']
+
+EVENT_COLUMNS = {SDD_EVENTS: SDD_EVENT_COLUMNS, SIMULATION_EVENTS: SIMULATION_EVENT_COLUMNS}
+
+# [INFO][ 0.21237] Building SDD for 8 variables and 11 constraints
+# [INFO][ 0.23011] SDD minimization: 132 -> 101 nodes (30% reduction)
+# [INFO][ 1.50000] Starting IW(1) Simulation
+# [INFO][ 2.75000] Finished IW(1) Simulation. Fraction reached subgoals: 0.50
+# [INFO][ 9.10000] Simulation - IW(2) run reached all goals
+EVENT_PATTERN = re.compile(
+    r'(?:^\[\w+\]\[\s*(?P<timestamp>\d+\.\d+)\][^\n]*?)?(?:'
+    r'Building SDD for (?P<vars>\d+) variables and (?P<constraints>\d+) constraints'
+    r'|SDD minimization: (?P<nodes_before>\d+) -> (?P<nodes_after>\d+) nodes'
+    r'|Starting IW\((?P<start_width>\d+)\) Simulation'
+    r'|Finished IW\((?P<finish_width>\d+)\) Simulation\. Fraction reached subgoals: (?P<fraction>\d+(?:\.\d+)?)'
+    r'|Simulation - IW\((?P<result_width>\d+)\) run (?P<result>reached|did not reach) all goals)', re.M)
+
+
+def _get_duration(start, end):
+    return None if start is None or end is None else round(end - start, 6)
+
+
+def extract_events(content):
+    """
+    Scan the planner log once and return the tables of SDD and simulation events (see the module
+    documentation).
+    """
+    sdd_events = []
+    simulation_events = []
+    open_sdd = None
+    open_simulations = {}
+    for match in EVENT_PATTERN.finditer(content):
+        timestamp = match.group('timestamp')
+        timestamp = float(timestamp) if timestamp is not None else None
+        if match.group('vars') is not None:
+            open_sdd = [timestamp, None, int(match.group('vars')), int(match.group('constraints')), None, None]
+            sdd_events.append(open_sdd)
+        elif match.group('nodes_after') is not None:
+            if open_sdd is None:
+                # A minimization whose SDD was built without a message.
+                open_sdd = [timestamp, None, None, None, None, None]
+                sdd_events.append(open_sdd)
+            open_sdd[1] = _get_duration(open_sdd[0], timestamp)
+            open_sdd[4:] = [int(match.group('nodes_before')), int(match.group('nodes_after'))]
+            open_sdd = None
+        elif match.group('start_width') is not None:
+            width = int(match.group('start_width'))
+            open_simulations[width] = [width, timestamp, None, None, None]
+            simulation_events.append(open_simulations[width])
+        else:
+            width = int(match.group('finish_width') or match.group('result_width'))
+            event = open_simulations.get(width)
+            if event is None:
+                # The simulation was started without a message.
+                event = open_simulations[width] = [width, None, None, None, None]
+                simulation_events.append(event)
+            if match.group('fraction') is not None:
+                event[2] = _get_duration(event[1], timestamp)
+                event[3] = float(match.group('fraction'))
+                if width == 1:
+                    event[4] = int(event[3] == 1)
+            else:
+                event[4] = int(match.group('result') == 'reached')
+    return sdd_events, simulation_events
+
+
+def load_events(eval_dir, attribute, batch_size=65536):
+    """
+    Return the events in the *attribute* column (e.g. ``sdd_events``) of all runs in *eval_dir* as
+    a dictionary mapping the event columns to numpy arrays (with NaN for missing values), plus
+    "algorithm", "domain" and "problem" columns with the run of each event.
+    """
+    import numpy as np
+
+    from .store import ColumnarStore, has_store
+
+    run_attributes = ['algorithm', 'domain', 'problem']
+    if has_store(eval_dir):
+        batches = ColumnarStore(eval_dir).iter_batches(run_attributes + [attribute], batch_size)
+    else:
+        runs = list(tools.Properties(filename=os.path.join(eval_dir, 'properties')).values())
+        batches = [{attr: [run.get(attr) for run in runs] for attr in run_attributes + [attribute]}]
+
+    columns = EVENT_COLUMNS[attribute]
+    rows = []
+    run_values = {attr: [] for attr in run_attributes}
+    for batch in batches:
+        for index, events in enumerate(batch.get(attribute, [])):
+            if not events:
+                continue
+            rows.extend(events)
+            for attr in run_attributes:
+                run_values[attr].extend([batch[attr][index]] * len(events))
+    table = np.array(rows, dtype=np.float64).reshape(len(rows), len(columns))
+    result = {column: table[:, index] for index, column in enumerate(columns)}
+    result.update((attr, np.array(values, dtype=object)) for attr, values in run_values.items())
+    return result
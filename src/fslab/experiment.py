@@ -20,6 +20,7 @@
 A module for running FS experiments.
 """
 
+import json
 import logging
 import os.path
 
@@ -27,11 +28,22 @@ from downward.experiment import FastDownwardRun, FastDownwardExperiment, _Downwa
 from lab.experiment import Run
 from lab import tools
 
+from .archive import archive_runs
 from .cached_revision import FSCachedRevision
+from .compression import check_compression, get_log_filename
+from .environments import AsyncLocalEnvironment
+from .escalation import escalate_time_limits, get_time_limits
+from .fetcher import FSFetcher
+from .sink import MERGED_FILENAME, SINK_CONFIG_FILENAME, get_sink_config, merge_results
+from .suites import BenchmarkIndex
+from .validation import validate_plans
 
 DIR = os.path.dirname(os.path.abspath(__file__))
 DOWNWARD_SCRIPTS_DIR = os.path.join(DIR, 'scripts')
 
+# The commands of a run, for drivers that execute them without the run script (see fslab.async_driver).
+COMMANDS_FILENAME = 'commands.json'
+
 
 RUN_TPL = """#! /usr/bin/env python
 # -*- coding: utf-8 -*-
@@ -39,6 +51,7 @@ RUN_TPL = """#! /usr/bin/env python
 import logging
 import os
 import platform
+import sys
 
 from fslab.call import Call
 from lab import tools
@@ -47,12 +60,13 @@ tools.configure_logging()
 
 logging.info('node: {}'.format(platform.node()))
 
-run_log = open('run.log', 'w')
-run_err = open('run.err', 'w', buffering=1)  # line buffering
-redirects = {'stdout': run_log, 'stderr': run_err}
-
 # Make sure we're in the run directory.
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
+%(escalation)s
+# Opening the logs truncates them, so runs that finished in a previous round must exit before.
+run_log = open(%(run_log)r, %(run_log_mode)r)
+run_err = open('run.err', 'w', buffering=1)  # line buffering
+redirects = {'stdout': run_log, 'stderr': run_err%(compression)s}
 
 %(calls)s
 
@@ -62,9 +76,18 @@ for f in [run_log, run_err]:
         os.remove(f.name)
 """
 
+ESCALATION_TPL = """
+from fslab.escalation import start_round
+
+time_limit = start_round(%(time_limits)r)
+if time_limit is None:
+    # The run finished in a previous round, see fslab.escalation
+    sys.exit()
+"""
+
 
 class FSRun(FastDownwardRun):
-    def __init__(self, exp, algo, task):
+    def __init__(self, exp, algo, task, repetition=None):
         # Note: We surpass the FastDownwardRun constructor to avoid adding the
         # Fast Downward planner command and adding ours instead
         Run.__init__(self, exp)
@@ -72,6 +95,10 @@ class FSRun(FastDownwardRun):
         self.task = task
 
         self._set_properties()
+        if repetition is not None:
+            # Repetitions are merged into a single run by the fetcher, see fslab.repetitions
+            self.set_property('repetition', repetition)
+            self.set_property('id', self.properties['id'] + ['rep{}'.format(repetition)])
 
         # Linking to instead of copying the PDDL files makes building
         # the experiment twice as fast.
@@ -83,13 +110,35 @@ class FSRun(FastDownwardRun):
         # TODO Note that we just pass '.' as the output directory, since the command
         # TODO will be executed from the run directory. Perhaps cleaner options are available
         # TODO that don't mix the workspace with other important LAB files?
+        cmd = (['{' + algo.cached_revision.get_planner_resource_name() + '}'] +
+               algo.driver_options + ['--domain', '{domain}', '--instance', '{problem}', '--output', '.']
+               + algo.component_options)
+        if repetition is not None and exp.seed_option is not None:
+            cmd += [exp.seed_option, str(repetition)]
+        call_kwargs = {}
+        profiling = exp.profiling
+        profiled = profiling is not None and profiling.is_selected(algo.name, task)
+        if profiled:
+            cmd = profiling.wrap_command(cmd)
+            call_kwargs = profiling.get_call_kwargs()
+            self.set_property('profiler', profiling.profiler)
+        grounding_cache = exp.grounding_cache
+        if grounding_cache is not None:
+            key = grounding_cache.get_key(algo, task)
+            cmd = grounding_cache.wrap_command(cmd, key, exp.path)
+            self.set_property('grounding_cache_key', key)
+        result_cache = exp.result_cache
+        # Repeated and profiled runs are meant to measure the planner again, so their results are not reused.
+        if result_cache is not None and repetition is None and not profiled and result_cache.is_selected(algo.name):
+            key = result_cache.get_key(algo, task, exp.time_limit, exp.memory_limit)
+            cmd = result_cache.wrap_command(cmd, key)
+            self.set_property('result_cache_key', key)
         self.add_command(
             'planner',
-            ['{' + algo.cached_revision.get_planner_resource_name() + '}'] +
-            algo.driver_options + ['--domain', '{domain}', '--instance', '{problem}', '--output', '.']
-            + algo.component_options,
+            cmd,
             time_limit=exp.time_limit,
             memory_limit=exp.memory_limit,
+            **call_kwargs
         )
 
     def _build_run_script(self):
@@ -122,6 +171,9 @@ class FSRun(FastDownwardRun):
                     return repr(str(arg))
 
             def format_key_value_pair(key, val):
+                if key == 'time_limit' and name == 'planner' and escalation:
+                    # The time limit of the round is determined by the run script.
+                    return 'time_limit=time_limit'
                 if isinstance(val, tools.string_type):
                     formatted_value = format_arg(val)
                 else:
@@ -138,15 +190,34 @@ class FSRun(FastDownwardRun):
                 parts.append(kwargs_string)
             return "Call({}, **redirects).wait()\n".format(", ".join(parts))
 
+        escalation = len(self.experiment.time_limits) > 1
         calls_text = "\n".join(
             make_call(name, cmd, kwargs)
             for name, (cmd, kwargs) in self.commands.items()
         )
         # run_script = tools.fill_template("run.py", calls=calls_text)
-        run_script = RUN_TPL % dict(calls=calls_text)
+        compression = self.experiment.log_compression
+        run_script = RUN_TPL % dict(
+            calls=calls_text,
+            escalation=ESCALATION_TPL % dict(time_limits=self.experiment.time_limits) if escalation else '',
+            run_log=get_log_filename('run.log', compression),
+            run_log_mode='w' if compression is None else 'wb',
+            compression='' if compression is None else ", 'stdout_compression': {!r}".format(compression))
 
         self.add_new_file("", "run", run_script, permissions=0o755)
 
+        if isinstance(self.experiment.environment, AsyncLocalEnvironment):
+            # The environment executes the commands without the run script, see fslab.async_driver
+            def format_value(value):
+                return value.format(**env_vars) if isinstance(value, tools.string_type) else value
+
+            commands = [
+                {'name': name, 'args': [str(format_value(arg)) for arg in cmd],
+                 'kwargs': {key: format_value(value) for key, value in sorted(kwargs.items())}}
+                for name, (cmd, kwargs) in self.commands.items()]
+            self.add_new_file("", COMMANDS_FILENAME, json.dumps(dict(
+                commands=commands, log_compression=compression, escalation=escalation)))
+
 
 class FSExperiment(FastDownwardExperiment):
     """Conduct a FS experiment. See documentation
@@ -155,11 +226,52 @@ class FSExperiment(FastDownwardExperiment):
     DEFAULT_SEARCH_TIME_LIMIT = 30*60  # in seconds
     DEFAULT_SEARCH_MEMORY_LIMIT = 8*1024  # in MB
 
-    def __init__(self, path=None, environment=None, revision_cache=None, time_limit=None, memory_limit=None):
-        """  """
+    def __init__(self, path=None, environment=None, revision_cache=None, time_limit=None, memory_limit=None,
+                 profiling=None, log_compression=None, repetitions=1, seed_option=None, grounding_cache=None,
+                 result_sink=False, initial_time_limit=None, time_limit_factor=4, result_cache=None):
+        """ If *profiling* is a :class:`fslab.profiling.ProfilingOptions` object, the runs it selects
+        are profiled. If *log_compression* is "gzip" or "zstd", the standard output of all commands
+        of a run is compressed into run.log.gz or run.log.zst (see :mod:`fslab.compression`).
+
+        If *repetitions* is greater than 1, each algorithm is run that many times on each task, and
+        the fetcher merges the repetitions into runs with statistics of their timing attributes (see
+        :mod:`fslab.repetitions`). If *seed_option* is given (e.g. "--seed"), the planner receives
+        it followed by the number of the repetition.
+
+        If *grounding_cache* is a :class:`fslab.grounding_cache.GroundingCacheOptions` object, runs
+        that share the revision, the task and the frontend options reuse the frontend output of the
+        first of them.
+
+        If *result_sink* is True, the parser of each run also writes its properties into a SQLite
+        database, which can be queried while the experiment runs (see :mod:`fslab.sink`).
+
+        If *initial_time_limit* is given, the runs are executed in several rounds: all runs first
+        get the initial time limit, and the runs that time out get a *time_limit_factor* times
+        larger limit in each further round, up to *time_limit* (see :mod:`fslab.escalation` and
+        :meth:`add_escalation_steps`).
+
+        If *result_cache* is a :class:`fslab.result_cache.ResultCacheOptions` object, runs whose
+        revision, options, task and limits match those of a run of this or an earlier experiment
+        reuse its results instead of running the planner. """
+        if log_compression is not None:
+            check_compression(log_compression)
+        if repetitions < 1:
+            logging.critical('The number of repetitions must be positive: {}'.format(repetitions))
         super().__init__(path, environment, revision_cache)
         self.time_limit = time_limit if time_limit is not None else self.DEFAULT_SEARCH_TIME_LIMIT
         self.memory_limit = memory_limit if memory_limit is not None else self.DEFAULT_SEARCH_MEMORY_LIMIT
+        self.time_limits = [self.time_limit]
+        if initial_time_limit is not None:
+            self.time_limits = get_time_limits(initial_time_limit, self.time_limit, time_limit_factor)
+        self.profiling = profiling
+        self.log_compression = log_compression
+        self.repetitions = repetitions
+        self.seed_option = seed_option
+        self.grounding_cache = grounding_cache
+        self.result_cache = result_cache
+        self.task_selection = {}
+        if result_sink:
+            self.add_new_file('', SINK_CONFIG_FILENAME, get_sink_config())
 
     def add_algorithm(self, name, repo, rev, component_options,
                       build_options=None, driver_options=None):
@@ -180,6 +292,53 @@ class FSExperiment(FastDownwardExperiment):
                     'identical.'.format(**locals()))
         self._algorithms[name] = algorithm
 
+    def select_tasks(self, min_problem_size=None, max_problem_size=None, sort_by_size=False):
+        """ Only add runs for the tasks whose problem file size (in bytes) lies within the given bounds
+        and, if *sort_by_size* is True, add them in order of increasing problem file size. """
+        self.task_selection = dict(
+            min_problem_size=min_problem_size, max_problem_size=max_problem_size, sort_by_size=sort_by_size)
+
+    def add_fetcher(self, src=None, dest=None, merge=None, name=None, filter=None,
+                    write_properties=True, timing_attributes=None, **kwargs):
+        """ See documentation in Experiment.add_fetcher(). The fetched properties are written into a
+        columnar store in the evaluation directory (see FSFetcher) and, unless *write_properties* is
+        False, into the combined lab properties file as well. Repeated runs are merged, computing
+        statistics of the *timing_attributes* (see :mod:`fslab.repetitions`).
+        """
+        src = src or self.path
+        dest = dest or self.eval_dir
+        name = name or 'fetch-%s' % os.path.basename(src.rstrip('/'))
+        fetcher = FSFetcher(write_properties=write_properties, timing_attributes=timing_attributes)
+        self.add_step(name, fetcher, src, dest, merge=merge, filter=filter, **kwargs)
+
+    def add_archive_step(self, name='archive-runs', **kwargs):
+        """ Add a step that packs the finished run directories into a few large indexed archives and
+        removes them (see :func:`fslab.archive.archive_runs` for the keyword arguments). """
+        self.add_step(name, archive_runs, self.path, **kwargs)
+
+    def add_merge_results_step(self, name='merge-results', dest=None):
+        """ Add a step that merges the databases of the result sink into *dest* (default:
+        results.sqlite in the experiment directory). It can also be run while the experiment is
+        running, and only merges the runs written since its previous invocation. """
+        dest = dest or os.path.join(self.path, MERGED_FILENAME)
+        self.add_step(name, merge_results, self.path, dest)
+
+    def add_validation_step(self, name='validate-plans', **kwargs):
+        """ Add a step that validates the plans found by the runs with VAL and adds the attributes
+        plan_valid and plan_cost to their properties (see :func:`fslab.validation.validate_plans`
+        for the keyword arguments). Identical plans are only validated once. """
+        self.add_step(name, validate_plans, self.path, **kwargs)
+
+    def add_escalation_steps(self):
+        """ Add the steps for the further rounds of an experiment with an *initial_time_limit*: for
+        each round, a step that marks the runs that timed out and a step that starts the runs again
+        (which must come after the step that starts the first round). """
+        if len(self.time_limits) == 1:
+            logging.critical('The experiment has no initial time limit, so there is nothing to escalate.')
+        for round_number in range(1, len(self.time_limits)):
+            self.add_step('escalate-round-{}'.format(round_number), escalate_time_limits, self.path, self.time_limits)
+            self.add_step('start-round-{}'.format(round_number), self.start_runs)
+
     def _add_code(self):
         """Add the compiled code to the experiment."""
         for cached_rev in self._get_unique_cached_revisions():
@@ -193,10 +352,26 @@ class FSExperiment(FastDownwardExperiment):
                 cached_rev.get_cached_path('run.py'),
                 cached_rev.get_exp_path('run.py'))
 
+    def _get_tasks(self):
+        """ Resolve the suites with the persistent benchmark index (see :mod:`fslab.suites`). """
+        tasks = []
+        for benchmarks_dir, suite in self._suites.items():
+            tasks.extend(BenchmarkIndex(benchmarks_dir).build_suite(suite, **self.task_selection))
+        return tasks
+
     def _add_runs(self):
-        for algo in self._algorithms.values():
-            for task in self._get_tasks():
-                self.add_run(FSRun(self, algo, task))
+        tasks = self._get_tasks()
+        if self.repetitions == 1:
+            for algo in self._algorithms.values():
+                for task in tasks:
+                    self.add_run(FSRun(self, algo, task))
+            return
+        # Add the repetitions in separate rounds, so that the repetitions of each pair of algorithm
+        # and task are far apart in the order of runs and tend to be executed on different nodes.
+        for repetition in range(self.repetitions):
+            for algo in self._algorithms.values():
+                for task in tasks:
+                    self.add_run(FSRun(self, algo, task, repetition=repetition))
 
     def _get_default_build_options(self):
         return ['-p']
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+A fetcher that writes the properties of all runs into a columnar store.
+"""
+
+from glob import glob
+import logging
+import os
+
+from lab import tools
+from lab.fetcher import Fetcher, _check_eval_dir
+
+from .archive import RunArchive, has_archive
+from .repetitions import aggregate_repetitions
+
+
+class FSFetcher(Fetcher):
+    """
+    Collect data from the runs of an FS experiment and store it in a :class:`~fslab.store.ColumnarStore`
+    within the evaluation directory, so that reports can load only the attributes they need. Runs
+    that have been packed into the experiment's archive (see :mod:`fslab.archive`) are fetched too.
+
+    The combined lab ``properties`` JSON file is written as well, so that the evaluation directory can
+    still be used by scripts and reports that do not know about the columnar store. Pass
+    ``write_properties=False`` to skip it for large experiments; an existing properties file is then
+    left untouched.
+
+    Repetitions of the same algorithm on the same task are merged into a single run, with the median,
+    interquartile range and confidence interval of each of the *timing_attributes* (see
+    :mod:`fslab.repetitions`).
+    """
+
+    def __init__(self, write_properties=True, backend=None, timing_attributes=None):
+        self.write_properties = write_properties
+        self.backend = backend
+        self.timing_attributes = timing_attributes
+
+    @staticmethod
+    def load_eval_dir(eval_dir):
+        """ Load all properties in the given evaluation directory, preferring the columnar store. """
+        from .store import ColumnarStore, has_store
+        if has_store(eval_dir):
+            return ColumnarStore(eval_dir).load()
+        return tools.Properties(os.path.join(eval_dir, 'properties'))
+
+    def __call__(self, src_dir, eval_dir=None, merge=None, filter=None, **kwargs):
+        """ See lab.fetcher.Fetcher.__call__ """
+        # The store (and with it NumPy) is only imported here, so that building experiments stays fast.
+        from .store import ColumnarStore, get_run_id
+        if not os.path.isdir(src_dir):
+            logging.critical('{} is missing or not a directory'.format(src_dir))
+        run_filter = tools.RunFilter(filter, **kwargs)
+
+        eval_dir = eval_dir or src_dir.rstrip('/') + '-eval'
+        logging.info('Fetching properties from {} to {}'.format(src_dir, eval_dir))
+
+        if merge is None:
+            _check_eval_dir(eval_dir)
+        elif not merge:
+            tools.remove_path(eval_dir)
+
+        # Load properties in the eval_dir if there are any already.
+        combined_props = tools.Properties()
+        combined_props.filename = os.path.join(eval_dir, 'properties')
+        combined_props.update(self.load_eval_dir(eval_dir))
+
+        fetch_from_eval_dir = (not os.path.exists(os.path.join(src_dir, 'runs-00001-00100')) and
+                               not has_archive(src_dir))
+        if fetch_from_eval_dir:
+            src_props = self.load_eval_dir(src_dir)
+            run_filter.apply(src_props)
+            combined_props.update(src_props)
+            logging.info('Fetched properties of {} runs.'.format(len(src_props)))
+        else:
+            slurm_err_content = tools.get_slurm_err_content(src_dir)
+            if slurm_err_content:
+                logging.error('There was output to *-grid-steps/slurm.err')
+
+            new_props = tools.Properties()
+            run_dirs = sorted(glob(os.path.join(src_dir, 'runs-*-*', '*')))
+            total_dirs = len(run_dirs)
+            logging.info('Scanning properties from {:d} run directories'.format(total_dirs))
+            for index, run_dir in enumerate(run_dirs, start=1):
+                loglevel = logging.INFO if index % 100 == 0 else logging.DEBUG
+                logging.log(loglevel, 'Scanning: {:6d}/{:d}'.format(index, total_dirs))
+                props = self.fetch_dir(run_dir)
+                if slurm_err_content:
+                    props.add_unexplained_error('output-to-slurm.err')
+                new_props[get_run_id(props)] = props
+
+            if has_archive(src_dir):
+                # Runs that are still unpacked take precedence over their archived copies.
+                archive = RunArchive(src_dir)
+                archived = [run_id for run_id in sorted(archive.runs) if run_id not in new_props]
+                logging.info('Scanning properties from {:d} archived runs'.format(len(archived)))
+                for run_id in archived:
+                    props = archive.fetch(run_id)
+                    if slurm_err_content:
+                        props.add_unexplained_error('output-to-slurm.err')
+                    new_props[run_id] = props
+            run_filter.apply(new_props)
+            if any('repetition' in props for props in new_props.values()):
+                new_props = aggregate_repetitions(new_props, self.timing_attributes)
+            combined_props.update(new_props)
+
+        unexplained_errors = 0
+        for props in combined_props.values():
+            error_message = tools.get_unexplained_errors_message(props)
+            if error_message:
+                logging.error(error_message)
+                unexplained_errors += 1
+
+        tools.makedirs(eval_dir)
+        ColumnarStore(eval_dir).write(combined_props, backend=self.backend)
+        if self.write_properties:
+            combined_props.write()
+        logging.info('Fetched {} runs ({} with unexplained errors).'.format(len(combined_props), unexplained_errors))
@@ -5,11 +5,29 @@ Regular expressions and methods for parsing the output of FS experiments.
 
 from __future__ import division
 
+import json
+import os
 import re
 
 
 from lab.parser import Parser
 
+from fslab.compression import decompress_log
+
+from fslab.escalation import STATE_FILENAME
+
+from fslab.events import SDD_EVENTS, SIMULATION_EVENTS, extract_events
+
+from fslab.grounding_cache import MARKER_FILENAME, write_frontend_times
+
+from fslab.profiling import PERF_REPORT, RSS_LOG, write_perf_report
+
+from fslab.result_cache import MARKER_FILENAME as RESULT_CACHE_MARKER_FILENAME
+
+from fslab.sink import write_run_to_sink
+
+from fslab.validation import store_plan
+
 
 def solved(run):
     return run['coverage'] or run['unsolvable']
@@ -47,37 +65,28 @@ def parse_memory_time_watchpoints(content, props):
 
 
 def parse_simulation_info(content, props):
-    res = re.findall(r'Starting IW\(1\) Simulation', content)
-    props['sim_iw1_started'] = int(len(res) > 0)
-
-    res = re.findall(r'Finished IW\(1\) Simulation. Fraction reached subgoals: (.+)\n', content)
-    props['sim_iw1_finished'] = int(len(res) > 0)
-    props['sim_iw1_reached_subgoals'] = float(res[-1]) if res else 0
+    # The IW(1) and IW(2) simulations are taken from the events table, see parse_events
+    for width in [1, 2]:
+        events = [event for event in props[SIMULATION_EVENTS] if event[0] == width]
+        finished = [event for event in events if event[3] is not None]
+        props['sim_iw{}_started'.format(width)] = int(len(events) > 0)
+        props['sim_iw{}_finished'.format(width)] = int(len(finished) > 0)
+        props['sim_iw{}_reached_subgoals'.format(width)] = finished[-1][3] if finished else 0
+        props['sim_iw{}_time'.format(width)] = sum(event[2] or 0 for event in finished)
 
     # Simulation - IW(1) run reached all goals
     #  Finished IW(1) Simulation. Fraction reached subgoals: 1.00
-    res = re.findall(r'Finished IW\(1\) Simulation. Fraction reached subgoals: 1\.00\n', content)
-    props['sim_iw1_successful'] = int(len(res) > 0)
+    props['sim_iw1_successful'] = int(any(event[4] for event in props[SIMULATION_EVENTS] if event[0] == 1))
 
     # considered too high to run IW(2)
     res = re.findall(r'considered too high to run IW\(2\)', content)
     props['sim_rall_because_too_many_actions'] = int(len(res) > 0)
 
-    # Simulation - IW(2) run reached all goals
-    res = re.findall(r'Simulation - IW\(2\) run reached all goals\n', content)
-    props['sim_iw2_successful'] = not props['sim_iw1_successful'] and int(len(res) > 0)
+    # Simulation - IW(2) run reached all goals / did not reach all goals
+    iw2_results = [event[4] for event in props[SIMULATION_EVENTS] if event[0] == 2 and event[4] is not None]
+    props['sim_iw2_successful'] = int(not props['sim_iw1_successful'] and any(iw2_results))
     props['sim_successful'] = props['sim_iw1_successful'] or props['sim_iw2_successful']
-
-    # Simulation - IW(2) run did not reach all goals
-    res = re.findall(r'Simulation - IW\(2\) run did not reach all goals', content)
-    props['sim_rall_because_iw2_unsuccessful'] = not props['sim_iw1_successful'] and int(len(res) > 0)
-
-    res = re.findall(r'Starting IW\(2\) Simulation', content)
-    props['sim_iw2_started'] = int(len(res) > 0)
-
-    res = re.findall(r'Finished IW\(2\) Simulation. Fraction reached subgoals: (.+)\n', content)
-    props['sim_iw2_finished'] = int(len(res) > 0)
-    props['sim_iw2_reached_subgoals'] = float(res[-1]) if res else 0
+    props['sim_rall_because_iw2_unsuccessful'] = int(not props['sim_iw1_successful'] and 0 in iw2_results)
 
     res = re.findall(r'Total simulation time: (\d+\.\d+)\n', content)
     props['sim_total_simulation_time'] = float(res[-1]) if res else 0
@@ -118,15 +127,77 @@ def parse_grounding_info(content, props):
     props['num_ground_actions'] = int(res[-1]) if res else 0
 
 
+PHASE_PATTERN = re.compile(
+    r'^(?:\[INFO\]\[\s*(\d+\.\d+)\]\s*)?(.+?)\s*:\s*'
+    r'\[(\d+\.\d+)s CPU, (\d+\.\d+)s? wall-clock, diff: (-?\d+\.\d+)MB[,\]]', re.M)
+
+
+def get_phase_slug(name):
+    # "Computing reachable groundings..." -> "computing_reachable_groundings"
+    return re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')
+
+
+def parse_phases(content, props):
+    # [INFO][ 0.21237] Computing reachable groundings...: [0.19s CPU, 0.20s wall-clock, diff: 3.50MB, ...]
+    # Each phase is recorded as [name, timestamp, CPU time, wall-clock time, memory delta (MB)], in
+    # order of appearance. Phases that appear several times are summed up in the flat attributes.
+    phases = []
+    for timestamp, name, cpu, wall, mem in PHASE_PATTERN.findall(content):
+        phases.append([name.strip(), float(timestamp) if timestamp else None, float(cpu), float(wall), float(mem)])
+    props['phases'] = phases
+
+    for name, _, cpu, wall, mem in phases:
+        slug = get_phase_slug(name)
+        if not slug:
+            continue
+        for kind, value in [('cpu', cpu), ('wall', wall), ('mem', mem)]:
+            attr = 'phase_{}_{}'.format(slug, kind)
+            props[attr] = props.get(attr, 0) + value
+
+
+def parse_events(content, props):
+    # One row per SDD and per IW(k) simulation, see fslab.events
+    props[SDD_EVENTS], props[SIMULATION_EVENTS] = extract_events(content)
+
+
 def parse_sdd_minimization(content, props):
+    # The SDDs are taken from the events table, see parse_events
     # SDD minimization: 132 -> 101 nodes (30% reduction)
-    allsizes = re.findall(r'SDD minimization: .+ -> ([0-9]+) nodes', content)
-    props['sdd_sizes'] = sum(int(x) for x in allsizes) if allsizes else -1
+    minimized = [event for event in props[SDD_EVENTS] if event[5] is not None]
+    props['sdd_sizes'] = sum(event[5] for event in minimized) if minimized else -1
 
     # Building SDD for 8 variables and 11 constraints
-    thsizes = re.findall(r'Building SDD for ([0-9]+) variables and ([0-9]+) constraints', content)
-    props['sdd_theory_vars'] = sum(int(x[0]) for x in thsizes) if allsizes else -1
-    props['sdd_theory_constraints'] = sum(int(x[1]) for x in thsizes) if allsizes else -1
+    built = [event for event in props[SDD_EVENTS] if event[2] is not None]
+    props['sdd_theory_vars'] = sum(event[2] for event in built) if built else -1
+    props['sdd_theory_constraints'] = sum(event[3] for event in built) if built else -1
+    props['sdd_time'] = sum(event[1] or 0 for event in props[SDD_EVENTS])
+
+
+def parse_rss_profile(content, props, max_points=64):
+    # time	rss
+    # 0.102	5184
+    samples = re.findall(r'^(\d+\.\d+)\t(\d+)$', content, re.M)
+    props['rss_samples'] = len(samples)
+    if not samples:
+        return
+    samples = [(float(t), int(rss)) for t, rss in samples]
+    props['rss_peak'] = max(rss for _, rss in samples)
+    # Keep the peak of each of at most max_points equally long stretches of samples
+    step = -(-len(samples) // max_points)
+    props['rss_curve'] = [list(max(samples[i:i + step], key=lambda s: s[1])) for i in range(0, len(samples), step)]
+
+
+def parse_perf_report(content, props, num_symbols=10):
+    # # Samples: 12K of event 'cycles'
+    res = re.findall(r'^# Samples: (\d+)(K|M)? of event', content, re.M)
+    if res:
+        number, unit = res[0]
+        props['perf_samples'] = int(number) * {'': 1, 'K': 1000, 'M': 1000000}[unit]
+
+    #     23.45%  planner  [.] fs0::SimpleStateModel::applicable_actions
+    symbols = re.findall(r'^\s+(\d+\.\d+)%\s+(\S+)\s+\[.\]\s+(.+)$', content, re.M)
+    props['perf_top_symbols'] = [[symbol.strip(), dso, float(percent)]
+                                 for percent, dso, symbol in symbols[:num_symbols]]
 
 
 def parse_results(content, props):
@@ -178,7 +249,9 @@ def parse_results(content, props):
         props['expansions'] = out['expanded']
         props['generations'] = out['generated']
         props['evaluations'] = out['evaluated']
-        props['plan'] = ', '.join(out['plan'])
+        if props['coverage'] and out['plan']:
+            # Unsolvable runs have no plan to store and validate.
+            store_plan(out['plan'], props)  # see fslab.validation
         props['node_generation_rate'] = out['gen_per_second']
 
 
@@ -192,6 +265,34 @@ def check_min_values(content, props):
             props[attr] = max(time, 0.01)
 
 
+def parse_grounding_cache(content, props):
+    # {"key": "3f2a...", "entry": "/.../grounding-cache/3f/3f2a...", "hit": true, "stored": false,
+    #  "frontend_times": {"time_frontend": 12.3, "reach_time": 4.5}}
+    marker = json.loads(content)
+    props['grounding_cache_key'] = marker['key']
+    props['grounding_cache_hit'] = int(marker['hit'])
+    for attr, value in marker.get('frontend_times', {}).items():
+        props['cached_' + attr] = value
+    write_frontend_times(marker, props)
+
+
+def parse_result_cache(content, props):
+    # {"key": "3f2a...", "entry": "/.../results/3f/3f2a...", "hit": true, "stored": false}
+    marker = json.loads(content)
+    props['result_cache_key'] = marker['key']
+    props['result_cache_hit'] = int(marker['hit'])
+
+
+def parse_time_limit_escalation(content, props):
+    # {"round": 1, "time_limit": 300, "pending": false,
+    #  "rounds": [{"time_limit": 60, "planner_wall_clock_time": 60.4, "exit_code": -24}]}
+    state = json.loads(content)
+    props['time_limit'] = state['time_limit']
+    props['escalation_round'] = state['round']
+    props['escalation_time_limits'] = [r['time_limit'] for r in state['rounds']] + [state['time_limit']]
+    props['escalation_wasted_time'] = sum(r['planner_wall_clock_time'] or 0 for r in state['rounds'])
+
+
 class FSOutputParser(Parser):
     def __init__(self):
         Parser.__init__(self)
@@ -201,17 +302,50 @@ class FSOutputParser(Parser):
 
         self.add_function(parse_memory_time_watchpoints, file="run.log")
         self.add_function(parse_grounding_info, file="run.log")
+        self.add_function(parse_phases, file="run.log")
         self.add_function(parse_node_generation_rate, file="run.log")
+        self.add_function(parse_events, file="run.log")
         self.add_function(parse_sdd_minimization, file="run.log")
         self.add_function(parse_simulation_info, file="run.log")
 
         self.add_function(parse_results, file="results.json")
         self.add_function(check_min_values, file="results.json")
 
+        # Only present if the run was profiled, see fslab.profiling
+        self.add_function(parse_rss_profile, file=RSS_LOG)
+        self.add_function(parse_perf_report, file=PERF_REPORT)
+
+        # Only present if the experiment uses the grounding cache, see fslab.grounding_cache
+        self.add_function(parse_grounding_cache, file=MARKER_FILENAME)
+
+        # Only present if the experiment uses the result cache, see fslab.result_cache
+        self.add_function(parse_result_cache, file=RESULT_CACHE_MARKER_FILENAME)
+
+        # Only present if the experiment escalates time limits, see fslab.escalation
+        self.add_function(parse_time_limit_escalation, file=STATE_FILENAME)
+
         # Note We might want to parse problem stats as well
         # self.add_function(parse_problem_stats, file="problem_stats.json")
 
+    def parse(self):
+        write_perf_report()
+        # Lab's parser only reads plain files, so a run log that was compressed while it was being
+        # written (see fslab.compression) is decompressed for the time of the parsing.
+        decompressed = decompress_log('run.log')
+        try:
+            Parser.parse(self)
+        finally:
+            if decompressed:
+                os.remove('run.log')
+        # Only does something if the experiment has a result sink, see fslab.sink
+        write_run_to_sink(self.props)
+
+
+def main():
+    FSOutputParser().parse()
+
 
-FSOutputParser().parse()
+if __name__ == '__main__':
+    main()
 
 
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""
+An opt-in cache of the planner frontend output, shared by runs that differ only in search options.
+
+Configs of the same revision usually parse and ground every task in the same way, and differ only
+in the options of the search. With a :class:`GroundingCacheOptions` object passed to
+:class:`~fslab.experiment.FSExperiment`, the planner command of each run is wrapped by this module
+(``python -m fslab.grounding_cache ...``), which looks up the key of the run, i.e., a hash of
+
+- the planner revision and its build options,
+- the contents of the domain and problem files, and
+- the frontend-relevant options of the run (those named in *frontend_options*, or all driver
+  options by default).
+
+If the cache has an entry for the key, the files of the entry are copied into the run directory
+and the planner is called with the *reuse_options* appended, so that it starts from them instead of
+running the frontend again. Otherwise, the planner runs normally and the frontend output files
+given in *outputs* are stored in the cache under the key once the planner exits, if it succeeded or
+if the outputs had been complete for a while (*settle_time*), e.g. when the search timed out.
+
+The wrapper records what it did in ``grounding-cache.json``, from which the parser sets the
+``grounding_cache_hit`` property. For runs that reused an entry, the frontend time of the run that
+stored it is reported as ``cached_time_frontend`` and ``cached_reach_time``, while
+``time_frontend`` and ``reach_time`` hold the (small) frontend time of the run itself.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+from lab import tools
+
+
+MARKER_FILENAME = 'grounding-cache.json'
+FRONTEND_TIMES_FILENAME = 'frontend-times.json'
+DEFAULT_CACHE_DIRNAME = 'grounding-cache'
+DEFAULT_SETTLE_TIME = 10  # in seconds
+
+
+def get_frontend_options(options, frontend_options):
+    """
+    Return the options (with their values) among *options* whose names are in *frontend_options*,
+    e.g. ["--driver", "sbfws"] for ["--driver", "sbfws", "--options", "bfws.rs=sim"] and ["--driver"].
+    """
+    selected = []
+    for index, option in enumerate(options):
+        name = option.split('=', 1)[0]
+        if name in frontend_options:
+            selected.append(option)
+            if '=' not in option and index + 1 < len(options) and not options[index + 1].startswith('-'):
+                selected.append(options[index + 1])
+    return selected
+
+
+def get_entry_dir(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key)
+
+
+class GroundingCacheOptions(object):
+    """
+    Share the frontend output of the planner between runs (see the module documentation).
+
+    *outputs* is the list of files and directories, relative to the run directory, that the
+    frontend writes and that the planner can start from when called with *reuse_options*.
+    *frontend_options* names the driver and component options that influence the frontend output
+    (default: all driver options). When the planner does not succeed, its outputs are only stored
+    if none of them was modified during the last *settle_time* seconds, so that the outputs of a
+    planner that was killed while writing them are not stored.
+    The cache is kept in *cache_dir*, which must be reachable from all nodes that execute runs
+    (default: the directory "grounding-cache" in the experiment directory).
+    """
+    def __init__(self, outputs, reuse_options, frontend_options=None, cache_dir=None,
+                 settle_time=DEFAULT_SETTLE_TIME):
+        if not outputs:
+            logging.critical('The grounding cache needs the names of the frontend output files.')
+        self.outputs = tools.make_list(outputs)
+        self.reuse_options = tools.make_list(reuse_options)
+        self.frontend_options = None if frontend_options is None else set(tools.make_list(frontend_options))
+        self.cache_dir = cache_dir
+        self.settle_time = settle_time
+        self._file_hashes = {}
+
+    def _get_file_hash(self, path):
+        # The domain file is shared by all tasks of a domain, so the hashes are cached.
+        from .suites import get_file_hash
+        if path not in self._file_hashes:
+            self._file_hashes[path] = get_file_hash(path)
+        return self._file_hashes[path]
+
+    def get_key(self, algo, task):
+        """ Return the cache key of the run of the :class:`_DownwardAlgorithm` *algo* on *task*. """
+        # The hashes of the benchmark index might be outdated if a file was edited in place.
+        problem_hash = self._get_file_hash(task.problem_file)
+        if self.frontend_options is None:
+            options = algo.driver_options
+        else:
+            options = get_frontend_options(algo.driver_options + algo.component_options, self.frontend_options)
+        parts = [algo.cached_revision._hashed_name, self._get_file_hash(task.domain_file), problem_hash] + options
+        return hashlib.sha1('\0'.join(parts).encode('utf-8')).hexdigest()
+
+    def wrap_command(self, cmd, key, exp_dir):
+        """ Return the command that runs *cmd* with the grounding cache. """
+        cache_dir = self.cache_dir or os.path.join(exp_dir, DEFAULT_CACHE_DIRNAME)
+        wrapper = [tools.get_python_executable(), '-m', 'fslab.grounding_cache',
+                   '--cache-dir', os.path.abspath(cache_dir), '--key', key,
+                   '--settle-time', str(self.settle_time)]
+        wrapper += ['--output={}'.format(output) for output in self.outputs]
+        wrapper += ['--reuse-option={}'.format(option) for option in self.reuse_options]
+        return wrapper + ['--'] + cmd
+
+
+def _copy(src, dest):
+    if os.path.isdir(src):
+        shutil.copytree(src, dest, symlinks=True)
+    else:
+        shutil.copy2(src, dest)
+
+
+def restore_entry(entry_dir, outputs, run_dir='.'):
+    for output in outputs:
+        dest = os.path.join(run_dir, output)
+        if os.path.lexists(dest):
+            tools.remove_path(dest)
+        tools.makedirs(os.path.dirname(os.path.abspath(dest)))
+        _copy(os.path.join(entry_dir, output), dest)
+
+
+def get_last_modification(outputs, run_dir='.'):
+    """ Return the time at which one of the *outputs* (files or directories) was last modified. """
+    mtimes = []
+    for output in outputs:
+        path = os.path.join(run_dir, output)
+        mtimes.append(os.path.getmtime(path))
+        for root, dirs, files in os.walk(path):
+            mtimes.extend(os.path.getmtime(os.path.join(root, name)) for name in dirs + files)
+    return max(mtimes)
+
+
+def store_entry(entry_dir, outputs, run_dir='.'):
+    """ Atomically store the *outputs* of the run in *entry_dir*. Return False if they are incomplete. """
+    if not all(os.path.exists(os.path.join(run_dir, output)) for output in outputs):
+        return False
+    tmp_dir = '{}.{}.tmp'.format(entry_dir, os.getpid())
+    tools.makedirs(os.path.dirname(entry_dir))
+    try:
+        for output in outputs:
+            dest = os.path.join(tmp_dir, output)
+            tools.makedirs(os.path.dirname(dest))
+            _copy(os.path.join(run_dir, output), dest)
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another run stored the same entry in the meantime.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return os.path.isdir(entry_dir)
+    return True
+
+
+def write_frontend_times(marker, props):
+    """ Called by the parser: record the frontend times of a run that stored its output in the cache. """
+    if not marker.get('stored'):
+        return
+    times_file = os.path.join(marker['entry'], FRONTEND_TIMES_FILENAME)
+    if not os.path.exists(times_file):
+        times = {attr: props[attr] for attr in ['time_frontend', 'reach_time'] if attr in props}
+        tools.write_file(times_file, json.dumps(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the planner with the grounding cache of fslab.')
+    parser.add_argument('--cache-dir', required=True)
+    parser.add_argument('--key', required=True)
+    parser.add_argument('--output', dest='outputs', action='append', required=True)
+    parser.add_argument('--reuse-option', dest='reuse_options', action='append', default=[])
+    parser.add_argument('--settle-time', type=float, default=DEFAULT_SETTLE_TIME)
+    parser.add_argument('cmd', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    cmd = args.cmd[1:] if args.cmd[:1] == ['--'] else args.cmd
+
+    entry_dir = get_entry_dir(args.cache_dir, args.key)
+    marker = {'key': args.key, 'entry': entry_dir, 'hit': os.path.isdir(entry_dir), 'stored': False}
+    if marker['hit']:
+        restore_entry(entry_dir, args.outputs)
+        times_file = os.path.join(entry_dir, FRONTEND_TIMES_FILENAME)
+        if os.path.exists(times_file):
+            with open(times_file) as f:
+                marker['frontend_times'] = json.load(f)
+        cmd = cmd + args.reuse_options
+    tools.write_file(MARKER_FILENAME, json.dumps(marker))
+
+    process = subprocess.Popen(cmd)
+    # Pass termination signals (e.g. from lab's wall-clock time limit) on to the planner.
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+        signal.signal(signum, lambda signum, frame: process.send_signal(signum))
+    returncode = process.wait()
+
+    # The frontend outputs of runs that did not succeed (e.g. that timed out during the search) are
+    # stored as well, unless the planner might have been killed while writing them.
+    complete = all(os.path.exists(output) for output in args.outputs)
+    if not marker['hit'] and complete and (
+            returncode == 0 or get_last_modification(args.outputs) < time.time() - args.settle_time):
+        marker['stored'] = store_entry(entry_dir, args.outputs)
+        tools.write_file(MARKER_FILENAME, json.dumps(marker))
+    sys.exit(returncode if returncode >= 0 else 128 - returncode)
+
+
+if __name__ == '__main__':
+    main()
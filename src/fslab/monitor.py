@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+"""
+Live progress of a running experiment, read from its run directories.
+
+    python -m fslab.monitor <exp_dir> [--watch SECONDS] [--window SECONDS] [--json]
+
+The monitor shows the number of pending, running, finished and failed runs, the wall-clock time
+of the planner runs so far, the distribution of the current node generation rate of the running runs and an
+estimate of the time to completion.
+
+Scans are incremental, with modification times as watermarks: a runs-XXXXX-XXXXX directory is
+only listed again when its modification time changes, a pending run is only looked at again when
+its directory changes, a finished run is only looked at again when its ``properties`` file changes
+or disappears (e.g. when the escalation step schedules it for another round, see
+:mod:`fslab.escalation`), and only the output appended to the log of a running run since the last
+scan is read. The state is kept in
+``<exp_dir>/monitor-state.json``, so that consecutive invocations are incremental as well.
+
+A run is pending until the lab driver creates its ``driver.log``, and finished once the parser
+has written its ``properties``. As in lab, a run failed if it wrote to ``driver.err`` or
+``run.err``, or has unexplained errors. Node generation rates are not available for compressed
+run logs (see :mod:`fslab.compression`).
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+from .archive import INDEX_FILENAME, get_archive_dir
+
+
+STATE_FILENAME = 'monitor-state.json'
+STATE_VERSION = 2
+
+PENDING = 'pending'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+
+DEFAULT_WINDOW = 3600  # in seconds
+MAX_TAIL_BYTES = 64 * 1024
+
+RUNS_DIR_PATTERN = re.compile(r'runs-\d+-\d+$')
+RATE_PATTERN = re.compile(rb'Node generation rate after \d+K generations \(nodes/sec\.\): (\d+(?:\.\d+)?)')
+WALL_CLOCK_PATTERN = re.compile(r'planner wall-clock time: (\d+(?:\.\d+)?)s')
+
+
+def _get_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _read_new_output(path, offset):
+    """
+    Return the complete lines appended to the file *path* since *offset* (at most the last
+    MAX_TAIL_BYTES of them) and the offset up to which the file has been read.
+    """
+    size = _get_size(path)
+    if size < offset:
+        offset = 0  # The file was truncated or replaced.
+    if size == offset:
+        return b'', offset
+    start = max(offset, size - MAX_TAIL_BYTES)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(size - start)
+    end = data.rfind(b'\n') + 1
+    return data[:end], start + end
+
+
+def _quantiles(values):
+    """ Return the minimum, quartiles and maximum of *values*. """
+    values = sorted(values)
+    if len(values) == 1:
+        return values * 5
+    quartiles = statistics.quantiles(values, n=4, method='inclusive')
+    return [values[0]] + quartiles + [values[-1]]
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return 'unknown'
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return '{}m'.format(minutes)
+    hours, minutes = divmod(minutes, 60)
+    if hours < 48:
+        return '{}h {:02d}m'.format(hours, minutes)
+    return '{}d {:02d}h'.format(*divmod(hours, 24))
+
+
+class ExperimentMonitor(object):
+    """ Incrementally scan the run directories of the experiment in *exp_dir*. """
+    def __init__(self, exp_dir, state_file=None):
+        self.exp_dir = exp_dir
+        self.state_file = state_file or os.path.join(exp_dir, STATE_FILENAME)
+        self.groups = {}
+        self.runs = {}
+        self._archive_mtime = None
+        self._archived_run_dirs = set()
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                state = json.load(f)
+            if state.get('version') == STATE_VERSION:
+                self.groups = state['groups']
+                self.runs = state['runs']
+
+    def write_state(self):
+        tmp_file = '{}.{}.tmp'.format(self.state_file, os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump({'version': STATE_VERSION, 'groups': self.groups, 'runs': self.runs}, f)
+        os.replace(tmp_file, self.state_file)
+
+    def _list_run_dirs(self):
+        """ Return the run directories relative to the experiment, listing only changed groups. """
+        groups = {}
+        for entry in os.scandir(self.exp_dir):
+            if not RUNS_DIR_PATTERN.match(entry.name) or not entry.is_dir():
+                continue
+            mtime = entry.stat().st_mtime_ns
+            group = self.groups.get(entry.name)
+            if group is None or group['mtime'] != mtime:
+                group = {'mtime': mtime, 'runs': sorted(
+                    run.name for run in os.scandir(entry.path) if run.is_dir())}
+            groups[entry.name] = group
+        self.groups = groups
+        return [os.path.join(name, run) for name, group in sorted(groups.items()) for run in group['runs']]
+
+    def _read_finished_run(self, run_dir, properties_file):
+        with open(properties_file) as f:
+            props = json.load(f)
+        planner_time = None
+        try:
+            with open(os.path.join(run_dir, 'driver.log')) as f:
+                match = WALL_CLOCK_PATTERN.search(f.read())
+            if match:
+                planner_time = float(match.group(1))
+        except FileNotFoundError:
+            pass
+        failed = (props.get('unexplained_errors') or _get_size(os.path.join(run_dir, 'driver.err')) or
+                  _get_size(os.path.join(run_dir, 'run.err')))
+        return {
+            'status': FAILED if failed else FINISHED,
+            'mtime': os.stat(properties_file).st_mtime_ns,
+            'finished': os.path.getmtime(properties_file),
+            'planner_time': planner_time,
+            'solved': bool(props.get('coverage')),
+        }
+
+    def _is_done(self, rel_dir, entry):
+        """ Return whether the run has finished and its properties have not changed since. """
+        if entry is None or entry['status'] not in (FINISHED, FAILED):
+            return False
+        try:
+            return os.stat(os.path.join(self.exp_dir, rel_dir, 'properties')).st_mtime_ns == entry['mtime']
+        except FileNotFoundError:
+            return False
+
+    def _update_run(self, rel_dir, now):
+        entry = self.runs.get(rel_dir)
+        run_dir = os.path.join(self.exp_dir, rel_dir)
+        try:
+            mtime = os.stat(run_dir).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if entry is not None and entry['status'] == PENDING and entry['mtime'] == mtime:
+            return entry
+
+        properties_file = os.path.join(run_dir, 'properties')
+        if os.path.exists(properties_file):
+            return self._read_finished_run(run_dir, properties_file)
+        try:
+            started = os.path.getmtime(os.path.join(run_dir, 'driver.log'))
+        except FileNotFoundError:
+            return {'status': PENDING, 'mtime': mtime}
+
+        if entry is None or entry['status'] != RUNNING:
+            entry = {'status': RUNNING, 'started': started, 'offset': 0, 'rate': None}
+        entry['elapsed'] = now - entry['started']
+        output, entry['offset'] = _read_new_output(os.path.join(run_dir, 'run.log'), entry['offset'])
+        rates = RATE_PATTERN.findall(output)
+        if rates:
+            entry['rate'] = float(rates[-1])
+        return entry
+
+    def _get_archived_run_dirs(self):
+        """ Return the (cached) set of run directories that were packed into the experiment's archive. """
+        index_file = os.path.join(get_archive_dir(self.exp_dir), INDEX_FILENAME)
+        try:
+            mtime = os.stat(index_file).st_mtime_ns
+        except FileNotFoundError:
+            return set()
+        if mtime != self._archive_mtime:
+            with open(index_file) as f:
+                runs = json.load(f)['runs']
+            self._archived_run_dirs = {entry['run_dir'] for entry in runs.values()}
+            self._archive_mtime = mtime
+        return self._archived_run_dirs
+
+    def scan(self, window=DEFAULT_WINDOW):
+        """ Update the state of all runs that may have changed and return a summary (see :meth:`summarize`). """
+        now = time.time()
+        run_dirs = self._list_run_dirs()
+        runs = {}
+        for rel_dir in run_dirs:
+            entry = self.runs.get(rel_dir)
+            if not self._is_done(rel_dir, entry):
+                entry = self._update_run(rel_dir, now)
+            if entry is not None:
+                runs[rel_dir] = entry
+        # Finished runs whose directories were archived in the meantime are kept.
+        for rel_dir, entry in self.runs.items():
+            if rel_dir not in runs and entry['status'] in (FINISHED, FAILED):
+                runs[rel_dir] = entry
+        self.runs = runs
+        self.write_state()
+        return self.summarize(now, window)
+
+    def summarize(self, now, window=DEFAULT_WINDOW):
+        """
+        Return a dictionary with the number of runs per status, the wall-clock hours spent in the
+        planner runs, the quantiles of the node generation rates of the running runs, the throughput
+        (finished runs per hour) over the last *window* seconds and the estimated time to completion
+        in seconds.
+        """
+        counts = {status: 0 for status in [PENDING, RUNNING, FINISHED, FAILED]}
+        solved = 0
+        planner_time = 0.0
+        rates = []
+        finish_times = []
+        for entry in self.runs.values():
+            counts[entry['status']] += 1
+            if entry['status'] == RUNNING:
+                planner_time += entry['elapsed']
+                if entry['rate'] is not None:
+                    rates.append(entry['rate'])
+            elif entry['status'] in (FINISHED, FAILED):
+                solved += entry['solved']
+                planner_time += entry['planner_time'] or 0.0
+                finish_times.append(entry['finished'])
+        archived = len(self._get_archived_run_dirs() - set(self.runs))
+
+        recent = [t for t in finish_times if t >= now - window]
+        throughput = eta = None
+        if len(recent) >= 2:
+            throughput = len(recent) / (now - min(recent)) * 3600
+        elif len(finish_times) >= 2:
+            throughput = len(finish_times) / (now - min(finish_times)) * 3600
+        remaining = counts[PENDING] + counts[RUNNING]
+        if throughput:
+            eta = remaining / throughput * 3600
+        elif remaining == 0:
+            eta = 0.0
+
+        return dict(
+            counts, total=len(self.runs) + archived, archived=archived, solved=solved,
+            planner_hours=planner_time / 3600,
+            rate_quantiles=_quantiles(rates) if rates else None,
+            throughput=throughput, eta=eta)
+
+
+def format_summary(exp_dir, summary):
+    lines = [
+        'Experiment: {}'.format(os.path.abspath(exp_dir)),
+        'Runs: {total} total, {finished} finished, {failed} failed, {running} running, {pending} pending'.format(
+            **summary),
+        'Solved: {solved}{}'.format(
+            ', not counting {archived} archived runs'.format(**summary) if summary['archived'] else '', **summary),
+        'Planner time: {:.1f} hours (wall-clock)'.format(summary['planner_hours']),
+    ]
+    if summary['rate_quantiles']:
+        lines.append(
+            'Node generation rate of running runs (nodes/sec.): min {:.0f}, 25% {:.0f}, median {:.0f}, '
+            '75% {:.0f}, max {:.0f}'.format(*summary['rate_quantiles']))
+    throughput = summary['throughput']
+    lines.append('Throughput: {} runs/hour, estimated time to completion: {}'.format(
+        'unknown' if throughput is None else '{:.1f}'.format(throughput), format_duration(summary['eta'])))
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Show the progress of a running FS experiment.')
+    parser.add_argument('exp_dir', help='experiment directory')
+    parser.add_argument('--watch', type=float, metavar='SECONDS',
+                        help='scan again every SECONDS seconds until all runs are finished')
+    parser.add_argument('--window', type=float, default=DEFAULT_WINDOW, metavar='SECONDS',
+                        help='time window for the throughput estimate (default: %(default)s)')
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    parser.add_argument('--reset', action='store_true', help='discard the state of previous scans')
+    args = parser.parse_args(args)
+
+    if not os.path.isdir(args.exp_dir):
+        sys.exit('{} is not a directory'.format(args.exp_dir))
+    if args.reset and os.path.exists(os.path.join(args.exp_dir, STATE_FILENAME)):
+        os.remove(os.path.join(args.exp_dir, STATE_FILENAME))
+    monitor = ExperimentMonitor(args.exp_dir)
+    while True:
+        summary = monitor.scan(window=args.window)
+        print(json.dumps(summary) if args.json else format_summary(args.exp_dir, summary), flush=True)
+        if args.watch is None or summary['pending'] + summary['running'] == 0:
+            break
+        time.sleep(args.watch)
+        if not args.json:
+            print()
+
+
+if __name__ == '__main__':
+    main()
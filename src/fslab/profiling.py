@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+Optional profiling of selected planner runs.
+
+An experiment can profile a deterministic sample of its runs, or only the runs of some domains or
+algorithms, with one of two profilers:
+
+- "rss": a thread of the run script samples the resident set size of the planner process tree
+  from ``/proc/<pid>/status`` at a fixed interval and writes it to ``rss.tsv``.
+- "perf": the planner command is wrapped in ``perf record``, which writes ``perf.data``. Before
+  parsing, ``perf report`` summarizes the profile into ``perf.txt``.
+
+All files are written into the run directory, next to ``run.log``, and the parser turns them into
+the ``rss_*`` and ``perf_*`` properties.
+"""
+
+import logging
+import os
+import subprocess
+import threading
+import time
+import zlib
+
+from lab import tools
+
+
+RSS = 'rss'
+PERF = 'perf'
+PROFILERS = [RSS, PERF]
+
+RSS_LOG = 'rss.tsv'
+PERF_DATA = 'perf.data'
+PERF_REPORT = 'perf.txt'
+
+
+class ProfilingOptions(object):
+    """
+    Select the runs to profile and the profiler to use.
+
+    A run is profiled if its algorithm is in *algorithms* (default: all) and its domain is in
+    *domains* (default: all), and if it belongs to the sample of runs given by *sample_rate*
+    (a fraction between 0 and 1). The sample is determined by a hash of the algorithm, domain and
+    problem, so the same runs are selected whenever the experiment is built.
+
+    *rss_interval* is the sampling interval of the "rss" profiler in seconds. *perf_frequency* is
+    the sampling frequency of the "perf" profiler in Hz; if *perf_call_graph* is True, perf also
+    records call graphs, at a higher overhead.
+    """
+    def __init__(self, profiler=RSS, sample_rate=1.0, domains=None, algorithms=None,
+                 rss_interval=0.1, perf_frequency=99, perf_call_graph=False):
+        if profiler not in PROFILERS:
+            logging.critical('Profiler {} not in {}'.format(profiler, PROFILERS))
+        if not 0 <= sample_rate <= 1:
+            logging.critical('The profiling sample rate must be between 0 and 1: {}'.format(sample_rate))
+        self.profiler = profiler
+        self.sample_rate = sample_rate
+        self.domains = None if domains is None else set(tools.make_list(domains))
+        self.algorithms = None if algorithms is None else set(tools.make_list(algorithms))
+        self.rss_interval = rss_interval
+        self.perf_frequency = perf_frequency
+        self.perf_call_graph = perf_call_graph
+
+    def is_selected(self, algorithm, task):
+        if self.algorithms is not None and algorithm not in self.algorithms:
+            return False
+        if self.domains is not None and task.domain not in self.domains:
+            return False
+        key = '{}:{}:{}'.format(algorithm, task.domain, task.problem).encode('utf-8')
+        return zlib.crc32(key) / 2**32 < self.sample_rate
+
+    def wrap_command(self, cmd):
+        """ Return the command that runs *cmd* under the profiler. """
+        if self.profiler != PERF:
+            return cmd
+        perf_cmd = ['perf', 'record', '--quiet', '-F', str(self.perf_frequency), '-o', PERF_DATA]
+        if self.perf_call_graph:
+            perf_cmd.append('-g')
+        return perf_cmd + ['--'] + cmd
+
+    def get_call_kwargs(self):
+        """ Return the additional keyword arguments for :class:`fslab.call.Call`. """
+        if self.profiler != RSS:
+            return {}
+        return {'rss_log': RSS_LOG, 'rss_interval': self.rss_interval}
+
+
+def _get_process_tree(pid):
+    pids = [pid]
+    for current in pids:
+        try:
+            with open('/proc/{}/task/{}/children'.format(current, current)) as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def _get_rss(pid):
+    """ Return the resident set size of the process in KiB, or None if it has terminated. """
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    # Zombie processes have no VmRSS entry.
+    return None
+
+
+class RssSampler(threading.Thread):
+    """
+    Periodically write the elapsed time and the total resident set size (in KiB) of the process
+    tree rooted at *pid* to *filename*, until :meth:`stop` is called or the process terminates.
+    """
+    def __init__(self, pid, filename, interval):
+        super().__init__(name='rss-sampler', daemon=True)
+        self.pid = pid
+        self.filename = filename
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        start = time.time()
+        with open(self.filename, 'w') as f:
+            f.write('time\trss\n')
+            while not self._stopped.is_set():
+                sizes = [_get_rss(pid) for pid in _get_process_tree(self.pid)]
+                if sizes[0] is None:
+                    break
+                f.write('{:.3f}\t{}\n'.format(time.time() - start, sum(s for s in sizes if s is not None)))
+                self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def write_perf_report(run_dir='.', max_symbols=50):
+    """ Summarize the perf profile of the run, if there is one, into a textual report. """
+    data = os.path.join(run_dir, PERF_DATA)
+    report = os.path.join(run_dir, PERF_REPORT)
+    if not os.path.exists(data) or os.path.exists(report):
+        return
+    cmd = ['perf', 'report', '--stdio', '--no-children', '--percent-limit', '0.1',
+           '--sort', 'dso,symbol', '-i', data]
+    try:
+        output = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as err:
+        logging.error('Could not summarize {}: {}'.format(data, err))
+        return
+    # Keep the header and the most expensive symbols only.
+    lines = output.splitlines()
+    header = [line for line in lines if line.startswith('#')]
+    symbols = [line for line in lines if line.strip() and not line.startswith('#')]
+    tools.write_file(report, '\n'.join(header + symbols[:max_symbols]) + '\n')
@@ -1,105 +1,114 @@
 # -*- coding: utf-8 -*-
 
-from collections import defaultdict
+import logging
 
 from matplotlib import ticker
+import numpy as np
 
 from downward.reports.scatter import ScatterPlotReport
-from downward.reports.plot import PlotReport, Matplotlib, MatplotlibPlot
+
+from .reports import ColumnarDataMixin
+from .scatter import LargeScatterMatplotlib, LargeScatterMixin
 
 
 # TODO: handle outliers
 
-# TODO: this is mostly copied from ScatterMatplotlib (scatter.py)
-class RelativeScatterMatplotlib(Matplotlib):
+class RelativeScatterMatplotlib(LargeScatterMatplotlib):
     @classmethod
-    def _plot(cls, report, axes, categories, styles):
+    def _plot(cls, report, axes):
         # Display grid
-        axes.grid(b=True, linestyle='-', color='0.75')
+        axes.grid(True, linestyle='-', color='0.75')
 
-        has_points = False
         # Generate the scatter plots
-        for category, coords in sorted(categories.items()):
-            X, Y = zip(*coords)
-            axes.scatter(X, Y, s=42, label=category, **styles[category])
-            if X and Y:
-                has_points = True
-
-        if report.xscale == 'linear' or report.yscale == 'linear':
-            plot_size = report.missing_val * 1.01
-        else:
-            plot_size = report.missing_val * 1.25
+        cls._plot_points(report, axes, s=42)
 
         # make 5 ticks above and below 1
-        yticks = []
         tick_step = report.ylim_top**(1/5.0)
-        for i in xrange(-5, 6):
-            yticks.append(tick_step**i)
-        axes.set_yticks(yticks)
+        axes.set_yticks(tick_step ** np.arange(-5, 6))
         axes.get_yaxis().set_major_formatter(ticker.ScalarFormatter())
 
-        axes.set_xlim(report.xlim_left or -1, report.xlim_right or plot_size)
-        axes.set_ylim(report.ylim_bottom or -1, report.ylim_top or plot_size)
+        axes.set_xlim(left=report.xlim_left)
+        axes.set_ylim(report.ylim_bottom, report.ylim_top)
 
-        for axis in [axes.xaxis, axes.yaxis]:
-            MatplotlibPlot.change_axis_formatter(
-                axis,
-                report.missing_val if report.show_missing else None)
-        return has_points
 
-
-class RelativeScatterPlotReport(ScatterPlotReport):
+class RelativeScatterPlotReport(ColumnarDataMixin, LargeScatterMixin, ScatterPlotReport):
     """
     Generate a scatter plot that shows a relative comparison of two
     algorithms with regard to the given attribute. The attribute value
     of algorithm 1 is shown on the x-axis and the relation to the value
     of algorithm 2 on the y-axis.
+
+    Only tasks for which both algorithms have a positive value are shown.
+    Plots with many points are rasterized or drawn as a density plot, see
+    :class:`fslab.scatter.LargeScatterMixin`.
     """
 
     def __init__(self, show_missing=True, get_category=None, **kwargs):
-        ScatterPlotReport.__init__(self, show_missing, get_category, **kwargs)
-        if self.output_format == 'tex':
-            raise "not supported"
-        else:
-            self.writer = RelativeScatterMatplotlib
-
-    def _fill_categories(self, runs):
-        # We discard the *runs* parameter.
-        # Map category names to value tuples
-        categories = defaultdict(list)
-        self.ylim_bottom = 2
-        self.ylim_top = 0.5
-        self.xlim_left = float("inf")
-        for (domain, problem), runs in self.problem_runs.items():
-            if len(runs) != 2:
+        if kwargs.get('format') == 'tex':
+            logging.critical('Relative scatter plots do not support the "tex" format.')
+        super().__init__(relative=True, show_missing=show_missing, get_category=get_category, **kwargs)
+        self.writer = RelativeScatterMatplotlib
+
+    def _get_aligned_values(self):
+        """ Return the category of each task with values for both algorithms, along with the value
+        vectors of the two algorithms, aligned by task. """
+        if len(self.algorithms) != 2:
+            logging.critical('Relative scatter plots compare exactly two algorithms: {}'.format(self.algorithms))
+        algo1, algo2 = self.algorithms
+        categories, values1, values2 = [], [], []
+        for runs in self.problem_runs.values():
+            # The runs of a task follow the order of the run IDs, not that of self.algorithms.
+            by_algorithm = {run['algorithm']: run for run in runs}
+            if len(runs) != 2 or algo1 not in by_algorithm or algo2 not in by_algorithm:
                 continue
-            run1, run2 = runs
-            assert (run1['algorithm'] == self.algorithms[0] and
-                    run2['algorithm'] == self.algorithms[1])
+            run1, run2 = by_algorithm[algo1], by_algorithm[algo2]
             val1 = run1.get(self.attribute)
             val2 = run2.get(self.attribute)
             if val1 is None or val2 is None:
                 continue
-            category = self.get_category(run1, run2)
-            assert val1 > 0, (domain, problem, self.algorithms[0], val1)
-            assert val2 > 0, (domain, problem, self.algorithms[1], val2)
-            x = val1
-            y = val2 / float(val1)
-
-            categories[category].append((x, y))
-
-            self.ylim_top = max(self.ylim_top, y)
-            self.ylim_bottom = min(self.ylim_bottom, y)
-            self.xlim_left = min(self.xlim_left, x)
-
-        # center around 1
-        if self.ylim_bottom < 1:
-            self.ylim_top = max(self.ylim_top, 1 / float(self.ylim_bottom))
-        if self.ylim_top > 1:
-            self.ylim_bottom = min(self.ylim_bottom, 1 / float(self.ylim_top))
-        return categories
-
-    def _set_scales(self, xscale, yscale):
-        # ScatterPlot uses log-scaling on the x-axis by default.
-        PlotReport._set_scales(
-            self, xscale or self.attribute.scale or 'log', 'log')
\ No newline at end of file
+            categories.append(self.get_category(run1, run2))
+            values1.append(val1)
+            values2.append(val2)
+        return categories, np.array(values1, dtype=np.float64), np.array(values2, dtype=np.float64)
+
+    def _fill_categories(self):
+        """ Map category names to (x, y) array pairs, where x holds the values of the first algorithm
+        and y the ratio between the values of the second and the first algorithm. """
+        categories, x, y = self._get_aligned_values()
+
+        positive = (x > 0) & (y > 0)
+        num_discarded = len(x) - np.count_nonzero(positive)
+        if num_discarded:
+            logging.warning('Ignoring {} tasks with non-positive values for {} in the relative scatter plot'.format(
+                num_discarded, self.attribute))
+        ratios = y[positive] / x[positive]
+        x = x[positive]
+        if not len(x):
+            return {}
+
+        # Center the y-axis around 1.
+        self.ylim_top = max(ratios.max(), 1 / ratios.min(), 1.1)
+        self.ylim_bottom = 1 / self.ylim_top
+        self.xlim_left = x.min()
+
+        # Group the points by category with a single sort instead of one pass per category.
+        names = sorted(set(categories), key=lambda c: (c is not None, c))
+        code_of = {name: code for code, name in enumerate(names)}
+        point_codes = np.fromiter((code_of[c] for c in categories), dtype=np.intp, count=len(categories))[positive]
+        order = np.argsort(point_codes, kind='stable')
+        bounds = np.searchsorted(point_codes[order], np.arange(len(names) + 1))
+        result = {}
+        for code, name in enumerate(names):
+            indices = order[bounds[code]:bounds[code + 1]]
+            if len(indices):
+                result[name] = (x[indices], ratios[indices])
+        return result
+
+    def _write_plot(self, runs, filename):
+        self.categories = self._fill_categories()
+        if not self.categories:
+            logging.critical('Plot contains no points.')
+        self.plot_diagonal_line = False
+        self.plot_horizontal_line = True
+        self.styles = self._get_category_styles(self.categories)
+        self.writer.write(self, filename)
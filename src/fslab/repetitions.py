@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""
+Repeated runs of each algorithm on each task.
+
+Timing attributes of a single run are noisy samples, especially on shared cluster nodes. An
+experiment with ``repetitions=K`` (see :class:`~fslab.experiment.FSExperiment`) runs every algorithm
+K times on every task, and the fetcher merges the K runs into a single run, in which each timing
+attribute holds the median of its samples and is accompanied by
+
+- ``<attribute>_iqr``: the interquartile range of the samples,
+- ``<attribute>_ci_low``, ``<attribute>_ci_high``: a distribution-free confidence interval for
+  the median, based on order statistics, and
+- ``<attribute>_samples``: the samples themselves.
+
+The repetitions of a run do not always have the same outcome, e.g. when one of them hits the time
+limit. The merged run takes the outcome (``coverage`` and ``error``) shared by most repetitions,
+and all other attributes, including the samples of the timing attributes, only come from the
+repetitions with this outcome, the first of which provides the non-timing attributes. Their
+number is stored in ``matching_repetitions``. The unexplained errors are collected from all
+repetitions. The comparative reports use the confidence intervals to flag which differences are
+statistically significant.
+"""
+
+import math
+import statistics
+
+from lab import tools
+
+
+TIMING_ATTRIBUTES = ['search_time', 'total_time', 'node_generation_rate']
+DEFAULT_CONFIDENCE = 0.95
+
+
+def get_ci_attributes(attribute):
+    return [attribute + '_ci_low', attribute + '_ci_high']
+
+
+def median_confidence_interval(values, confidence=DEFAULT_CONFIDENCE):
+    """
+    Return the narrowest interval [x_(j), x_(n-j+1)] between order statistics of *values* that
+    contains the median of the distribution with probability at least *confidence*. If there are
+    too few values for the requested confidence, the whole range of values is returned.
+    """
+    values = sorted(values)
+    n = len(values)
+    alpha = 1 - confidence
+    # The number of values below the median follows a Binomial(n, 1/2) distribution.
+    j = 0
+    cumulative = 0.0
+    while j < n // 2:
+        cumulative += math.comb(n, j) / 2 ** n
+        if 2 * cumulative > alpha:
+            break
+        j += 1
+    j = max(j, 1)
+    return values[j - 1], values[n - j]
+
+
+def summarize_samples(values, confidence=DEFAULT_CONFIDENCE):
+    """ Return the median, the interquartile range and the confidence interval of the median of *values*. """
+    if len(values) == 1:
+        q1 = q3 = values[0]
+    else:
+        q1, _, q3 = statistics.quantiles(values, n=4, method='inclusive')
+    ci_low, ci_high = median_confidence_interval(values, confidence)
+    return {'median': statistics.median(values), 'iqr': q3 - q1, 'ci_low': ci_low, 'ci_high': ci_high}
+
+
+def get_outcome(run):
+    return run.get('coverage'), run.get('error')
+
+
+def merge_repetitions(runs, attributes=None, confidence=DEFAULT_CONFIDENCE):
+    """
+    Merge the repetitions *runs* of one algorithm on one task into a single run, with the most
+    common outcome among the repetitions (see the module documentation).
+    """
+    attributes = TIMING_ATTRIBUTES if attributes is None else attributes
+    runs = sorted(runs, key=lambda run: run.get('repetition', 0))
+    outcomes = [get_outcome(run) for run in runs]
+    # Ties are broken in favor of the earlier repetition.
+    outcome = max(outcomes, key=lambda outcome: (outcomes.count(outcome), -outcomes.index(outcome)))
+    matching = [run for run in runs if get_outcome(run) == outcome]
+    merged = dict(matching[0])
+    merged.pop('repetition', None)
+    merged['id'] = runs[0]['id'][:3]
+    merged['repetitions'] = len(runs)
+    merged['matching_repetitions'] = len(matching)
+    errors = []
+    for run in runs:
+        errors.extend(error for error in run.get('unexplained_errors', []) if error not in errors)
+    if errors:
+        merged['unexplained_errors'] = errors
+    for attribute in attributes:
+        samples = [run[attribute] for run in matching if run.get(attribute) is not None]
+        if not samples:
+            continue
+        summary = summarize_samples(samples, confidence)
+        merged[attribute] = summary['median']
+        merged[attribute + '_iqr'] = summary['iqr']
+        merged[attribute + '_ci_low'] = summary['ci_low']
+        merged[attribute + '_ci_high'] = summary['ci_high']
+        merged[attribute + '_samples'] = samples
+    return merged
+
+
+def aggregate_repetitions(props, attributes=None, confidence=DEFAULT_CONFIDENCE):
+    """
+    Return a new :class:`lab.tools.Properties` object in which the repetitions of each algorithm
+    on each task in *props* are merged (see :func:`merge_repetitions`). Runs without repetitions
+    are kept unchanged.
+    """
+    groups = {}
+    for run_id, run in props.items():
+        if 'repetition' in run:
+            groups.setdefault('-'.join(run['id'][:3]), []).append(run)
+        else:
+            groups[run_id] = [run]
+    aggregated = tools.Properties()
+    for run_id, runs in groups.items():
+        if len(runs) == 1 and 'repetition' not in runs[0]:
+            aggregated[run_id] = runs[0]
+        else:
+            aggregated[run_id] = merge_repetitions(runs, attributes, confidence)
+    return aggregated
+
+
+def is_significant(run1, run2, attribute):
+    """
+    Return whether the values of *attribute* in the two merged runs differ significantly, i.e.,
+    whether the confidence intervals of their medians are disjoint, or None if the runs were not
+    repeated. Disjoint intervals are a conservative criterion for a significant difference.
+    """
+    low, high = get_ci_attributes(attribute)
+    if any(run.get(low) is None or run.get(high) is None for run in [run1, run2]):
+        return None
+    return run1[high] < run2[low] or run2[high] < run1[low]
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+
+"""
+Report classes for FS experiments.
+
+These are thin wrappers around the Downward Lab reports that load the experiment data from a
+shared :class:`~fslab.dataset.RunDataset` or from the columnar store written by
+:class:`~fslab.fetcher.FSFetcher`, if available, reading only the attributes that the report
+actually needs.
+"""
+
+from collections import deque
+from concurrent import futures
+from fnmatch import fnmatch
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+
+from downward.reports import PlanningReport
+from downward.reports.absolute import AbsoluteReport
+from downward.reports.compare import ComparativeReport, DiffColumnsModule
+from lab import reports, tools
+from lab.reports import Table
+
+from .dataset import RunSlice
+from .repetitions import get_ci_attributes, is_significant
+from .store import ColumnarStore, has_store
+from .version import __version__
+
+
+def __getattr__(name):
+    # The scatter plot report lives in fslab.scatter, so that importing this module does not
+    # import matplotlib.
+    if name == 'FSScatterPlotReport':
+        from .scatter import FSScatterPlotReport
+        return FSScatterPlotReport
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+# Attributes that the planning reports access directly, regardless of the attributes being reported.
+BASE_ATTRIBUTES = ['id', 'domain', 'problem', 'algorithm', 'run_dir', 'unexplained_errors', 'error', 'node']
+
+
+class ColumnarDataMixin(object):
+    """
+    Mixin for lab reports that loads the data from the columnar store of the evaluation directory.
+
+    Besides the attributes of the report, filters might need additional attributes. The names
+    of the attributes used by *filter_<attribute>* keyword arguments are detected automatically,
+    but attributes used within filter functions must be listed in *extra_attributes*.
+
+    If a *dataset* is given, the runs are taken from it instead of being read from disk, which
+    allows several reports to share the data loaded by the first one of them.
+    """
+    def __init__(self, *args, extra_attributes=None, dataset=None, **kwargs):
+        self.extra_attributes = tools.make_list(extra_attributes)
+        self.dataset = dataset
+        super().__init__(*args, **kwargs)
+
+    def get_required_attributes(self, available):
+        """ Return the subset of the *available* attributes that the report needs. """
+        if not self.attributes:
+            # The report will use all numerical attributes.
+            return list(available)
+        required = set(BASE_ATTRIBUTES) | set(self.extra_attributes) | set(self.run_filter.filtered_attributes)
+        required |= set(getattr(self, 'INFO_ATTRIBUTES', [])) | set(getattr(self, 'ERROR_ATTRIBUTES', []))
+        for pattern in self.attributes:
+            required |= {attr for attr in available if fnmatch(attr, pattern)}
+        return [attr for attr in available if attr in required]
+
+    def _get_preselected_algorithms(self):
+        """ Return the algorithms whose runs the report will use, if they are known in advance. """
+        filter_algorithm = getattr(self, 'filter_algorithm', None)
+        # Filter functions are applied before any filter_* kwarg and might rename algorithms.
+        only_kwarg_filters = len(self.run_filter.filters) == len(self.run_filter.filtered_attributes)
+        if filter_algorithm and only_kwarg_filters:
+            return filter_algorithm
+        return None
+
+    def _load_data(self):
+        if self.dataset is not None:
+            attributes = self.get_required_attributes(self.dataset.attributes)
+            self.props = self.dataset.select(algorithms=self._get_preselected_algorithms(), attributes=attributes)
+            if not self.props:
+                logging.critical('The shared dataset contains no runs for this report.')
+            return
+
+        if not has_store(self.eval_dir):
+            return super()._load_data()
+
+        store = ColumnarStore(self.eval_dir)
+        attributes = self.get_required_attributes(store.attributes)
+        logging.info('Reading {} of {} attributes from the columnar store'.format(
+            len(attributes), len(store.attributes)))
+        self.props = tools.Properties()
+        self.props.update(store.load(attributes))
+        logging.info('Reading columnar store finished')
+        if not self.props:
+            logging.critical('columnar store in evaluation dir is empty.')
+
+
+class FSAbsoluteReport(ColumnarDataMixin, AbsoluteReport):
+    """ See :class:`downward.reports.absolute.AbsoluteReport` """
+
+
+class SignificanceDiffColumnsModule(DiffColumnsModule):
+    """
+    Diff columns that flag statistically significant differences: the difference in a row is
+    followed by "*" if it is significant, and greyed out if it is not. Rows without significance
+    information are left unchanged.
+    """
+    def __init__(self, algorithm_pairs, summary_functions):
+        super().__init__(algorithm_pairs, summary_functions)
+        self.significant = {}  # Maps (row name, diff column name) to a bool
+
+    def format(self, table, formatted_cells):
+        super().format(table, formatted_cells)
+        for (row_name, diff_col_name), significant in self.significant.items():
+            formatted_value = formatted_cells[row_name].get(diff_col_name)
+            if formatted_value is None:
+                continue
+            if significant:
+                formatted_cells[row_name][diff_col_name] = formatted_value + ' *'
+            else:
+                formatted_cells[row_name][diff_col_name] = re.sub(r'\|color:\w+\}', '|color:grey}', formatted_value)
+
+
+class FSComparativeReport(ColumnarDataMixin, ComparativeReport):
+    """
+    See :class:`downward.reports.compare.ComparativeReport`
+
+    If the runs were repeated (see :mod:`fslab.repetitions`), the per-task tables flag which
+    differences are statistically significant (see :class:`SignificanceDiffColumnsModule`), i.e.,
+    those for which the confidence intervals of the medians of both algorithms are disjoint.
+    """
+    def get_required_attributes(self, available):
+        required = super().get_required_attributes(available)
+        ci_attributes = {ci_attr for attr in required for ci_attr in get_ci_attributes(attr)}
+        return required + [attr for attr in available if attr in ci_attributes and attr not in required]
+
+    def _get_empty_table(self, attribute=None, title=None, columns=None):
+        table = AbsoluteReport._get_empty_table(self, attribute=attribute, title=title, columns=columns)
+        summary_functions = [] if title == 'Summary' else [sum, reports.arithmetic_mean]
+        table.dynamic_data_modules.append(SignificanceDiffColumnsModule(self._algorithm_pairs, summary_functions))
+        return table
+
+    def _get_domain_table(self, attribute, domain):
+        table = super()._get_domain_table(attribute, domain)
+        module = table.dynamic_data_modules[-1]
+        runs = {}
+        for algo in self.algorithms:
+            for run in self.domain_algorithm_runs[domain, algo]:
+                runs[run['problem'], algo] = run
+        for (algo1, algo2), _, diff_col_name in module.header_names:
+            for problem in table.row_names:
+                run1, run2 = runs.get((problem, algo1)), runs.get((problem, algo2))
+                if run1 is None or run2 is None:
+                    continue
+                significant = is_significant(run1, run2, attribute)
+                if significant is not None:
+                    module.significant[problem, diff_col_name] = significant
+        return table
+
+
+class FSPhaseReport(ColumnarDataMixin, PlanningReport):
+    """
+    Compare the CPU time, wall-clock time and memory delta of each phase of the planner (the
+    ``phase_<name>_{cpu,wall,mem}`` attributes parsed by fsparser) between algorithms.
+
+    Each cell holds the sum over the tasks for which all algorithms report the phase. For each
+    pair of algorithms in *algorithm_pairs*, a column with the relative change (in percent) from
+    the first to the second algorithm is added.
+    """
+    PHASE_KINDS = [('cpu', 'CPU time (s)'), ('wall', 'wall-clock time (s)'), ('mem', 'memory delta (MB)')]
+
+    def __init__(self, algorithm_pairs=None, **kwargs):
+        kwargs.setdefault('attributes', ['phase_*'])
+        self.algorithm_pairs = algorithm_pairs or []
+        super().__init__(**kwargs)
+
+    def _get_phases(self):
+        phases = set()
+        for attr in self.attributes:
+            match = re.match(r'phase_(.+)_(cpu|wall|mem)$', str(attr))
+            if match:
+                phases.add(match.group(1))
+        return sorted(phases)
+
+    def _get_table(self, kind, title):
+        table = Table(title='Phase {}'.format(title))
+        change_columns = ['Change % ({} vs. {})'.format(algo2, algo1) for algo1, algo2 in self.algorithm_pairs]
+        table.set_column_order(self.algorithms + change_columns + ['tasks'])
+        for phase in self._get_phases():
+            attr = 'phase_{}_{}'.format(phase, kind)
+            # The runs of a task follow the order of the run IDs, not that of self.algorithms.
+            by_algorithm = [{run['algorithm']: run for run in runs} for runs in self.problem_runs.values()]
+            common = [runs for runs in by_algorithm
+                      if all(runs.get(algorithm, {}).get(attr) is not None for algorithm in self.algorithms)]
+            if not common:
+                continue
+            totals = {}
+            for algorithm in self.algorithms:
+                totals[algorithm] = sum(runs[algorithm][attr] for runs in common)
+                table.add_cell(phase, algorithm, totals[algorithm])
+            table.add_cell(phase, 'tasks', len(common))
+            for (algo1, algo2), column in zip(self.algorithm_pairs, change_columns):
+                change = None
+                if totals.get(algo1) and algo2 in totals:
+                    change = (totals[algo2] - totals[algo1]) / abs(totals[algo1]) * 100
+                table.add_cell(phase, column, change)
+        return table
+
+    def get_markup(self):
+        tables = [self._get_table(kind, title) for kind, title in self.PHASE_KINDS]
+        return '\n'.join(str(table) for table in tables if table)
+
+
+def get_domain_category(run1, run2):
+    """ Scatter-plot category function that groups the points by domain. """
+    return run1['domain']
+
+
+class ReportJob(object):
+    """ The description of a report to be made: *report_class(\*args, \*\*kwargs)* written to *outfile*. """
+    def __init__(self, report_class, outfile, *args, **kwargs):
+        self.report_class = report_class
+        self.outfile = outfile
+        self.args = args
+        self.kwargs = kwargs
+
+    def make_report(self, **extra_kwargs):
+        kwargs = dict(self.kwargs)
+        kwargs.update(extra_kwargs)
+        return self.report_class(*self.args, **kwargs)
+
+    def is_picklable(self):
+        try:
+            pickle.dumps((self.report_class, self.args, self.kwargs))
+        except (pickle.PicklingError, AttributeError, TypeError):
+            return False
+        return True
+
+
+def _describe_object(obj):
+    """ JSON fallback for report arguments such as functions and classes. """
+    return '{}.{}'.format(getattr(obj, '__module__', ''), getattr(obj, '__qualname__', repr(obj)))
+
+
+def _describe_arguments(value):
+    """
+    Return the report arguments *value* with each :class:`lab.reports.Attribute` replaced by its
+    name and options, which JSON would otherwise serialize as a plain string.
+    """
+    if isinstance(value, reports.Attribute):
+        return {'attribute': str(value), 'absolute': value.absolute, 'min_wins': value.min_wins,
+                'function': _describe_object(value.function), 'scale': value.scale, 'digits': value.digits}
+    if isinstance(value, (list, tuple)):
+        return [_describe_arguments(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _describe_arguments(item) for key, item in value.items()}
+    return value
+
+
+class ReportManifest(object):
+    """
+    Record, for each report written to an evaluation directory, the algorithms and attributes it
+    depends on and a digest of their values, so that reports whose inputs did not change need
+    not be made again.
+
+    The digest also covers the report class and its arguments, including the options of the
+    attributes (e.g. *min_wins* and *digits*). Note that functions passed as arguments (e.g.
+    filters) are only identified by their name.
+    """
+    FILENAME = 'report-manifest.json'
+
+    def __init__(self, eval_dir):
+        self.eval_dir = eval_dir
+        self.filename = os.path.join(eval_dir, self.FILENAME)
+        self.entries = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                self.entries = json.load(f)
+
+    def _get_key(self, outfile):
+        return os.path.relpath(os.path.abspath(outfile), os.path.abspath(self.eval_dir))
+
+    @staticmethod
+    def compute_digest(job, dataset, algorithms, attributes):
+        description = json.dumps(
+            _describe_arguments([__version__, job.report_class, job.args, job.kwargs]),
+            default=_describe_object, sort_keys=True)
+        digest = hashlib.sha1(description.encode('utf-8'))
+        for algorithm in sorted(algorithms):
+            for attribute in sorted(attributes):
+                digest.update(dataset.get_digest(algorithm, attribute).encode('ascii'))
+        return digest.hexdigest()
+
+    def is_up_to_date(self, outfile, output_format, digest):
+        entry = self.entries.get(self._get_key(outfile))
+        exists = any(os.path.exists(path) for path in [outfile, outfile + '.' + output_format])
+        return exists and entry is not None and entry['digest'] == digest
+
+    def record(self, outfile, algorithms, attributes, digest):
+        self.entries[self._get_key(outfile)] = {
+            'algorithms': sorted(algorithms), 'attributes': sorted(attributes), 'digest': digest}
+
+    def write(self):
+        tools.makedirs(self.eval_dir)
+        tools.write_file(self.filename, json.dumps(self.entries, indent=2, sort_keys=True))
+
+
+def _render_report(job, eval_dir, data):
+    job.make_report(dataset=data)(eval_dir, job.outfile)
+    return job.outfile
+
+
+def make_reports(jobs, eval_dir, dataset, processes=None, incremental=False):
+    """
+    Make the reports described by the given :class:`ReportJob` objects from the runs in *dataset*,
+    using a pool of *processes* worker processes (default: one per CPU available to this process).
+
+    Each worker only receives the slice of the dataset that its report needs. Slices are built
+    lazily, so that only a bounded number of them is held in memory at any time. Jobs whose report
+    arguments cannot be sent to another process (e.g. because they contain lambdas) are made in the
+    current process.
+
+    If *incremental* is True, reports whose inputs did not change since they were last made (see
+    :class:`ReportManifest`) are skipped.
+    """
+    processes = processes or len(os.sched_getaffinity(0))
+    manifest = ReportManifest(eval_dir) if incremental else None
+    pending = deque()
+    executor = futures.ProcessPoolExecutor(max_workers=processes) if processes > 1 else None
+
+    def finish(future, outfile, algorithms, attributes, digest):
+        future.result()
+        if manifest is not None:
+            manifest.record(outfile, algorithms, attributes, digest)
+
+    try:
+        for job in jobs:
+            # Create the report in this process to determine which data it needs.
+            report = job.make_report(dataset=dataset)
+            algorithms = report._get_preselected_algorithms()
+            attributes = report.get_required_attributes(dataset.attributes)
+
+            digest = None
+            if manifest is not None:
+                digest = manifest.compute_digest(job, dataset, algorithms or dataset.algorithms, attributes)
+                if manifest.is_up_to_date(job.outfile, report.output_format, digest):
+                    logging.info('Inputs unchanged, skipping {}'.format(job.outfile))
+                    continue
+
+            if executor is None or not job.is_picklable():
+                if executor is not None:
+                    logging.warning('Report for {} cannot be made in a worker process.'.format(job.outfile))
+                future = futures.Future()
+                future.set_result(_render_report(job, eval_dir, dataset))
+            else:
+                data = RunSlice(dataset.select(algorithms=algorithms, attributes=attributes))
+                future = executor.submit(_render_report, job, eval_dir, data)
+            pending.append((future, job.outfile, algorithms or dataset.algorithms, attributes, digest))
+
+            # Bound the number of slices in flight, waiting for the jobs in submission order.
+            while len(pending) >= 2 * processes:
+                finish(*pending.popleft())
+        while pending:
+            finish(*pending.popleft())
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if manifest is not None:
+            manifest.write()
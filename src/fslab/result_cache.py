@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""
+An opt-in result cache shared by experiments, so that identical runs are only executed once.
+
+Comparisons against a baseline revision repeat the same runs of the baseline in every experiment.
+With a :class:`ResultCacheOptions` object passed to :class:`~fslab.experiment.FSExperiment`, the
+planner command of each run is wrapped by this module (``python -m fslab.result_cache ...``),
+which looks up the key of the run, i.e., a hash of
+
+- the planner revision and its build options,
+- the driver and component options of the algorithm,
+- the contents of the domain and problem files, and
+- the time and memory limits.
+
+If the cache has an entry for the key, the wrapper writes the output of the cached run to its
+standard output and error (and thus to the run.log and run.err of the run) and copies the cached
+*artifacts* (e.g. ``results.json``) into the run directory, instead of running the planner. The
+parser then parses them as if the planner had written them, so that the run gets the properties of
+the cached run. Otherwise, the planner runs normally, and the wrapper stores its output and
+artifacts in the cache if the planner exits with exit code 0, i.e., it was not killed by a limit.
+
+Since the results of cached runs are reused, including their timing attributes, the cache must
+only be used for deterministic planner configurations. Repeated runs (see *repetitions* of
+FSExperiment) and profiled runs are never cached. The wrapper records what it did in
+``result-cache.json``, from which the parser sets the ``result_cache_key`` and
+``result_cache_hit`` properties.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+from glob import glob
+
+from lab import tools
+
+from .grounding_cache import _copy, get_entry_dir
+
+
+MARKER_FILENAME = 'result-cache.json'
+DEFAULT_ARTIFACTS = ['results.json']
+# The output of the planner (run.log and run.err), stored in the entries with the names of the streams.
+STREAMS = [('run.log', 'stdout'), ('run.err', 'stderr')]
+CHUNK_SIZE = 64 * 1024
+
+
+def get_default_cache_dir():
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache'))
+    return os.path.join(cache_dir, 'fslab', 'results')
+
+
+class ResultCacheOptions(object):
+    """
+    Reuse the results of identical runs across experiments (see the module documentation).
+
+    *artifacts* is the list of files, relative to the run directory, that the planner writes
+    besides its output and that are needed to parse the run (glob patterns are allowed). If
+    *algorithms* is given, only the runs of these algorithms are cached. The cache is kept in
+    *cache_dir*, which must be reachable from all nodes that execute runs (default:
+    ``~/.cache/fslab/results``).
+    """
+    def __init__(self, artifacts=None, algorithms=None, cache_dir=None):
+        self.artifacts = tools.make_list(artifacts or DEFAULT_ARTIFACTS)
+        self.algorithms = None if algorithms is None else set(tools.make_list(algorithms))
+        self.cache_dir = cache_dir or get_default_cache_dir()
+        self._file_hashes = {}
+
+    def is_selected(self, algorithm):
+        return self.algorithms is None or algorithm in self.algorithms
+
+    def _get_file_hash(self, path):
+        # The domain file is shared by all tasks of a domain, so the hashes are cached.
+        from .suites import get_file_hash
+        if path not in self._file_hashes:
+            self._file_hashes[path] = get_file_hash(path)
+        return self._file_hashes[path]
+
+    def get_key(self, algo, task, time_limit, memory_limit):
+        """ Return the cache key of the run of the :class:`_DownwardAlgorithm` *algo* on *task*. """
+        # The hashes of the benchmark index might be outdated if a file was edited in place.
+        parts = ([algo.cached_revision._hashed_name] + algo.driver_options + ['--'] + algo.component_options +
+                 [self._get_file_hash(task.domain_file), self._get_file_hash(task.problem_file),
+                  'time_limit={}'.format(time_limit), 'memory_limit={}'.format(memory_limit)])
+        return hashlib.sha1('\0'.join(parts).encode('utf-8')).hexdigest()
+
+    def wrap_command(self, cmd, key):
+        """ Return the command that runs *cmd* with the result cache. """
+        wrapper = [tools.get_python_executable(), '-m', 'fslab.result_cache',
+                   '--cache-dir', os.path.abspath(self.cache_dir), '--key', key]
+        wrapper += ['--artifact={}'.format(artifact) for artifact in self.artifacts]
+        return wrapper + ['--'] + cmd
+
+
+def _write_stream(path, stream):
+    with open(path, 'rb') as f:
+        shutil.copyfileobj(f, stream.buffer)
+    stream.flush()
+
+
+def restore_result(entry_dir, run_dir='.'):
+    """ Copy the artifacts of the cached run into *run_dir* and its output to our stdout and stderr. """
+    for name in os.listdir(entry_dir):
+        if name not in dict(STREAMS).values():
+            dest = os.path.join(run_dir, name)
+            if os.path.lexists(dest):
+                tools.remove_path(dest)
+            _copy(os.path.join(entry_dir, name), dest)
+    for (_, stream_name), stream in zip(STREAMS, [sys.stdout, sys.stderr]):
+        path = os.path.join(entry_dir, stream_name)
+        if os.path.exists(path):
+            _write_stream(path, stream)
+
+
+def _tee(pipe, stream, path):
+    """ Copy the output of the planner from *pipe* to *stream* and to the file *path*. """
+    with open(path, 'wb') as f:
+        for chunk in iter(lambda: os.read(pipe.fileno(), CHUNK_SIZE), b''):
+            stream.buffer.write(chunk)
+            stream.flush()
+            f.write(chunk)
+    pipe.close()
+
+
+def store_result(tmp_dir, entry_dir, artifacts, run_dir='.'):
+    """
+    Atomically move the output of the run in *tmp_dir*, together with its *artifacts* (glob
+    patterns), to *entry_dir*. Return False if an artifact is missing.
+    """
+    matches = [glob(os.path.join(run_dir, pattern)) for pattern in artifacts]
+    if not all(matches):
+        logging.warning('Not storing the result of the run, since some of its artifacts are missing.')
+        return False
+    try:
+        for path in [path for paths in matches for path in paths]:
+            _copy(path, os.path.join(tmp_dir, os.path.basename(path)))
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another run stored the same entry in the meantime.
+        return os.path.isdir(entry_dir)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the planner with the result cache of fslab.')
+    parser.add_argument('--cache-dir', required=True)
+    parser.add_argument('--key', required=True)
+    parser.add_argument('--artifact', dest='artifacts', action='append', default=[])
+    parser.add_argument('cmd', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    cmd = args.cmd[1:] if args.cmd[:1] == ['--'] else args.cmd
+
+    entry_dir = get_entry_dir(args.cache_dir, args.key)
+    marker = {'key': args.key, 'entry': entry_dir, 'hit': os.path.isdir(entry_dir), 'stored': False}
+    tools.write_file(MARKER_FILENAME, json.dumps(marker))
+    if marker['hit']:
+        restore_result(entry_dir)
+        sys.exit(0)
+
+    # Keep a copy of the output of the planner, to store it if the planner succeeds.
+    tmp_dir = '{}.{}.tmp'.format(entry_dir, os.getpid())
+    tools.makedirs(tmp_dir)
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # Pass termination signals (e.g. from lab's wall-clock time limit) on to the planner.
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+        signal.signal(signum, lambda signum, frame: process.send_signal(signum))
+    tees = [threading.Thread(target=_tee, args=(pipe, stream, os.path.join(tmp_dir, stream_name)))
+            for pipe, stream, (_, stream_name) in zip(
+                [process.stdout, process.stderr], [sys.stdout, sys.stderr], STREAMS)]
+    for tee in tees:
+        tee.start()
+    returncode = process.wait()
+    for tee in tees:
+        tee.join()
+
+    if returncode == 0:
+        marker['stored'] = store_result(tmp_dir, entry_dir, args.artifacts)
+        tools.write_file(MARKER_FILENAME, json.dumps(marker))
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    sys.exit(returncode if returncode >= 0 else 128 - returncode)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+"""
+Scaling of performance attributes with the size of the instances.
+
+:class:`FSScalingReport` bins the runs by an instance-size feature parsed from the grounding
+output (``num_state_vars``, ``num_action_schemas``, ``num_ground_actions`` or
+``num_reach_actions``) into logarithmically spaced bins, and reports for each algorithm and bin
+the median of the performance attributes over the solved runs, together with the coverage.
+
+For each algorithm and attribute, the report fits a power law ``value ~ size ** k`` by least
+squares on the log-log values of all solved runs and reports the growth exponent *k*. The local
+exponents between consecutive bins show at which size the scaling of an algorithm deviates from
+the overall trend, e.g. when a revision starts to run out of memory on the larger instances.
+
+The values of each attribute are copied from the runs of the report (after filtering) into a
+numpy column once, and all statistics are then computed with numpy on these columns, without a
+Python loop over the bins or algorithms.
+"""
+
+import logging
+import os
+
+import numpy as np
+
+from downward.reports import PlanningReport
+from lab import tools
+from lab.reports import Table
+
+from .aggregate import _to_float_array
+from .reports import ColumnarDataMixin
+
+
+SIZE_ATTRIBUTES = ['num_state_vars', 'num_action_schemas', 'num_ground_actions', 'num_reach_actions']
+DEFAULT_ATTRIBUTES = ['search_time', 'memory', 'node_generation_rate']
+DEFAULT_NUM_BINS = 10
+
+
+def get_log_bins(sizes, num_bins):
+    """ Return the edges of *num_bins* logarithmically spaced bins that cover the positive *sizes*. """
+    low, high = sizes.min(), sizes.max()
+    if low == high:
+        return np.array([low, high + 1], dtype=np.float64)
+    edges = np.geomspace(low, high, num_bins + 1)
+    # Include the largest instance in the last bin.
+    edges[-1] = np.nextafter(high, np.inf)
+    return edges
+
+
+def grouped_medians(groups, values, num_groups):
+    """ Return the median of the *values* of each group (NaN for empty groups) and the group sizes. """
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order]
+    starts = np.searchsorted(groups, np.arange(num_groups))
+    counts = np.bincount(groups, minlength=num_groups)
+    medians = np.full(num_groups, np.nan)
+    nonempty = counts > 0
+    lower = starts[nonempty] + (counts[nonempty] - 1) // 2
+    upper = starts[nonempty] + counts[nonempty] // 2
+    medians[nonempty] = (values[lower] + values[upper]) / 2
+    return medians, counts
+
+
+def fit_exponents(groups, log_sizes, log_values, num_groups):
+    """
+    Fit ``log_value = k * log_size + c`` for each group by least squares and return the slopes *k*
+    (NaN for groups with fewer than two distinct sizes).
+    """
+    def group_sum(weights):
+        return np.bincount(groups, weights=weights, minlength=num_groups)
+    n = np.bincount(groups, minlength=num_groups).astype(np.float64)
+    sx, sy = group_sum(log_sizes), group_sum(log_values)
+    sxx, sxy = group_sum(log_sizes * log_sizes), group_sum(log_sizes * log_values)
+    denominator = n * sxx - sx * sx
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = (n * sxy - sx * sy) / denominator
+    slopes[~(denominator > 1e-9 * np.maximum(n * sxx, 1))] = np.nan
+    return slopes
+
+
+class FSScalingReport(ColumnarDataMixin, PlanningReport):
+    """
+    Report how the performance *attributes* (default: ``search_time``, ``memory`` and
+    ``node_generation_rate``) of each algorithm scale with the instance-size feature
+    *size_attribute*. See the module documentation.
+
+    The runs are grouped into *num_bins* logarithmically spaced bins of the size feature. Runs
+    without a positive size (e.g. when grounding failed) are ignored. The performance attributes
+    are only taken from solved runs, and bins with fewer than *min_runs* solved runs of an
+    algorithm are left empty.
+
+    If *plot_format* is given (e.g. "png" or "pdf"), a log-log plot of the bin medians of each
+    attribute is written next to the report, to ``<report>-<attribute>.<plot_format>``.
+
+    >>> report = FSScalingReport(size_attribute='num_reach_actions', plot_format='png')
+    """
+    def __init__(self, size_attribute='num_ground_actions', num_bins=DEFAULT_NUM_BINS, min_runs=1,
+                 plot_format=None, **kwargs):
+        if size_attribute not in SIZE_ATTRIBUTES:
+            logging.warning('{} is not one of the size features {}'.format(size_attribute, SIZE_ATTRIBUTES))
+        kwargs.setdefault('attributes', DEFAULT_ATTRIBUTES)
+        kwargs['extra_attributes'] = tools.make_list(kwargs.get('extra_attributes')) + [size_attribute, 'coverage']
+        self.size_attribute = size_attribute
+        self.num_bins = num_bins
+        self.min_runs = min_runs
+        self.plot_format = plot_format
+        super().__init__(**kwargs)
+
+    def _get_columns(self):
+        """ Return the algorithm codes, sizes and solved flags of the runs with a positive size. """
+        runs = list(self.props.values())
+        code_of = {algorithm: code for code, algorithm in enumerate(self.algorithms)}
+        codes = np.fromiter((code_of[run['algorithm']] for run in runs), dtype=np.intp, count=len(runs))
+        sizes = _to_float_array([run.get(self.size_attribute) for run in runs])
+        solved = _to_float_array([run.get('coverage') for run in runs]) == 1
+        valid = sizes > 0
+        return runs, valid, codes[valid], sizes[valid], solved[valid]
+
+    def _prepare(self):
+        runs, valid, codes, sizes, solved = self._get_columns()
+        if not len(sizes):
+            logging.critical('No run has a positive value for {}.'.format(self.size_attribute))
+        self.edges = get_log_bins(sizes, self.num_bins)
+        num_bins = len(self.edges) - 1
+        bins = np.clip(np.digitize(sizes, self.edges) - 1, 0, num_bins - 1)
+        num_algorithms = len(self.algorithms)
+        groups = codes * num_bins + bins
+        shape = (num_algorithms, num_bins)
+
+        self.bin_names = ['{:.3g} - {:.3g}'.format(low, high) for low, high in zip(self.edges, self.edges[1:])]
+        self.num_runs = np.bincount(groups, minlength=num_algorithms * num_bins).reshape(shape)
+        self.num_solved = np.bincount(groups[solved], minlength=num_algorithms * num_bins).reshape(shape)
+
+        self.medians = {}
+        self.median_sizes = {}
+        self.exponents = {}
+        for attribute in self.attributes:
+            values = _to_float_array([run.get(attribute) for run in runs])[valid]
+            usable = solved & (values > 0)
+            attr_groups = groups[usable]
+            medians, counts = grouped_medians(attr_groups, values[usable], num_algorithms * num_bins)
+            median_sizes, _ = grouped_medians(attr_groups, sizes[usable], num_algorithms * num_bins)
+            medians[counts < self.min_runs] = np.nan
+            median_sizes[counts < self.min_runs] = np.nan
+            self.medians[attribute] = medians.reshape(shape)
+            self.median_sizes[attribute] = median_sizes.reshape(shape)
+            self.exponents[attribute] = fit_exponents(
+                codes[usable], np.log(sizes[usable]), np.log(values[usable]), num_algorithms)
+
+    def _get_local_exponents(self, attribute):
+        """ Return the slopes of the log-log median curve between consecutive non-empty bins. """
+        log_sizes = np.log(self.median_sizes[attribute])
+        log_values = np.log(self.medians[attribute])
+        local = np.full(log_values.shape, np.nan)
+        for code in range(len(self.algorithms)):
+            nonempty = np.flatnonzero(~np.isnan(log_values[code]))
+            if len(nonempty) < 2:
+                continue
+            with np.errstate(divide='ignore', invalid='ignore'):
+                slopes = np.diff(log_values[code, nonempty]) / np.diff(log_sizes[code, nonempty])
+            local[code, nonempty[1:]] = slopes
+        return local
+
+    def _get_coverage_table(self):
+        table = Table(title='Coverage by {} (solved/runs)'.format(self.size_attribute))
+        for code, algorithm in enumerate(self.algorithms):
+            for index, bin_name in enumerate(self.bin_names):
+                if self.num_runs[code, index]:
+                    table.add_cell(bin_name, algorithm, '{}/{}'.format(
+                        self.num_solved[code, index], self.num_runs[code, index]))
+        table.set_row_order(self.bin_names)
+        table.set_column_order(self.algorithms)
+        return table
+
+    def _get_bin_table(self, title, values, **kwargs):
+        """ Return a table with a row for each bin and a column for each algorithm. """
+        table = Table(title=title, **kwargs)
+        for code, algorithm in enumerate(self.algorithms):
+            for index, bin_name in enumerate(self.bin_names):
+                if not np.isnan(values[code, index]):
+                    table.add_cell(bin_name, algorithm, float(values[code, index]))
+        table.set_row_order([bin_name for bin_name in self.bin_names if bin_name in table])
+        table.set_column_order(self.algorithms)
+        return table
+
+    def _get_median_tables(self, attribute):
+        medians = self._get_bin_table(
+            'Median {} of solved runs by {}'.format(attribute, self.size_attribute),
+            self.medians[attribute], min_wins=attribute.min_wins, digits=attribute.digits)
+        local_exponents = self._get_bin_table(
+            'Local growth exponents of {} (from the previous bin)'.format(attribute),
+            self._get_local_exponents(attribute), min_wins=None)
+        return [medians, local_exponents]
+
+    def _get_exponent_table(self):
+        table = Table(title='Growth exponents (value ~ {} ** k)'.format(self.size_attribute), min_wins=None)
+        for attribute in self.attributes:
+            for code, algorithm in enumerate(self.algorithms):
+                exponent = self.exponents[attribute][code]
+                if not np.isnan(exponent):
+                    table.add_cell(algorithm, str(attribute), float(exponent))
+        table.set_row_order(self.algorithms)
+        table.set_column_order([str(attribute) for attribute in self.attributes])
+        return table
+
+    def _write_plots(self):
+        import matplotlib
+        matplotlib.use('Agg')
+        from matplotlib import pyplot as plt
+
+        basename = os.path.splitext(self.outfile)[0]
+        for attribute in self.attributes:
+            fig, axes = plt.subplots(figsize=(8, 6))
+            for code, algorithm in enumerate(self.algorithms):
+                sizes = self.median_sizes[attribute][code]
+                medians = self.medians[attribute][code]
+                nonempty = ~np.isnan(medians)
+                if not nonempty.any():
+                    continue
+                axes.plot(sizes[nonempty], medians[nonempty], marker='o', label='{} (k = {:.2f})'.format(
+                    algorithm, self.exponents[attribute][code]))
+            axes.set_xscale('log')
+            axes.set_yscale('log')
+            axes.set_xlabel(self.size_attribute)
+            axes.set_ylabel('median {}'.format(attribute))
+            axes.grid(True, which='both', linestyle='-', color='0.85')
+            axes.legend(loc='best', fontsize='small')
+            plot_file = '{}-{}.{}'.format(basename, attribute, self.plot_format)
+            fig.savefig(plot_file, bbox_inches='tight')
+            plt.close(fig)
+            logging.info('Wrote file://{}'.format(plot_file))
+
+    def get_markup(self):
+        self._prepare()
+        if self.plot_format:
+            self._write_plots()
+        tables = [self._get_exponent_table(), self._get_coverage_table()]
+        for attribute in self.attributes:
+            tables += self._get_median_tables(attribute)
+        return '\n'.join(str(table) for table in tables)
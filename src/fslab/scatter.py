@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+Support for scatter plots with very many points.
+
+Drawing tens of thousands of markers as vector graphics produces huge PDF/SVG files which are
+slow to render. Once a plot has more than a given number of points, the reports in this module
+either rasterize the markers (keeping axes, labels and legend as vector graphics) or replace the
+individual markers by a hexagonal-bin density plot.
+"""
+
+import logging
+
+import numpy as np
+
+from downward.reports.scatter import ScatterPlotReport
+from downward.reports.scatter_matplotlib import ScatterMatplotlib
+
+from .reports import ColumnarDataMixin
+
+
+#: Draw every point as a vector marker, regardless of the number of points.
+VECTOR = 'vector'
+#: Draw the markers as a single embedded raster image.
+RASTERIZE = 'rasterize'
+#: Draw the density of points as hexagonal bins.
+HEXBIN = 'hexbin'
+
+LARGE_PLOT_MODES = [VECTOR, RASTERIZE, HEXBIN]
+
+DEFAULT_MAX_VECTOR_POINTS = 5000
+
+
+class LargeScatterMixin(object):
+    """
+    Mixin for scatter plot reports that switches to the *large_plot_mode* ("rasterize" or
+    "hexbin") when the plot contains more than *max_vector_points* points. Use "vector" to
+    always draw every point as a vector marker.
+    """
+    def __init__(self, *args, large_plot_mode=RASTERIZE, max_vector_points=DEFAULT_MAX_VECTOR_POINTS,
+                 hexbin_gridsize=60, **kwargs):
+        if large_plot_mode not in LARGE_PLOT_MODES:
+            logging.critical('Large plot mode {} not in {}'.format(large_plot_mode, LARGE_PLOT_MODES))
+        self.large_plot_mode = large_plot_mode
+        self.max_vector_points = max_vector_points
+        self.hexbin_gridsize = hexbin_gridsize
+        super().__init__(*args, **kwargs)
+
+    def get_category_arrays(self):
+        """ Return a dictionary mapping each category to a pair of (x, y) coordinate arrays. """
+        arrays = {}
+        for category, coords in self.categories.items():
+            if isinstance(coords, tuple):
+                # Coordinates are already given as a pair of arrays.
+                arrays[category] = coords
+            else:
+                arrays[category] = tuple(np.array(coords, dtype=np.float64).reshape(-1, 2).T)
+        return arrays
+
+    def get_plot_mode(self):
+        num_points = sum(len(coords[0]) if isinstance(coords, tuple) else len(coords)
+                         for coords in self.categories.values())
+        if num_points <= self.max_vector_points:
+            return VECTOR
+        return self.large_plot_mode
+
+    def has_multiple_categories(self):
+        # Density plots do not distinguish categories, hence there is nothing to put in a legend.
+        return self.get_plot_mode() != HEXBIN and super().has_multiple_categories()
+
+
+class LargeScatterMatplotlib(ScatterMatplotlib):
+    """ Matplotlib writer for reports with the :class:`LargeScatterMixin`. """
+    @classmethod
+    def _plot_points(cls, report, axes, **scatter_kwargs):
+        arrays = report.get_category_arrays()
+        mode = report.get_plot_mode()
+        if mode == HEXBIN:
+            x_vals = np.concatenate([x for x, _ in arrays.values()])
+            y_vals = np.concatenate([y for _, y in arrays.values()])
+
+            def binning_scale(scale):
+                return 'log' if scale == 'log' else 'linear'
+
+            collection = axes.hexbin(
+                x_vals, y_vals, gridsize=report.hexbin_gridsize, bins='log', mincnt=1,
+                xscale=binning_scale(axes.get_xscale()), yscale=binning_scale(axes.get_yscale()))
+            axes.figure.colorbar(collection, ax=axes, label='tasks')
+            return
+
+        for category in sorted(arrays, key=lambda c: (c is not None, c)):
+            x_vals, y_vals = arrays[category]
+            axes.scatter(
+                x_vals, y_vals, clip_on=False, label=category, rasterized=(mode == RASTERIZE),
+                **dict(report.styles[category], **scatter_kwargs))
+
+    @classmethod
+    def _plot(cls, report, axes):
+        axes.grid(True, linestyle='-', color='0.75')
+        cls._plot_points(report, axes)
+        axes.set_xbound(upper=report.x_upper)
+        axes.set_ybound(upper=report.y_upper)
+
+
+class FSScatterPlotReport(ColumnarDataMixin, LargeScatterMixin, ScatterPlotReport):
+    """ See :class:`downward.reports.scatter.ScatterPlotReport` and :class:`LargeScatterMixin` """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.output_format != 'tex':
+            self.writer = LargeScatterMatplotlib
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+An optional result sink that makes the properties of the runs queryable with SQL while the
+experiment is running.
+
+If an experiment is created with ``result_sink=True``, the parser appends the properties of each
+run, right after writing its ``properties`` file, to a SQLite database. Since SQLite databases in
+WAL mode must only be written from a single host, each node writes its own database
+``<exp_dir>/results/<node>.sqlite``. The merge step (see
+:meth:`~fslab.experiment.FSExperiment.add_merge_results_step`) combines them, incrementally, into
+``<exp_dir>/results.sqlite``, which can be queried with any SQLite client::
+
+    SELECT algorithm, SUM(json_extract(properties, '$.coverage')) FROM runs GROUP BY algorithm;
+    SELECT r.domain, AVG(a.value) FROM attributes a JOIN runs r USING (run_id)
+        WHERE a.name = 'search_time' GROUP BY r.domain;
+
+The ``runs`` table holds one row per run with all its properties as JSON, and the ``attributes``
+table holds one row per run and scalar attribute, indexed by attribute name. Each write of a run
+gets a new, increasing sequence number ``seq``, which the merge step uses to find the runs written
+since the previous merge. Unlike timestamps, sequence numbers are assigned while the database is
+locked for writing, so a run that commits after a merge can never get a smaller one.
+"""
+
+import glob
+import json
+import logging
+import os
+import platform
+import sqlite3
+import time
+
+from lab import tools
+
+
+SINK_CONFIG_FILENAME = 'result-sink.json'
+SINK_DIRNAME = 'results'
+MERGED_FILENAME = 'results.sqlite'
+BUSY_TIMEOUT = 60  # in seconds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT, run_id TEXT UNIQUE, algorithm TEXT, domain TEXT,
+    problem TEXT, node TEXT, updated REAL, properties TEXT);
+CREATE INDEX IF NOT EXISTS runs_algorithm_domain ON runs (algorithm, domain);
+CREATE TABLE IF NOT EXISTS attributes (
+    run_id TEXT, name TEXT, value, PRIMARY KEY (run_id, name)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS attributes_name_value ON attributes (name, value);
+CREATE TABLE IF NOT EXISTS merged_sources (source TEXT PRIMARY KEY, seq INTEGER);
+"""
+# The columns of the runs table without the sequence number, which each database assigns itself.
+RUN_COLUMNS = 'run_id, algorithm, domain, problem, node, updated, properties'
+
+
+def get_sink_dir(exp_dir):
+    return os.path.join(exp_dir, SINK_DIRNAME)
+
+
+def get_sink_config(journal_mode='wal'):
+    """ Return the contents of the file that enables the sink for the runs of an experiment. """
+    return json.dumps({'journal_mode': journal_mode})
+
+
+def connect(path, journal_mode='wal'):
+    """ Open (and create, if needed) the result database *path*. """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    conn.execute('PRAGMA journal_mode={}'.format(journal_mode))
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _is_scalar(value):
+    return isinstance(value, (bool, int, float, str))
+
+
+def write_run(conn, props, node=None):
+    """ Insert or replace the run with the given properties (which must contain its "id"). """
+    run_id = '-'.join(props['id'])
+    with conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO runs ({}) VALUES (?, ?, ?, ?, ?, ?, ?)'.format(RUN_COLUMNS),
+            (run_id, props.get('algorithm'), props.get('domain'), props.get('problem'),
+             node or platform.node(), time.time(), json.dumps(props)))
+        conn.execute('DELETE FROM attributes WHERE run_id = ?', (run_id,))
+        conn.executemany(
+            'INSERT INTO attributes VALUES (?, ?, ?)',
+            [(run_id, name, value) for name, value in sorted(props.items()) if _is_scalar(value)])
+
+
+def write_run_to_sink(props, run_dir='.'):
+    """
+    Called by the parser: append the properties of the run in *run_dir* to the database of this
+    node, if the experiment has a result sink.
+    """
+    exp_dir = os.path.join(run_dir, '..', '..')
+    config_file = os.path.join(exp_dir, SINK_CONFIG_FILENAME)
+    if not os.path.exists(config_file):
+        return
+    with open(config_file) as f:
+        config = json.load(f)
+    # The parser only sees the properties it parsed, not the static ones (e.g. "id").
+    run_props = tools.Properties(filename=os.path.join(run_dir, 'static-properties'))
+    run_props.update(props)
+    node = platform.node()
+    sink_dir = get_sink_dir(exp_dir)
+    tools.makedirs(sink_dir)
+    conn = connect(os.path.join(sink_dir, '{}.sqlite'.format(node)), config.get('journal_mode', 'wal'))
+    try:
+        write_run(conn, run_props, node)
+    finally:
+        conn.close()
+
+
+def merge_results(exp_dir, dest=None):
+    """
+    Merge the databases written by the nodes into *dest* (default: ``<exp_dir>/results.sqlite``).
+    Only the runs written since the previous merge are copied.
+    """
+    dest = dest or os.path.join(exp_dir, MERGED_FILENAME)
+    sources = sorted(glob.glob(os.path.join(get_sink_dir(exp_dir), '*.sqlite')))
+    conn = connect(dest, journal_mode='delete')
+    try:
+        total = 0
+        for source in sources:
+            name = os.path.basename(source)
+            row = conn.execute('SELECT seq FROM merged_sources WHERE source = ?', (name,)).fetchone()
+            since = row[0] if row else 0
+            conn.execute('ATTACH DATABASE ? AS source', (source,))
+            with conn:
+                until = conn.execute('SELECT MAX(seq) FROM source.runs').fetchone()[0]
+                if until is not None and until > since:
+                    condition = 'SELECT run_id FROM source.runs WHERE seq > ? AND seq <= ?'
+                    conn.execute('DELETE FROM attributes WHERE run_id IN ({})'.format(condition), (since, until))
+                    count = conn.execute(
+                        'INSERT OR REPLACE INTO runs ({0}) SELECT {0} FROM source.runs '
+                        'WHERE seq > ? AND seq <= ?'.format(RUN_COLUMNS), (since, until)).rowcount
+                    conn.execute(
+                        'INSERT INTO attributes SELECT * FROM source.attributes '
+                        'WHERE run_id IN ({})'.format(condition), (since, until))
+                    conn.execute('INSERT OR REPLACE INTO merged_sources VALUES (?, ?)', (name, until))
+                    total += count
+            conn.execute('DETACH DATABASE source')
+        num_runs = conn.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+    finally:
+        conn.close()
+    logging.info('Merged {} new runs from {} node databases into {} ({} runs)'.format(
+        total, len(sources), dest, num_runs))
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+"""
+A typed columnar store for the properties fetched from FS experiments.
+
+Lab keeps the properties of all runs of an experiment in a single JSON file. For large experiments
+this file becomes a bottleneck, since every report has to load (and keep in memory) all attributes
+of all runs, including large attributes such as the inline plans. The store defined here keeps
+one typed column per attribute, so that reports only need to load the attributes they use.
+
+Columns are written as a Parquet file if `pyarrow` is available, and as one NumPy file per column
+otherwise.
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+
+from lab import tools
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+STORE_DIRNAME = 'columns'
+SCHEMA_FILENAME = 'schema.json'
+PARQUET_FILENAME = 'runs.parquet'
+RUN_IDS_FILENAME = 'run_ids.json'
+
+PARQUET = 'parquet'
+NUMPY = 'numpy'
+
+# The kinds of columns we know how to store. Anything that is not a homogeneous column of
+# booleans, numbers or strings (e.g. the "id" lists or the "unexplained_errors") is JSON-encoded.
+BOOL, INT, FLOAT, STR, JSON = 'bool', 'int', 'float', 'str', 'json'
+
+
+def get_store_dir(eval_dir):
+    return os.path.join(eval_dir, STORE_DIRNAME)
+
+
+def has_store(eval_dir):
+    return os.path.exists(os.path.join(get_store_dir(eval_dir), SCHEMA_FILENAME))
+
+
+def get_run_id(run):
+    return '-'.join(run['id'])
+
+
+def _infer_kind(values):
+    types = {type(v) for v in values if v is not None}
+    if not types:
+        return JSON
+    if types == {bool}:
+        return BOOL
+    if types == {int}:
+        return INT
+    if types <= {int, float}:
+        return FLOAT
+    if types == {str}:
+        return STR
+    return JSON
+
+
+class ColumnarStore(object):
+    """ A store with one column per attribute and one row per run. """
+
+    def __init__(self, eval_dir):
+        self.path = get_store_dir(eval_dir)
+        self._schema = None
+        self._run_ids = None
+
+    @property
+    def schema(self):
+        if self._schema is None:
+            with open(os.path.join(self.path, SCHEMA_FILENAME)) as f:
+                self._schema = json.load(f)
+        return self._schema
+
+    @property
+    def attributes(self):
+        return sorted(self.schema['columns'].keys())
+
+    @property
+    def run_ids(self):
+        if self._run_ids is None:
+            if 'run_ids' in self.schema:
+                # Stores written by older versions keep the run IDs in the schema.
+                self._run_ids = self.schema['run_ids']
+            else:
+                with open(os.path.join(self.path, RUN_IDS_FILENAME)) as f:
+                    self._run_ids = json.load(f)
+        return self._run_ids
+
+    def __len__(self):
+        if 'num_runs' in self.schema:
+            return self.schema['num_runs']
+        return len(self.run_ids)
+
+    def write(self, props, backend=None):
+        """ Write the given {run_id: run} dictionary to the store, replacing any previous content. """
+        backend = backend or (PARQUET if pyarrow is not None else NUMPY)
+        if backend == PARQUET and pyarrow is None:
+            logging.critical('The Parquet backend of the columnar store needs pyarrow.')
+
+        run_ids = sorted(props.keys())
+        attributes = sorted({attr for run in props.values() for attr in run.keys()})
+
+        if os.path.exists(self.path):
+            tools.remove_path(self.path)
+        tools.makedirs(self.path)
+
+        columns = {}
+        arrays = {}
+        for index, attr in enumerate(attributes):
+            values = [props[run_id].get(attr) for run_id in run_ids]
+            kind = _infer_kind(values)
+            columns[attr] = {'kind': kind, 'file': 'col-{:05d}'.format(index)}
+            if backend == PARQUET:
+                arrays[attr] = self._to_arrow(values, kind)
+            else:
+                self._write_numpy_column(columns[attr]['file'], values, kind)
+
+        if backend == PARQUET:
+            table = pyarrow.table(arrays) if arrays else pyarrow.table({})
+            pyarrow.parquet.write_table(table, os.path.join(self.path, PARQUET_FILENAME))
+
+        # The run IDs are kept apart from the schema, since streaming readers do not need them.
+        self._run_ids = run_ids
+        tools.write_file(os.path.join(self.path, RUN_IDS_FILENAME), json.dumps(run_ids))
+        self._schema = {'backend': backend, 'num_runs': len(run_ids), 'columns': columns}
+        tools.write_file(os.path.join(self.path, SCHEMA_FILENAME), json.dumps(self._schema))
+        logging.info('Wrote columnar store with {} runs and {} attributes to {} ({})'.format(
+            len(run_ids), len(attributes), self.path, backend))
+
+    def load_columns(self, attributes=None):
+        """ Return a dictionary mapping each of the given attributes (default: all) to the list of
+        its values, one per run in the order given by `run_ids`. Missing values are None. """
+        available = self.schema['columns']
+        attributes = [a for a in (attributes if attributes is not None else self.attributes) if a in available]
+        if self.schema['backend'] == PARQUET:
+            table = pyarrow.parquet.read_table(os.path.join(self.path, PARQUET_FILENAME), columns=attributes)
+            columns = {attr: table.column(attr).to_pylist() for attr in attributes}
+            for attr in attributes:
+                if available[attr]['kind'] == JSON:
+                    columns[attr] = [None if v is None else json.loads(v) for v in columns[attr]]
+            return columns
+        return {attr: self._read_numpy_column(available[attr]['file'], available[attr]['kind'])
+                for attr in attributes}
+
+    def iter_batches(self, attributes, batch_size=65536):
+        """ Iterate over the runs in batches of at most *batch_size* runs, without loading whole columns
+        into memory where the backend allows it. Each batch is a dictionary mapping the given attributes to
+        lists of values, as in :meth:`load_columns`. """
+        available = self.schema['columns']
+        attributes = [a for a in attributes if a in available]
+        if self.schema['backend'] == PARQUET:
+            parquet_file = pyarrow.parquet.ParquetFile(os.path.join(self.path, PARQUET_FILENAME))
+            for batch in parquet_file.iter_batches(batch_size=batch_size, columns=attributes):
+                columns = batch.to_pydict()
+                for attr in attributes:
+                    if available[attr]['kind'] == JSON:
+                        columns[attr] = [None if v is None else json.loads(v) for v in columns[attr]]
+                yield columns
+            return
+
+        readers = {attr: self._open_numpy_column(available[attr]['file'], available[attr]['kind'])
+                   for attr in attributes}
+        for start in range(0, len(self), batch_size):
+            yield {attr: reader(start, start + batch_size) for attr, reader in readers.items()}
+
+    def load(self, attributes=None):
+        """ Return a lab-style {run_id: run} dictionary with only the given attributes (default: all).
+        As in lab properties files, attributes without a value are not present in the run dictionary. """
+        columns = self.load_columns(attributes)
+        props = {}
+        for index, run_id in enumerate(self.run_ids):
+            props[run_id] = {attr: values[index] for attr, values in columns.items() if values[index] is not None}
+        return props
+
+    @staticmethod
+    def _to_arrow(values, kind):
+        if kind == JSON:
+            return pyarrow.array([None if v is None else json.dumps(v) for v in values], type=pyarrow.string())
+        if kind == FLOAT:
+            values = [None if v is None else float(v) for v in values]
+        types = {BOOL: pyarrow.bool_(), INT: pyarrow.int64(), FLOAT: pyarrow.float64(), STR: pyarrow.string()}
+        return pyarrow.array(values, type=types[kind])
+
+    def _write_numpy_column(self, name, values, kind):
+        filename = os.path.join(self.path, name)
+        if kind == STR:
+            # Dictionary-encode strings: most string attributes (algorithm, domain, error, ...) take
+            # few distinct values, and the integer codes can be read in slices.
+            distinct = sorted({v for v in values if v is not None})
+            code_of = {value: code for code, value in enumerate(distinct)}
+            codes = np.array([-1 if v is None else code_of[v] for v in values], dtype=np.int32)
+            np.save(filename + '.codes.npy', codes, allow_pickle=False)
+            with open(filename + '.values.json', 'w') as f:
+                json.dump(distinct, f)
+            return
+        if kind == JSON:
+            # Variable-length data does not fit well into NumPy arrays, so we store it as JSON.
+            with open(filename + '.json', 'w') as f:
+                json.dump(values, f)
+            return
+        dtypes = {BOOL: np.bool_, INT: np.int64, FLOAT: np.float64}
+        mask = np.array([v is None for v in values], dtype=np.bool_)
+        data = np.array([0 if v is None else v for v in values], dtype=dtypes[kind])
+        np.save(filename + '.npy', data, allow_pickle=False)
+        if mask.any():
+            np.save(filename + '.mask.npy', mask, allow_pickle=False)
+
+    def _read_numpy_column(self, name, kind):
+        return self._open_numpy_column(name, kind)(0, len(self))
+
+    def _open_numpy_column(self, name, kind):
+        """ Return a function that reads the values of the column in a given [start, end) range. """
+        filename = os.path.join(self.path, name)
+        if kind == STR:
+            codes = np.load(filename + '.codes.npy', mmap_mode='r', allow_pickle=False)
+            with open(filename + '.values.json') as f:
+                distinct = json.load(f)
+
+            def read_strings(start, end):
+                return [None if code < 0 else distinct[code] for code in codes[start:end].tolist()]
+            return read_strings
+
+        if kind == JSON:
+            with open(filename + '.json') as f:
+                values = json.load(f)
+            return lambda start, end: values[start:end]
+
+        data = np.load(filename + '.npy', mmap_mode='r', allow_pickle=False)
+        mask = None
+        if os.path.exists(filename + '.mask.npy'):
+            mask = np.load(filename + '.mask.npy', mmap_mode='r', allow_pickle=False)
+
+        def read_values(start, end):
+            values = data[start:end].tolist()
+            if mask is not None:
+                for index in np.flatnonzero(mask[start:end]):
+                    values[index] = None
+            return values
+        return read_values
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+A persistent index of benchmark directories.
+
+Building an experiment resolves every domain of its suites into problems and their domain files,
+which means listing and probing the files of each domain directory. The :class:`BenchmarkIndex`
+records the result per domain, together with the size and SHA-1 hash of every problem file, and
+only scans a domain again once the modification time of its directory changes (i.e., when files
+are added, removed or renamed). Note that editing a file in place does not change the modification
+time of its directory; call :meth:`BenchmarkIndex.refresh` in that case.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+from downward.suites import Problem
+from lab import tools
+
+
+INDEX_VERSION = 1
+
+# Names under which the domain file of a problem is searched for, in this order (as in lab).
+DOMAIN_FILE_PATTERNS = ['domain.pddl', '{prefix}-domain.pddl', 'domain_{problem}', 'domain-{problem}']
+
+
+def get_default_index_file(benchmarks_dir):
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache'))
+    key = hashlib.sha1(os.path.abspath(benchmarks_dir).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, 'fslab', 'benchmarks-{}.json'.format(key))
+
+
+def get_file_hash(path):
+    """ Return the SHA-1 hash of the contents of the file *path*. """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _find_domain_file(problem, filenames):
+    for pattern in DOMAIN_FILE_PATTERNS:
+        name = pattern.format(prefix=problem[:3], problem=problem)
+        if name in filenames:
+            return name
+    return None
+
+
+class BenchmarkIndex(object):
+    """
+    The index of the benchmark directory *benchmarks_dir*, stored in *index_file* (by default in
+    the user's cache directory, so that shared, read-only benchmark directories can be indexed).
+    """
+    def __init__(self, benchmarks_dir, index_file=None):
+        self.benchmarks_dir = os.path.abspath(benchmarks_dir)
+        self.index_file = index_file or get_default_index_file(benchmarks_dir)
+        self.domains = {}
+        self._changed = False
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as f:
+                data = json.load(f)
+            if data.get('version') == INDEX_VERSION and data.get('benchmarks_dir') == self.benchmarks_dir:
+                self.domains = data['domains']
+
+    def _scan_domain(self, domain):
+        directory = os.path.join(self.benchmarks_dir, domain)
+        logging.info('Indexing benchmark domain {}'.format(directory))
+        filenames = set(os.listdir(directory))
+        # Same selection of problem files as lab's downward.suites.Domain.
+        problem_names = tools.natural_sort(
+            [name for name in filenames if 'domain' not in name and not name.endswith('.py')])
+        problems = []
+        for problem in problem_names:
+            problem_file = os.path.join(directory, problem)
+            problems.append({
+                'problem': problem,
+                'domain_file': _find_domain_file(problem, filenames),
+                'size': os.path.getsize(problem_file),
+                'sha1': get_file_hash(problem_file),
+            })
+        return problems
+
+    def get_domain(self, domain):
+        """ Return the index entries of the problems of *domain*, scanning its directory if needed. """
+        directory = os.path.join(self.benchmarks_dir, domain)
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            logging.critical('Benchmark domain {} not found'.format(directory))
+        entry = self.domains.get(domain)
+        if entry is None or entry['mtime'] != mtime:
+            entry = {'mtime': mtime, 'problems': self._scan_domain(domain)}
+            self.domains[domain] = entry
+            self._changed = True
+        return entry['problems']
+
+    def refresh(self, domains=None):
+        """ Scan the given domains (default: all indexed domains) again. """
+        for domain in tools.make_list(domains) if domains is not None else list(self.domains):
+            self.domains.pop(domain, None)
+            self.get_domain(domain)
+        self.write()
+
+    def write(self):
+        if not self._changed and os.path.exists(self.index_file):
+            return
+        tools.makedirs(os.path.dirname(self.index_file))
+        tmp_file = '{}.{}.tmp'.format(self.index_file, os.getpid())
+        data = {'version': INDEX_VERSION, 'benchmarks_dir': self.benchmarks_dir, 'domains': self.domains}
+        tools.write_file(tmp_file, json.dumps(data))
+        os.replace(tmp_file, self.index_file)
+        self._changed = False
+
+    def _make_problem(self, domain, entry):
+        if entry['domain_file'] is None:
+            logging.critical('No domain file found for {}:{}'.format(domain, entry['problem']))
+        directory = os.path.join(self.benchmarks_dir, domain)
+        return Problem(
+            domain, entry['problem'],
+            domain_file=os.path.join(directory, entry['domain_file']),
+            problem_file=os.path.join(directory, entry['problem']),
+            properties={'problem_file_size': entry['size'], 'problem_file_sha1': entry['sha1']})
+
+    def build_suite(self, descriptions, min_problem_size=None, max_problem_size=None, sort_by_size=False):
+        """
+        Return the problems of the given domain ("gripper") or problem ("gripper:prob01.pddl")
+        descriptions as :class:`downward.suites.Problem` objects, like :func:`downward.suites.build_suite`.
+
+        Problems whose file size (in bytes) lies outside of [*min_problem_size*, *max_problem_size*] are
+        skipped. If *sort_by_size* is True, the problems are sorted by increasing file size.
+        """
+        problems = []
+        for description in descriptions:
+            if isinstance(description, Problem):
+                problems.append(description)
+                continue
+            domain, _, problem = description.partition(':')
+            entries = self.get_domain(domain)
+            if problem:
+                entries = [entry for entry in entries if entry['problem'] == problem]
+                if not entries:
+                    logging.critical('Problem {} not found in {}'.format(problem, domain))
+            problems.extend(self._make_problem(domain, entry) for entry in entries)
+        self.write()
+
+        def get_size(problem):
+            return problem.properties.get('problem_file_size', 0)
+
+        if min_problem_size is not None:
+            problems = [problem for problem in problems if get_size(problem) >= min_problem_size]
+        if max_problem_size is not None:
+            problems = [problem for problem in problems if get_size(problem) <= max_problem_size]
+        if sort_by_size:
+            problems.sort(key=get_size)
+        return problems
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+"""
+Deduplicated plan storage and plan validation with VAL.
+
+The parser does not inline the plan of a run into its properties. Instead, it writes the plan, in
+the format that VAL reads, to a content-addressed store in the experiment directory
+(``plans/<hash[:2]>/<hash>.plan``), so that every distinct plan is stored once, and sets the
+``plan_hash`` attribute of the run (see :func:`store_plan` and :func:`load_plan`).
+
+The validation step (see :meth:`~fslab.experiment.FSExperiment.add_validation_step`) collects the
+(domain, problem, plan) triples of all runs, identified by the hashes of the files, and validates
+each distinct triple once, in parallel. The verdicts are kept in a cache in the user's cache
+directory, so that the same plans found by later experiments (e.g. for other revisions) are not
+validated again. The step writes the attributes ``plan_valid`` (0 or 1) and ``plan_cost`` into the
+properties of the runs, including the runs that have been packed into the archive of the
+experiment (see :mod:`fslab.archive`).
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+import re
+import subprocess
+from glob import glob
+
+from lab import tools
+
+from .archive import RunArchive, has_archive
+from .suites import get_file_hash
+
+
+PLAN_DIRNAME = 'plans'
+DEFAULT_VALIDATOR = 'validate'
+DEFAULT_TIMEOUT = 600  # in seconds
+
+ACTION_PATTERN = re.compile(r'^\s*([^\s(]+)\s*\((.*)\)\s*$')
+COST_PATTERN = re.compile(r'^Final value: (\S+)', re.M)
+
+
+def get_default_cache_file():
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache'))
+    return os.path.join(cache_dir, 'fslab', 'plan-verdicts.json')
+
+
+def get_plan_file(plan_dir, plan_hash):
+    return os.path.join(plan_dir, plan_hash[:2], plan_hash + '.plan')
+
+
+def format_action(action):
+    """ Return the action as VAL expects it, e.g. "(move a b)" for "move(a, b)" and "move a b". """
+    action = action.strip()
+    if action.startswith('('):
+        return action
+    match = ACTION_PATTERN.match(action)
+    if match:
+        name, args = match.groups()
+        action = ' '.join([name] + [arg.strip() for arg in args.split(',') if arg.strip()])
+    return '({})'.format(action)
+
+
+def store_plan(actions, props, run_dir='.'):
+    """
+    Called by the parser: store the plan with the given *actions* in the plan store of the
+    experiment and set the ``plan_hash`` of the run. If the run does not lie in an experiment
+    directory, the plan is kept in the properties.
+    """
+    content = ''.join(format_action(action) + '\n' for action in actions)
+    plan_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()
+    exp_dir = os.path.join(run_dir, '..', '..')
+    if not os.path.exists(os.path.join(exp_dir, 'runs-00001-00100')):
+        props['plan'] = ', '.join(actions)
+        return
+    plan_file = get_plan_file(os.path.join(exp_dir, PLAN_DIRNAME), plan_hash)
+    if not os.path.exists(plan_file):
+        tools.makedirs(os.path.dirname(plan_file))
+        tmp_file = '{}.{}.tmp'.format(plan_file, os.getpid())
+        tools.write_file(tmp_file, content)
+        os.replace(tmp_file, plan_file)
+    props['plan_hash'] = plan_hash
+
+
+def load_plan(exp_dir, plan_hash):
+    """ Return the actions of the plan with the given hash. """
+    with open(get_plan_file(os.path.join(exp_dir, PLAN_DIRNAME), plan_hash)) as f:
+        return f.read().splitlines()
+
+
+def run_validator(validator, domain_file, problem_file, plan_file, timeout=DEFAULT_TIMEOUT):
+    """
+    Validate the plan with VAL and return the verdict, a dictionary with the keys "valid" and
+    "cost", or None if VAL could not be run or did not finish in time.
+    """
+    try:
+        process = subprocess.run(
+            [validator, domain_file, problem_file, plan_file], stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as err:
+        logging.error('Could not validate {}: {}'.format(plan_file, err))
+        return None
+    valid = 'Plan valid' in process.stdout
+    match = COST_PATTERN.search(process.stdout)
+    cost = float(match.group(1)) if valid and match else None
+    if cost is not None and cost.is_integer():
+        cost = int(cost)
+    return {'valid': valid, 'cost': cost}
+
+
+class _VerdictCache(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.verdicts = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.filename):
+            return {}
+        with open(self.filename) as f:
+            return json.load(f)
+
+    def write(self):
+        # Keep the verdicts that other processes added in the meantime.
+        verdicts = self._load()
+        verdicts.update(self.verdicts)
+        tools.makedirs(os.path.dirname(self.filename))
+        tmp_file = '{}.{}.tmp'.format(self.filename, os.getpid())
+        tools.write_file(tmp_file, json.dumps(verdicts))
+        os.replace(tmp_file, self.filename)
+
+
+def validate_plans(exp_dir, validator=DEFAULT_VALIDATOR, processes=None, cache_file=None,
+                   timeout=DEFAULT_TIMEOUT):
+    """
+    Validate the plans of all runs in *exp_dir* that found one and write ``plan_valid`` and
+    ``plan_cost`` into their properties. See the module documentation.
+    """
+    plan_dir = os.path.join(exp_dir, PLAN_DIRNAME)
+    cache = _VerdictCache(cache_file or get_default_cache_file())
+    file_hashes = {}
+
+    def hash_file(path):
+        path = os.path.realpath(path)
+        if path not in file_hashes:
+            file_hashes[path] = get_file_hash(path)
+        return file_hashes[path]
+
+    runs = []
+    archived_runs = []
+    triples = {}
+
+    def add_run(props, domain_file, problem_file):
+        """ Return the key of the triple of the run, or None if it has no plan. """
+        plan_hash = props.get('plan_hash')
+        if plan_hash is None:
+            # No plan was found, or the run was parsed before plans were stored separately.
+            return None
+        key = '-'.join([hash_file(domain_file), hash_file(problem_file), plan_hash])
+        triples[key] = (domain_file, problem_file, get_plan_file(plan_dir, plan_hash))
+        return key
+
+    unpacked = set()
+    for run_dir in sorted(glob(os.path.join(exp_dir, 'runs-*-*', '*'))):
+        properties_file = os.path.join(run_dir, 'properties')
+        if not os.path.exists(properties_file):
+            continue
+        static_props = tools.Properties(filename=os.path.join(run_dir, 'static-properties'))
+        unpacked.add('-'.join(static_props['id']))
+        key = add_run(tools.Properties(filename=properties_file),
+                      os.path.join(run_dir, 'domain.pddl'), os.path.join(run_dir, 'problem.pddl'))
+        if key is not None:
+            runs.append((properties_file, key))
+
+    archive = RunArchive(exp_dir) if has_archive(exp_dir) else None
+    if archive is not None:
+        # Runs that are still unpacked take precedence over their archived copies (see FSFetcher).
+        for run_id in sorted(set(archive.runs) - unpacked):
+            key = add_run(archive.read_properties(run_id), archive.read_link(run_id, 'domain.pddl'),
+                          archive.read_link(run_id, 'problem.pddl'))
+            if key is not None:
+                archived_runs.append((run_id, key))
+
+    missing = [key for key in triples if key not in cache.verdicts]
+    logging.info('Found {} plans in {} runs, of which {} are not validated yet'.format(
+        len(triples), len(runs) + len(archived_runs), len(missing)))
+    with ThreadPoolExecutor(max_workers=processes or os.cpu_count()) as executor:
+        verdicts = executor.map(lambda key: run_validator(validator, *triples[key], timeout=timeout), missing)
+        for key, verdict in zip(missing, verdicts):
+            if verdict is not None:
+                cache.verdicts[key] = verdict
+    cache.write()
+
+    def set_verdict(props, key):
+        verdict = cache.verdicts[key]
+        props['plan_valid'] = int(verdict['valid'])
+        props['plan_cost'] = verdict['cost']
+
+    runs = [(properties_file, key) for properties_file, key in runs if key in cache.verdicts]
+    for properties_file, key in runs:
+        props = tools.Properties(filename=properties_file)
+        set_verdict(props, key)
+        props.write()
+    archived_runs = [(run_id, key) for run_id, key in archived_runs if key in cache.verdicts]
+    if archived_runs:
+        keys = dict(archived_runs)
+        archive.update_properties(keys, lambda run_id, props: set_verdict(props, keys[run_id]))
+
+    validated = len(runs) + len(archived_runs)
+    invalid = sum(not cache.verdicts[key]['valid'] for _, key in runs + archived_runs)
+    logging.info('Validated the plans of {} runs ({} invalid)'.format(validated, invalid))
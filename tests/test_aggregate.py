@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the running statistics of fslab.aggregate against lab's own aggregation functions.
+"""
+
+import sys
+
+import numpy as np
+import pytest
+
+from lab.reports import finite_sum, geometric_mean
+
+from fslab.aggregate import RunningStatistics
+
+
+VALUES = [3.0, 5.0, 0.5, 12.0, 7.25]
+
+
+def get_statistics(*batches):
+    """ Return the statistics of the given batches, each accumulated separately and then merged. """
+    stats = RunningStatistics()
+    for batch in batches:
+        batch_stats = RunningStatistics()
+        batch_stats.add_array(np.array(batch, dtype=np.float64))
+        stats.merge(batch_stats)
+    return stats
+
+
+@pytest.mark.parametrize('batches', [[VALUES], [VALUES[:2], VALUES[2:]]])
+def test_sum_and_geometric_mean(batches):
+    stats = get_statistics(*batches)
+    assert stats.get_value(sum) == pytest.approx(sum(VALUES))
+    assert stats.get_value(geometric_mean) == pytest.approx(geometric_mean(VALUES))
+    assert get_statistics([0.0] + VALUES).get_value(geometric_mean) == 0.0
+
+
+@pytest.mark.parametrize('batches', [
+    [[3.0, 5.0, sys.maxsize]],
+    [[3.0, sys.maxsize], [5.0], [sys.maxsize]],
+    [VALUES + [sys.maxsize] * 3],
+])
+def test_finite_sum_ignores_infinite_values(batches):
+    values = [value for batch in batches for value in batch]
+    stats = get_statistics(*batches)
+    assert stats.get_value(finite_sum) == finite_sum(values)
+    assert stats.get_value(sum) == pytest.approx(sum(values))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end test of an experiment executed by the AsyncLocalEnvironment, with the planner stand-in
+of the benchmarks.
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from pipeline import make_benchmarks, make_planner_repo  # noqa: E402
+
+from fslab.async_call import AsyncCall  # noqa: E402
+from fslab.async_driver import MemoryBudget, execute_run  # noqa: E402
+
+
+EXPERIMENT_SCRIPT = """
+import os
+
+import fslab
+from fslab.environments import AsyncLocalEnvironment
+from fslab.experiment import FSExperiment
+
+base = {base!r}
+exp = FSExperiment(
+    path=os.path.join(base, 'exp'), environment=AsyncLocalEnvironment(processes=3),
+    revision_cache=os.path.join(base, 'revision-cache'), time_limit=60, memory_limit=2048,
+    log_compression={log_compression!r})
+exp.add_suite(os.path.join(base, 'benchmarks'), {domains!r})
+for index in range(2):
+    exp.add_algorithm('algo{{}}'.format(index), os.path.join(base, 'repo'), 'HEAD',
+                      ['--seed', str(index), '--plan-length', '3'])
+exp.add_parser(os.path.join(os.path.dirname(fslab.__file__), 'fsparser.py'))
+exp.add_step('build', exp.build)
+exp.add_step('start', exp.start_runs)
+exp.add_fetcher(write_properties=True)
+exp.run_steps()
+"""
+
+
+# With log compression, the driver executes the run scripts instead of the commands.
+@pytest.fixture(params=[None, 'gzip'])
+def experiment(tmp_path, request):
+    base = str(tmp_path)
+    make_planner_repo(os.path.join(base, 'repo'))
+    domains = make_benchmarks(os.path.join(base, 'benchmarks'), num_tasks=3, num_domains=1)
+    script = os.path.join(base, 'experiment.py')
+    with open(script, 'w') as f:
+        f.write(EXPERIMENT_SCRIPT.format(base=base, domains=domains, log_compression=request.param))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(ROOT, 'src'), os.environ.get('PYTHONPATH', '')]))
+    subprocess.check_call([sys.executable, script, 'build', 'start', '3'], cwd=base, env=env)
+    return base
+
+
+def test_runs_are_parsed(experiment):
+    with open(os.path.join(experiment, 'exp-eval', 'properties')) as f:
+        props = json.load(f)
+    assert len(props) == 6
+    for run in props.values():
+        assert not run.get('unexplained_errors')
+        assert run['node']
+        assert 'coverage' in run
+
+
+def test_output_limit_of_exited_command(tmp_path):
+    # The command has usually exited by the time its output exceeds the hard limit.
+    stdout = str(tmp_path / 'run.log')
+    for _ in range(5):
+        call = AsyncCall(['/bin/sh', '-c', 'head -c 60000 /dev/zero'], 'planner', hard_stdout_limit=10,
+                         stdout=stdout)
+        assert asyncio.run(call.run()) in (0, -15)
+        assert os.path.getsize(stdout) <= 10 * 1024
+        os.remove(stdout)
+
+
+@pytest.mark.parametrize('enforce_output_limits', [False, True])
+def test_output_limits_are_opt_in(tmp_path, enforce_output_limits):
+    command = {'name': 'planner', 'args': ['/bin/sh', '-c', 'head -c 60000 /dev/zero'],
+               'kwargs': {'name': 'planner', 'soft_stdout_limit': 5, 'hard_stdout_limit': 10}}
+    (tmp_path / 'commands.json').write_text(json.dumps(
+        {'commands': [command], 'log_compression': None, 'escalation': False}))
+
+    async def run():
+        return await execute_run(str(tmp_path), MemoryBudget(float('inf')), enforce_output_limits)
+    failed = asyncio.run(run())
+    assert os.path.getsize(str(tmp_path / 'run.log')) == (10 * 1024 if enforce_output_limits else 60000)
+    assert failed == enforce_output_limits
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end test of an experiment with escalating time limits, with the planner stand-in of the
+benchmarks.
+"""
+
+from glob import glob
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from pipeline import make_benchmarks, make_planner_repo  # noqa: E402
+
+
+# The "slow" algorithm times out with the initial time limit of 1 second and solves the tasks with
+# the time limit of the second round.
+EXPERIMENT_SCRIPT = """
+import os
+
+import fslab
+from fslab.experiment import FSExperiment
+from lab.environments import LocalEnvironment
+
+base = {base!r}
+exp = FSExperiment(
+    path=os.path.join(base, 'exp'), environment=LocalEnvironment(processes=1),
+    revision_cache=os.path.join(base, 'revision-cache'), initial_time_limit=1, time_limit=4,
+    memory_limit=2048)
+exp.add_suite(os.path.join(base, 'benchmarks'), {domains!r})
+for name, cpu_time in [('fast', '0'), ('slow', '2')]:
+    exp.add_algorithm(name, os.path.join(base, 'repo'), 'HEAD',
+                      ['--plan-length', '3', '--solved-fraction', '1', '--cpu-time', cpu_time])
+exp.add_parser(os.path.join(os.path.dirname(fslab.__file__), 'fsparser.py'))
+exp.add_step('build', exp.build)
+exp.add_step('start', exp.start_runs)
+exp.add_escalation_steps()
+exp.run_steps()
+"""
+
+
+def read_run(run_dir):
+    with open(os.path.join(run_dir, 'static-properties')) as f:
+        algorithm = json.load(f)['algorithm']
+    with open(os.path.join(run_dir, 'properties')) as f:
+        props = json.load(f)
+    with open(os.path.join(run_dir, 'run.log')) as f:
+        return algorithm, props, f.read()
+
+
+def test_finished_runs_keep_their_output(tmp_path):
+    base = str(tmp_path)
+    make_planner_repo(os.path.join(base, 'repo'))
+    domains = make_benchmarks(os.path.join(base, 'benchmarks'), num_tasks=2, num_domains=1)
+    script = os.path.join(base, 'experiment.py')
+    with open(script, 'w') as f:
+        f.write(EXPERIMENT_SCRIPT.format(base=base, domains=domains))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(ROOT, 'src'), os.environ.get('PYTHONPATH', '')]))
+
+    def run_steps(*steps):
+        subprocess.check_call([sys.executable, script] + list(steps), cwd=base, env=env)
+
+    run_steps('build', 'start')
+    run_dirs = sorted(glob(os.path.join(base, 'exp', 'runs-*-*', '*')))
+    first_round = {run_dir: read_run(run_dir) for run_dir in run_dirs}
+    solved = [run_dir for run_dir, (_, props, _) in first_round.items() if props.get('coverage')]
+    assert {first_round[run_dir][0] for run_dir in solved} == {'fast'}
+    assert 'Number of state variables' in first_round[solved[0]][2]
+
+    run_steps('escalate-round-1', 'start-round-1')
+    for run_dir in run_dirs:
+        _, props, run_log = read_run(run_dir)
+        assert props['coverage'] == 1
+        if run_dir in solved:
+            assert run_log == first_round[run_dir][2]
+            assert props['escalation_round'] == 0
+        else:
+            assert props['escalation_round'] == 1
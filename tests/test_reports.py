@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the reports on algorithms whose names sort differently lexicographically ("rev10" <
+"rev9") and naturally ("rev9" < "rev10").
+"""
+
+import os
+
+from lab import tools
+import numpy as np
+
+from fslab.relativescatter import RelativeScatterPlotReport
+from fslab.reports import FSPhaseReport
+
+
+ALGORITHMS = ['rev9', 'rev10']
+
+
+def write_eval_dir(path, values):
+    """ Write the runs with the given attribute *values* of each algorithm on two tasks. """
+    props = tools.Properties(filename=os.path.join(path, 'properties'))
+    for problem in ['p1.pddl', 'p2.pddl']:
+        for algorithm in ALGORITHMS:
+            run = {'id': [algorithm, 'domain', problem], 'algorithm': algorithm, 'domain': 'domain',
+                   'problem': problem, 'coverage': 1}
+            run.update(values[algorithm])
+            props['-'.join(run['id'])] = run
+    props.write()
+    return path
+
+
+def scan_runs(report, eval_dir):
+    """ Load the runs of *eval_dir* into *report* as lab does before writing it. """
+    report.eval_dir = eval_dir
+    report._load_data()
+    report._apply_filter()
+    report._scan_data()
+    # The runs of each task follow the order of the run IDs, as in the properties file.
+    for runs in report.problem_runs.values():
+        runs.sort(key=lambda run: '-'.join(run['id']))
+    return report
+
+
+def test_phase_report_attributes_totals_to_algorithms(tmp_path):
+    eval_dir = write_eval_dir(str(tmp_path), {
+        'rev9': {'phase_search_cpu': 1.0}, 'rev10': {'phase_search_cpu': 3.0}})
+    report = scan_runs(FSPhaseReport(
+        attributes=['phase_search_cpu'], filter_algorithm=ALGORITHMS, algorithm_pairs=[('rev9', 'rev10')]),
+        eval_dir)
+    table = report._get_table('cpu', 'CPU time (s)')
+    assert table['search']['rev9'] == 2.0
+    assert table['search']['rev10'] == 6.0
+    assert table['search']['Change % (rev10 vs. rev9)'] == 200.0
+
+
+def test_relative_scatter_plot_aligns_values_with_algorithms(tmp_path):
+    eval_dir = write_eval_dir(str(tmp_path), {
+        'rev9': {'search_time': 2.0}, 'rev10': {'search_time': 8.0}})
+    report = scan_runs(RelativeScatterPlotReport(
+        attributes=['search_time'], filter_algorithm=ALGORITHMS), eval_dir)
+    _, x, y = report._get_aligned_values()
+    assert list(x) == [2.0, 2.0]
+    assert list(y) == [8.0, 8.0]
+    categories = report._fill_categories()
+    ratios = np.concatenate([ratios for _, ratios in categories.values()])
+    assert list(ratios) == [4.0, 4.0]